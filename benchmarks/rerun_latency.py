@@ -0,0 +1,239 @@
+# benchmarks/rerun_latency.py
+"""
+Headless rerun-latency benchmarks for the home, admin and doctor pages.
+
+    python -m benchmarks.rerun_latency --scales hero,10000,100000 --out bench.json
+    python -m benchmarks.rerun_latency compare before.json after.json
+
+Each (scale, page) pair runs in a fresh subprocess so "cold" really is the first render
+of a new server process. Pages are driven through Streamlit's AppTest harness with
+dashboard.py as the entry point, and every scenario records wall time per rerun plus
+the process's peak RSS. Scales other than "hero" (curated hero patients only, empty
+clinical store) are synthetic populations built once under --work-dir with
+utils.synthetic_population, ingested, risk-scored and loaded into a per-patient
+insight store.
+
+Scenarios:
+  cold            first render in a new process
+  warm            identical rerun (no widget change)
+  tab_switch      select each tab in turn (admin, doctor)
+  patient_switch  select a different patient from the current search page (doctor)
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from loguru import logger
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, "dashboard.py")
+PAGES = ["home", "admin", "doctor"]
+ADMIN_TABS = ["📊 Executive Overview", "⚠️ Risk Stratification", "🔁 Care Coordination",
+              "💰 Cost & Insurance Intelligence", "🔮 Predictive & What-If Analytics", "🧠 AI Strategy Console"]
+DOCTOR_TABS = ["Patient Overview", "Clinical Risk & Predictions", "Care Gaps & Coordination",
+               "Cost & Coverage Impact", "AI Clinical Co-Pilot"]
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _timed(at, timeout):
+    started = time.perf_counter()
+    at.run(timeout=timeout)
+    elapsed = time.perf_counter() - started
+    if at.exception:
+        raise RuntimeError(f"App raised: {at.exception[0].value}")
+    return elapsed
+
+
+def _result(scale, page, scenario, seconds):
+    ms = np.array(seconds) * 1000
+    return {
+        "scale": scale, "page": page, "scenario": scenario, "runs": len(ms),
+        "median_ms": round(float(np.median(ms)), 2), "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "min_ms": round(float(ms.min()), 2), "max_ms": round(float(ms.max()), 2),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_page(scale, page, repeats, timeout):
+    """Benchmark one page in this process; returns a list of result rows."""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP, default_timeout=timeout)
+    if page != "home":
+        at.session_state["user_role"] = page
+    results = [_result(scale, page, "cold", [_timed(at, timeout)])]
+    results.append(_result(scale, page, "warm", [_timed(at, timeout) for _ in range(repeats)]))
+
+    tabs = {"admin": ADMIN_TABS, "doctor": DOCTOR_TABS}.get(page)
+    if tabs:
+        seconds = []
+        for _ in range(max(1, repeats // len(tabs))):
+            for label in tabs[1:] + tabs[:1]:
+                at.session_state[f"{page}_tab"] = label
+                seconds.append(_timed(at, timeout))
+        results.append(_result(scale, page, "tab_switch", seconds))
+
+    if page == "doctor":
+        from utils.patient_search import get_patient_search
+        page_rows, _ = get_patient_search().search("", page=0)
+        pids = list(page_rows["patient_id"])[:repeats + 1]
+        seconds = []
+        for pid in pids[1:] + pids[:1]:
+            at.session_state["patient_id"] = pid
+            seconds.append(_timed(at, timeout))
+        results.append(_result(scale, page, "patient_switch", seconds))
+    return results
+
+
+def prepare_scale(scale, work_dir, seed):
+    """
+    Clinical store directory for a scale (built on first use); an empty one for "hero".
+    Per-patient insight records live next to it in patient_insights/.
+    """
+    if scale == "hero":
+        store = os.path.join(work_dir, "hero", "store")
+        os.makedirs(store, exist_ok=True)
+        return store
+    from utils.synthetic_population import generate
+    from utils.ingest import ingest
+    from utils.patient_insights import PatientInsightStore, read_records
+    from utils.risk_engine import run as score
+    from utils.care_gaps import run as detect_gaps
+    from utils.continuity import run as continuity
+    from utils.cohort_cube import run as build_cube
+
+    n = int(scale)
+    base = os.path.join(work_dir, str(n))
+    raw, store = os.path.join(base, "raw"), os.path.join(base, "store")
+    if not os.path.exists(os.path.join(store, "derived", "risk_scores.arrow")):
+        logger.info(f"Building {n:,}-patient benchmark population under {base}")
+        generate(base, n, seed)
+        ingest(raw, store, rebuild=True)
+        score(store, publish=False)
+        insights = PatientInsightStore(os.path.join(base, "patient_insights"))
+        for path in sorted(glob.glob(os.path.join(base, "insights", "*.jsonl"))):
+            insights.put_many(read_records(path))
+        insights.merge()
+    if not os.path.exists(os.path.join(store, "derived", "care_gaps.arrow")):
+        detect_gaps(store, publish=False)
+    if not os.path.exists(os.path.join(store, "derived", "coverage_continuity.arrow")):
+        continuity(store, publish=False)
+    if not os.path.exists(os.path.join(store, "derived", "cohort_cube.arrow")):
+        build_cube(store, publish=False)
+    return store
+
+
+def worker(args):
+    results = run_page(args.scale, args.page, args.repeats, args.timeout)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_suite(args):
+    scales = [s.strip() for s in args.scales.split(",") if s.strip()]
+    pages = [p.strip() for p in args.pages.split(",") if p.strip()]
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeats": args.repeats,
+            "lazy_tabs": os.getenv("LAZY_TABS", "1"),
+        },
+        "results": [],
+    }
+    for scale in scales:
+        store = prepare_scale(scale, args.work_dir, args.seed)
+        for page in pages:
+            with tempfile.TemporaryDirectory() as tmp:
+                out = os.path.join(tmp, "result.json")
+                env = dict(os.environ, CLINICAL_STORE_DIR=os.path.abspath(store),
+                           PATIENT_INSIGHTS_DIR=os.path.join(os.path.dirname(os.path.abspath(store)), "patient_insights"),
+                           LOG_PATH=os.path.join(tmp, "app.log"), LLM_CACHE_PATH=os.path.join(tmp, "llm.sqlite"))
+                command = [sys.executable, "-m", "benchmarks.rerun_latency", "worker", "--scale", scale,
+                           "--page", page, "--repeats", str(args.repeats), "--timeout", str(args.timeout), "--out", out]
+                subprocess.run(command, cwd=ROOT, env=env, check=True)
+                with open(out, "r", encoding="utf-8") as f:
+                    rows = json.load(f)
+            for row in rows:
+                logger.info(f"{scale:>8} {page:<6} {row['scenario']:<15} median {row['median_ms']:>9.1f} ms  "
+                            f"p95 {row['p95_ms']:>9.1f} ms  peak RSS {row['peak_rss_mb']:>7.1f} MB")
+            report["results"].extend(rows)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Wrote {len(report['results'])} results to {args.out}")
+
+
+def compare(args):
+    """Print median/peak-RSS ratios of `after` relative to `before` for matching rows."""
+    with open(args.before, "r", encoding="utf-8") as f:
+        before = {(r["scale"], r["page"], r["scenario"]): r for r in json.load(f)["results"]}
+    with open(args.after, "r", encoding="utf-8") as f:
+        after = json.load(f)["results"]
+    print(f"{'scale':>8} {'page':<6} {'scenario':<15} {'before ms':>10} {'after ms':>10} {'ratio':>7} {'RSS ratio':>9}")
+    for row in after:
+        old = before.get((row["scale"], row["page"], row["scenario"]))
+        if old is None:
+            continue
+        ratio = row["median_ms"] / old["median_ms"] if old["median_ms"] else float("nan")
+        rss = row["peak_rss_mb"] / old["peak_rss_mb"] if old["peak_rss_mb"] else float("nan")
+        print(f"{row['scale']:>8} {row['page']:<6} {row['scenario']:<15} {old['median_ms']:>10.1f} "
+              f"{row['median_ms']:>10.1f} {ratio:>7.2f} {rss:>9.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless rerun-latency benchmarks (Streamlit AppTest).")
+    commands = parser.add_subparsers(dest="command")
+
+    compare_cmd = commands.add_parser("compare", help="Compare two result files")
+    compare_cmd.add_argument("before")
+    compare_cmd.add_argument("after")
+    work = commands.add_parser("worker", help=argparse.SUPPRESS)
+    work.add_argument("--scale", required=True)
+    work.add_argument("--page", required=True, choices=PAGES)
+    work.add_argument("--out", required=True)
+    for p in (parser, work):
+        p.add_argument("--repeats", type=int, default=10, help="Reruns per warm / switch scenario")
+        p.add_argument("--timeout", type=float, default=300, help="Seconds allowed per rerun")
+    parser.add_argument("--scales", default="hero,10000,100000,1000000",
+                        help="Comma-separated: hero and/or patient counts")
+    parser.add_argument("--pages", default=",".join(PAGES))
+    parser.add_argument("--work-dir", default=os.path.join(ROOT, "benchmarks", ".work"),
+                        help="Where synthetic populations are generated and cached")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench.json")
+    args = parser.parse_args(argv)
+
+    if args.command == "worker":
+        worker(args)
+    elif args.command == "compare":
+        compare(args)
+    else:
+        run_suite(args)
+
+
+if __name__ == "__main__":
+    main()
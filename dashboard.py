@@ -3,17 +3,22 @@ from dotenv import load_dotenv
 from loguru import logger
 import os
 
+from utils.startup import first_paint, prewarm
 from utils.styles import inject_css
+from utils.logging_setup import configure_logging, render_context
+from utils.telemetry import start_metrics_server
 from pages.home import render_home
-from pages.admin import render_admin_dashboard
-from pages.doctor import render_doctor_dashboard
+# pages.admin / pages.doctor (plotly, pandas, the clinical store) are imported when first
+# rendered; prewarm() loads them in the background once the login page is up.
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logger.add("logs/app.log", rotation="1 MB", level="DEBUG", 
-           format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {file}:{line} | {message}")
+# Configure logging (installed once per process; this script re-runs on every interaction)
+configure_logging()
+
+# Prometheus /metrics endpoint, when TELEMETRY_PORT is set (once per process)
+start_metrics_server()
 
 # Streamlit page configuration
 st.set_page_config(page_title="Clinical Intelligence Platform", layout="wide", initial_sidebar_state="expanded")
@@ -22,14 +27,21 @@ st.set_page_config(page_title="Clinical Intelligence Platform", layout="wide", i
 inject_css()
 
 def main():
-    logger.info("Dashboard launched")
-    
-    if "user_role" not in st.session_state:
-        render_home()
-    elif st.session_state.user_role == "admin":
-        render_admin_dashboard()
-    elif st.session_state.user_role == "doctor":
-        render_doctor_dashboard()
+    with render_context():
+        if "session_started" not in st.session_state:
+            st.session_state.session_started = True
+            logger.info("Dashboard launched")
+
+        if "user_role" not in st.session_state:
+            render_home()
+            prewarm()
+        elif st.session_state.user_role == "admin":
+            from pages.admin import render_admin_dashboard
+            render_admin_dashboard()
+        elif st.session_state.user_role == "doctor":
+            from pages.doctor import render_doctor_dashboard
+            render_doctor_dashboard()
+        first_paint()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
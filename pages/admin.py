@@ -1,125 +1,256 @@
+import os
+from itertools import chain
 import streamlit as st
 import pandas as pd
-from utils.styles import section_header, metric_card, ai_insight_box
-from utils.charts import risk_distribution_chart, cost_treemap_chart, equity_heatmap_chart, care_flow_sankey, hospitalization_scatter
-from utils.services import get_insight, derive_insight_via_agents
+from utils.styles import section_header, metric_card, ai_insight_box, render_tabs, show_dataframe
+from utils.charts import risk_distribution_chart, cost_treemap_chart, equity_heatmap_chart, care_flow_sankey, hospitalization_scatter, what_if_band_chart
+from utils.services import get_insight, stream_insights_via_agents
+from utils.care_flow import get_care_flow_index
+from utils.care_gaps import get_care_gap_table
+from utils.clinical_store import get_clinical_store
+from utils.cohort_cube import DIMENSION_LABELS, METRICS, get_cohort_cube
+from utils.continuity import get_continuity
+from utils.what_if import HORIZON_MONTHS, get_what_if_simulator
+from utils.telemetry import get_recorder
+from utils.figure_cache import get_figure_cache
+from utils.insight_store import get_insight_store
+from utils.patient_repository import get_patient_repository
+from utils.derivation import get_derivation_service
 
-def render_admin_dashboard():
-    # Logout in sidebar
-    with st.sidebar:
-        if st.button("Logout"):
-            del st.session_state.user_role
-            st.rerun()
+# TAB 1 — Executive Overview
+def _overview_tab():
+    section_header("Executive Overview – Why the system is under stress")
+    ai_insight_box("AI Executive Brief", get_insight("admin_data", "ai_executive_brief"))
 
-    st.markdown("## 🏥 Hospital Intelligence – Admin View")
-    st.markdown("Population-level clinical intelligence derived from longitudinal records. All insights are de-identified and HIPAA-safe.")
+    cols = st.columns(4)
+    metrics = get_insight("admin_data", "key_metrics")
+    cols[0].metric("Patients Analyzed", metrics["patients_analyzed"])
+    cols[1].metric("High-Risk Cohort", f"~{metrics['high_risk_percentage']}%")
+    cols[2].metric("Avoidable Cost Index", metrics["avoidable_cost_index"])
+    cols[3].metric("AI Confidence", metrics["ai_confidence"])
 
-    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
-        "📊 Executive Overview",
-        "⚠️ Risk Stratification",
-        "🔁 Care Coordination",
-        "💰 Cost & Insurance Intelligence",
-        "🔮 Predictive & What-If Analytics",
-        "🧠 AI Strategy Console"
-    ])
+    st.plotly_chart(risk_distribution_chart(get_insight("admin_data", "risk_distribution")), use_container_width=True)
+    cost_share = metrics.get("high_risk_cost_share")
+    if cost_share is None:
+        st.caption(f"**Interpretation:** {metrics['high_risk_percentage']}% of patients fall in the High Risk cohort.")
+    elif cost_share > 50:
+        st.caption(f"**Interpretation:** The {metrics['high_risk_percentage']}% High Risk cohort accounts for {cost_share}% of encounter spend. Focusing interventions here yields the highest ROI.")
+    else:
+        st.caption(f"**Interpretation:** The {metrics['high_risk_percentage']}% High Risk cohort accounts for {cost_share}% of encounter spend.")
+    st.caption("*Note: Avoidable Cost Index represents the ratio of costs associated with potentially preventable events (e.g., emergency visits for chronic conditions) to total care costs. A score > 0.5 indicates significant opportunity for savings.*")
 
-    # TAB 1 — Executive Overview
-    with tab1:
-        section_header("Executive Overview – Why the system is under stress")
-        ai_insight_box("AI Executive Brief", get_insight("admin_data", "ai_executive_brief"))
+# TAB 2 — Risk Stratification
+def _risk_tab():
+    section_header("Risk Stratification – From populations to priorities")
+    ai_insight_box("AI Root Cause Insight", get_insight("admin_data", "ai_root_cause_insight"))
 
-        cols = st.columns(4)
-        metrics = get_insight("admin_data", "key_metrics")
-        cols[0].metric("Patients Analyzed", metrics["patients_analyzed"])
-        cols[1].metric("High-Risk Cohort", f"~{metrics['high_risk_percentage']}%")
-        cols[2].metric("Avoidable Cost Index", metrics["avoidable_cost_index"])
-        cols[3].metric("AI Confidence", metrics["ai_confidence"])
+    cube = get_cohort_cube()
+    if cube is None:
+        st.subheader("Risk Ownership Lens")
+        show_dataframe(get_insight("admin_data", "risk_ownership_lens"), "risk_ownership_lens")
+        st.plotly_chart(equity_heatmap_chart(), use_container_width=True)
+        st.caption("**Interpretation:** Darker areas indicate compounding risk factors. Urban and Hispanic cohorts show higher instability, suggesting that social determinants and insurance churn are amplifying clinical risk in these groups.")
+    else:
+        # Every interaction below is a slice of the precomputed cohort cube, not a patient scan.
+        dims = cube.dimensions()
+        with st.expander("Drill down by cohort"):
+            cols = st.columns(4)
+            filters = {}
+            for i, dim in enumerate(dims):
+                chosen = cols[i % 4].multiselect(DIMENSION_LABELS[dim], cube.labels(dim), key=f"cube_filter_{dim}")
+                if chosen:
+                    filters[dim] = chosen
 
-        st.plotly_chart(risk_distribution_chart(get_insight("admin_data", "risk_distribution")), use_container_width=True)
-        st.caption("**Interpretation:** The 19% High Risk cohort drives the majority of resource intensity. Focusing interventions here yields the highest ROI.")
-        st.caption("*Note: Avoidable Cost Index represents the ratio of costs associated with potentially preventable events (e.g., emergency visits for chronic conditions) to total care costs. A score > 0.5 indicates significant opportunity for savings.*")
+        st.subheader("Risk Ownership Lens")
+        show_dataframe(cube.ownership_lens(filters), "risk_ownership_lens", use_container_width=True, hide_index=True)
 
-    # TAB 2 — Risk Stratification
-    with tab2:
-        section_header("Risk Stratification – From populations to priorities")
-        ai_insight_box("AI Root Cause Insight", get_insight("admin_data", "ai_root_cause_insight"))
+        cols = st.columns(3)
+        rows = cols[0].selectbox("Rows", dims, index=dims.index("race"), format_func=DIMENSION_LABELS.get, key="cube_rows")
+        columns = cols[1].selectbox("Columns", dims, index=dims.index("setting"), format_func=DIMENSION_LABELS.get, key="cube_columns")
+        metric = cols[2].selectbox("Measure", list(METRICS), key="cube_metric")
+        matrix = cube.pivot(rows, columns, metric, filters)
+        matrix.index.name, matrix.columns.name = DIMENSION_LABELS[rows], DIMENSION_LABELS.get(columns, columns)
+        st.plotly_chart(equity_heatmap_chart(matrix, metric), use_container_width=True)
+        if matrix.notna().any().any():
+            column = matrix.max().idxmax()
+            row = matrix[column].idxmax()
+            cohort = row if rows == columns else f"{row} × {column}"
+            overall = cube.aggregate((), filters)[metric].iloc[0]
+            st.caption(f"**Interpretation:** Darker cells mark higher {metric}. The highest is {cohort} at {matrix.at[row, column]:,.2f}, "
+                       f"against {overall:,.2f} across all selected patients.")
 
-        st.subheader("Risk Ownership Lens")
-        st.dataframe(get_insight("admin_data", "risk_ownership_lens"))
+# TAB 3 — Care Coordination
+def _care_coordination_tab():
+    section_header("Care Coordination – Where the system breaks")
+    ai_insight_box("AI Care Breakdown Prediction", get_insight("admin_data", "ai_care_breakdown_prediction"))
+    ai_insight_box("AI Failure Pattern Insight", get_insight("admin_data", "ai_failure_pattern_insight"))
 
-        st.plotly_chart(equity_heatmap_chart(get_insight("admin_data", "equity_heatmap")["disparities"]), use_container_width=True)
-        st.caption("**Interpretation:** Darker areas indicate compounding risk factors. Urban and Hispanic cohorts show higher instability, suggesting that social determinants and insurance churn are amplifying clinical risk in these groups.")
+    flow_index = get_care_flow_index()
+    if flow_index is not None and len(flow_index):
+        first, last = flow_index.date_range()
+        cols = st.columns([2, 1])
+        window = cols[0].date_input("Encounter window", value=(first, last), min_value=first, max_value=last)
+        cohort = cols[1].selectbox("Cohort", flow_index.cohorts())
+        # date_input returns a 1-tuple while the user is mid-way through picking a range.
+        start, end = (tuple(window) + (last,))[:2] if isinstance(window, (list, tuple)) else (window, last)
+        flow = flow_index.flows(start, end, cohort)
+    else:
+        flow = get_insight("admin_data", "care_flow")
+    st.plotly_chart(care_flow_sankey(flow if isinstance(flow, dict) else None), use_container_width=True)
+    st.caption("**Interpretation:** The flow thickness represents patient volume. Note the significant diversion from Primary Care to Emergency, bypassing Specialists—a hallmark of fragmented coordination.")
 
-    # TAB 3 — Care Coordination
-    with tab3:
-        section_header("Care Coordination – Where the system breaks")
-        ai_insight_box("AI Care Breakdown Prediction", get_insight("admin_data", "ai_care_breakdown_prediction"))
-        ai_insight_box("AI Failure Pattern Insight", get_insight("admin_data", "ai_failure_pattern_insight"))
-
-        st.plotly_chart(care_flow_sankey(), use_container_width=True)
-        st.caption("**Interpretation:** The flow thickness represents patient volume. Note the significant diversion from Primary Care to Emergency, bypassing Specialists—a hallmark of fragmented coordination.")
-
-    # TAB 4 — Cost & Insurance Intelligence
-    with tab4:
-        section_header("Cost & Insurance Intelligence – The hidden engine of risk")
-        ai_insight_box("AI Financial Leakage Insight", get_insight("admin_data", "ai_financial_leakage_insight"))
-
-        cost_data = get_insight("admin_data", "cost_treemap_data")
-        st.plotly_chart(cost_treemap_chart(cost_data["labels"], cost_data["values"]), use_container_width=True)
-        st.caption("**Interpretation:** Medications are the primary cost driver, followed by Encounters. The high medication spend relative to outcomes suggests adherence issues or lack of generic utilization.")
-
-        st.metric("Avoidable Cost Index", get_insight("admin_data", "avoidable_cost_index"))
-        st.caption("*Note: Avoidable Cost Index (0.68) indicates that nearly 68% of acute costs could be mitigated through better upstream preventive care and coordination.*")
-
-    # TAB 5 — Predictive & What-If Analytics
-    with tab5:
-        section_header("Predictive & What-If Analytics – Futures, not reports")
-        ai_insight_box("AI Forecast", get_insight("admin_data", "ai_forecast"))
-        ai_insight_box("Counterfactual Intelligence", get_insight("admin_data", "counterfactual_intelligence"))
-
-        #st.plotly_chart(hospitalization_scatter(get_insight("admin_data", "hospitalization_risk_distribution")), use_container_width=True)
-        #st.caption("**Interpretation:** Higher risk scores correlate with age, but significant variance exists. Young patients with high risk scores (outliers) represent the 'Preventive Failure' archetype.")
-
-    # TAB 6 — AI Strategy Console
-    with tab6:
-        section_header("AI Strategy Console – Why this is scalable AI")
-        prompts = get_insight("admin_data", "pre_loaded_prompts")
-        for prompt in prompts:
-            with st.expander(prompt):
-                st.write("AI Response: " + derive_insight_via_agents(prompt))  # Simulated or real
-
-        ai_gov = get_insight("admin_data", "ai_governance")
-        st.subheader("AI Governance & Trust Panel")
-        for key, value in ai_gov.items():
-            st.markdown(f"- **{key.capitalize()}**: {value}")
-
-        with st.expander("Confidence & Limitations"):
-            conf_lim = get_insight("doctor", "confidence_and_limitations")
-            if isinstance(conf_lim, dict):  # Check if dict
-                st.subheader("Confidence")
-                for c in conf_lim.get("confidence", []):
-                    st.markdown(f"- {c}")
-                st.subheader("Limitations")
-                for l in conf_lim.get("limitations", []):
-                    st.markdown(f"- {l}")
-                st.caption(conf_lim.get("disclaimer", ""))
-            else:
-                st.write("Confidence data not available.")
-
-        st.subheader("Hero Insights")
-        hero_insights = get_insight("admin_data", "ai_alerts")
-        if isinstance(hero_insights, list):
-            for alert in hero_insights:
-                ai_insight_box("Strategic Alert", alert)
-        else:
-            st.write("Hero insights data not available.")
-
-        agent_fn = get_insight("doctor", "agent_footnote")
-        st.subheader("Agent Footnote")
-        if isinstance(agent_fn, dict):  # Check if dict
-            st.write(f"Agents Involved: {agent_fn.get('agents_involved', 'Not available')}")
-            st.write(f"Datasets Analyzed: {agent_fn.get('datasets_analyzed', 'Not available')}")
-            st.write(f"Population Context: {agent_fn.get('population_context', 'Not available')}")
-            st.dataframe(pd.DataFrame(agent_fn.get("agent_details", [])))
+    gaps = get_care_gap_table()
+    if gaps is not None:
+        st.subheader("Care Gap Rates")
+        show_dataframe(gaps.rates(), "care_gap_rates", use_container_width=True, hide_index=True)
+        st.caption("Share of eligible patients overdue for each guideline, from the same care-gap run that feeds the doctor view's Detected Care Gaps.")
+
+# TAB 4 — Cost & Insurance Intelligence
+def _cost_tab():
+    section_header("Cost & Insurance Intelligence – The hidden engine of risk")
+    ai_insight_box("AI Financial Leakage Insight", get_insight("admin_data", "ai_financial_leakage_insight"))
+
+    cost_data = get_insight("admin_data", "cost_treemap_data")
+    st.plotly_chart(cost_treemap_chart(cost_data["labels"], cost_data["values"]), use_container_width=True)
+    st.caption("**Interpretation:** Medications are the primary cost driver, followed by Encounters. The high medication spend relative to outcomes suggests adherence issues or lack of generic utilization.")
+
+    avoidable = get_insight("admin_data", "avoidable_cost_index")
+    st.metric("Avoidable Cost Index", avoidable)
+    st.caption(f"*Note: Avoidable Cost Index ({avoidable:.2f}) means {avoidable:.0%} of all encounter spend is acute care (emergency, urgent care, inpatient) for patients with chronic conditions, the spend most open to better upstream preventive care and coordination.*")
+
+    continuity = get_continuity()
+    if continuity is not None and not continuity.cohorts.empty:
+        st.subheader("Medication Continuity & Insurance Churn by Cohort")
+        show_dataframe(continuity.cohort_rates(), "continuity_cohorts", use_container_width=True, hide_index=True)
+        st.caption("Proportion of days covered (PDC) by dispensed supply over the last year, and payer changes and coverage gaps from payer history. The last column counts patients whose medication supply lapsed within 90 days of a payer change.")
+
+# TAB 5 — Predictive & What-If Analytics
+def _predictive_tab():
+    section_header("Predictive & What-If Analytics – Futures, not reports")
+    ai_insight_box("AI Forecast", get_insight("admin_data", "ai_forecast"))
+    ai_insight_box("Counterfactual Intelligence", get_insight("admin_data", "counterfactual_intelligence"))
+
+    simulator = get_what_if_simulator()
+    if simulator is not None:
+        st.subheader("What-If Simulator")
+        cols = st.columns(3)
+        cohort = cols[0].selectbox("Cohort", simulator.cohorts(), key="whatif_cohort")
+        close_gaps = cols[1].slider("Overdue care gaps closed (%)", 0, 100, 30, step=10, key="whatif_gaps")
+        reduce_churn = cols[2].slider("Insurance churn reduced (%)", 0, 100, 0, step=10, key="whatif_churn")
+        bands = simulator.summary(cohort, close_gaps / 100, reduce_churn / 100)
+
+        def band(row, money=False):
+            fmt = "${:,.0f}" if money else "{:,.0f}"
+            return fmt.format(bands.loc[row, "median"]), f"90%: {fmt.format(bands.loc[row, 'p5'])} – {fmt.format(bands.loc[row, 'p95'])}"
+
+        cols = st.columns(4)
+        for col, (label, row, money) in zip(cols, [("Baseline hospitalizations", "baseline", False),
+                                                   ("Projected hospitalizations", "projected", False),
+                                                   ("Hospitalizations averted", "averted", False),
+                                                   ("Avoidable cost", "avoidable_cost", True)]):
+            value, spread = band(row, money)
+            col.metric(label, value)
+            col.caption(spread)
+        st.plotly_chart(what_if_band_chart(simulator.sweep(cohort, reduce_churn / 100), close_gaps), use_container_width=True)
+        st.caption(f"Next {HORIZON_MONTHS} months, {simulator.simulations:,} simulations per scenario over each patient's hospitalization risk. "
+                   "Effect sizes per closed gap and per retained patient are planning assumptions with their uncertainty drawn in every simulation; "
+                   "the band shows the 5th–95th percentile.")
+
+    store = get_clinical_store()
+    scores = store.read_derived("risk_scores")
+    points, version = None, None
+    if scores is not None:
+        # A zero-copy column selection; the figure is keyed on the table version, so the
+        # population is only converted and binned when risk_scores is rewritten.
+        points = scores.select(["age", "hospitalization_risk"]).rename_columns(["Age", "Risk"])
+        version = ("risk_scores", store.derived_version("risk_scores"))
+    st.plotly_chart(hospitalization_scatter(get_insight("admin_data", "hospitalization_risk_distribution"), points,
+                                            cache_key=version), use_container_width=True)
+    st.caption("**Interpretation:** Higher risk scores correlate with age, but significant variance exists. Young patients with high risk scores (outliers) represent the 'Preventive Failure' archetype.")
+
+# TAB 6 — AI Strategy Console
+def _strategy_tab():
+    section_header("AI Strategy Console – Why this is scalable AI")
+    prompts = get_insight("admin_data", "pre_loaded_prompts")
+    # All prompts are sent together; each expander streams its answer as it arrives.
+    for prompt, response in zip(prompts, stream_insights_via_agents(prompts)):
+        with st.expander(prompt):
+            st.write_stream(chain(["AI Response: "], response))
+
+    ai_gov = get_insight("admin_data", "ai_governance")
+    st.subheader("AI Governance & Trust Panel")
+    for key, value in ai_gov.items():
+        st.markdown(f"- **{key.capitalize()}**: {value}")
+
+    with st.expander("Confidence & Limitations"):
+        conf_lim = get_insight("doctor", "confidence_and_limitations")
+        if isinstance(conf_lim, dict):  # Check if dict
+            st.subheader("Confidence")
+            for c in conf_lim.get("confidence", []):
+                st.markdown(f"- {c}")
+            st.subheader("Limitations")
+            for l in conf_lim.get("limitations", []):
+                st.markdown(f"- {l}")
+            st.caption(conf_lim.get("disclaimer", ""))
         else:
-            st.write("Agent footnote data not available.")
\ No newline at end of file
+            st.write("Confidence data not available.")
+
+    st.subheader("Hero Insights")
+    hero_insights = get_insight("admin_data", "ai_alerts")
+    if isinstance(hero_insights, list):
+        for alert in hero_insights:
+            ai_insight_box("Strategic Alert", alert)
+    else:
+        st.write("Hero insights data not available.")
+
+    agent_fn = get_insight("doctor", "agent_footnote")
+    st.subheader("Agent Footnote")
+    if isinstance(agent_fn, dict):  # Check if dict
+        st.write(f"Agents Involved: {agent_fn.get('agents_involved', 'Not available')}")
+        st.write(f"Datasets Analyzed: {agent_fn.get('datasets_analyzed', 'Not available')}")
+        st.write(f"Population Context: {agent_fn.get('population_context', 'Not available')}")
+        show_dataframe(pd.DataFrame(agent_fn.get("agent_details", [])), "agent_details")
+    else:
+        st.write("Agent footnote data not available.")
+
+# Hidden telemetry tab — opened with ?telemetry=1 (or SHOW_TELEMETRY=1)
+def _telemetry_tab():
+    section_header("Render Telemetry")
+    recorder = get_recorder()
+    st.caption(f"Spans from the last {recorder.capacity:,} instrumented calls across all sessions; times in milliseconds.")
+    st.dataframe(recorder.summary(), use_container_width=True)
+
+    st.subheader("Caches")
+    st.json({
+        "figures": get_figure_cache().stats(),
+        "patients": get_patient_repository().stats(),
+        "insights": get_insight_store().stats(),
+        "derivations": get_derivation_service().stats(),
+    })
+
+    with st.expander("Prometheus export"):
+        metrics = recorder.prometheus()
+        st.download_button("Download metrics", metrics, file_name="metrics.prom", mime="text/plain")
+        st.code(metrics, language="text")
+
+def render_admin_dashboard():
+    # Logout in sidebar
+    with st.sidebar:
+        if st.button("Logout"):
+            del st.session_state.user_role
+            st.rerun()
+
+    st.markdown("## 🏥 Hospital Intelligence – Admin View")
+    st.markdown("Population-level clinical intelligence derived from longitudinal records. All insights are de-identified and HIPAA-safe.")
+
+    tabs = [
+        ("📊 Executive Overview", _overview_tab),
+        ("⚠️ Risk Stratification", _risk_tab),
+        ("🔁 Care Coordination", _care_coordination_tab),
+        ("💰 Cost & Insurance Intelligence", _cost_tab),
+        ("🔮 Predictive & What-If Analytics", _predictive_tab),
+        ("🧠 AI Strategy Console", _strategy_tab)
+    ]
+    if st.query_params.get("telemetry") == "1" or os.getenv("SHOW_TELEMETRY") == "1":
+        tabs.append(("📈 Telemetry", _telemetry_tab))
+    render_tabs(tabs, key="admin_tab")
@@ -1,12 +1,23 @@
 # pages/doctor.py
+from functools import partial
 import streamlit as st
 import pandas as pd
-from utils.styles import section_header, ai_insight_box
+from utils.styles import section_header, ai_insight_box, render_tabs, show_dataframe
 from utils.charts import patient_risk_gauge, encounter_timeline_chart
-from utils.services import get_insight
+from utils.services import get_insight, get_patient_insight
+from utils.care_gaps import get_care_gap_table
+from utils.patient_repository import get_patient_repository
+from utils.patient_search import get_patient_search, PAGE_SIZE
+
+# Patient-specific evidence: served by the patient repository (one batched, cached read of the
+# ingested clinical store per patient), falling back to the hardcoded demo rows for the hero patients.
+def _panel(pid, name):
+    return get_patient_repository().get_panels(pid)[name]
 
-# Patient-specific evidence (hardcoded for demo based on CSV insights; in prod, derive from agents/CSVs)
 def get_conditions(pid):
+    panel = _panel(pid, "conditions")
+    if not panel.empty:
+        return panel
     conditions_data = {
         "14289f20-085c-4fc8-bdd8-e2074166d91f": pd.DataFrame({"Condition": ["Hypertension", "Prediabetes", "Obesity"], "Status": ["Active", "Active", "Active"]}),
         "8d4c4326-e9de-4f45-9a4c-f8c36bff89ae": pd.DataFrame({"Condition": ["Viral sinusitis", "Acute viral pharyngitis"], "Status": ["Resolved", "Resolved"]}),
@@ -18,6 +29,9 @@ def get_conditions(pid):
     return conditions_data.get(pid, pd.DataFrame())
 
 def get_observations(pid):
+    panel = _panel(pid, "observations")
+    if not panel.empty:
+        return panel
     observations_data = {
         "14289f20-085c-4fc8-bdd8-e2074166d91f": pd.DataFrame({"Observation": ["Body Height", "Body Weight", "BMI"], "Value": ["170 cm", "85 kg", "29.4"], "Flag": ["Normal", "High", "Overweight"]}),
         "8d4c4326-e9de-4f45-9a4c-f8c36bff89ae": pd.DataFrame({"Observation": ["Blood Pressure", "BMI"], "Value": ["120/80 mmHg", "22.4"], "Flag": ["Normal", "Normal"]}),
@@ -29,6 +43,9 @@ def get_observations(pid):
     return observations_data.get(pid, pd.DataFrame())
 
 def get_encounters(pid):
+    panel = _panel(pid, "encounters")
+    if not panel.empty:
+        return panel
     encounters_data = {
         "14289f20-085c-4fc8-bdd8-e2074166d91f": pd.DataFrame({"Date": ["2010-01-23", "2011-08-09"], "Type": ["Ambulatory", "Emergency"]}),
         "8d4c4326-e9de-4f45-9a4c-f8c36bff89ae": pd.DataFrame({"Date": ["2011-04-30", "2018-03-05"], "Type": ["Wellness", "Ambulatory"]}),
@@ -40,6 +57,11 @@ def get_encounters(pid):
     return encounters_data.get(pid, pd.DataFrame())
 
 def get_care_gaps(pid):
+    # A patient the care-gap engine evaluated gets its result, even when nothing is overdue;
+    # patients it never saw (e.g. the curated demo IDs) keep the demo rows.
+    gaps = get_care_gap_table()
+    if gaps is not None and gaps.evaluated(pid):
+        return _panel(pid, "care_gaps")
     care_gaps_data = {
         "14289f20-085c-4fc8-bdd8-e2074166d91f": pd.DataFrame({"Gap": ["Missed lipid screening"], "Duration (days)": [90], "Risk Impact": ["Medium"]}),
         "8d4c4326-e9de-4f45-9a4c-f8c36bff89ae": pd.DataFrame({"Gap": ["Annual wellness check"], "Duration (days)": [180], "Risk Impact": ["Low"]}),
@@ -51,6 +73,9 @@ def get_care_gaps(pid):
     return care_gaps_data.get(pid, pd.DataFrame())
 
 def get_insurance(pid):
+    panel = _panel(pid, "insurance")
+    if not panel.empty:
+        return panel
     insurance_data = {
         "14289f20-085c-4fc8-bdd8-e2074166d91f": pd.DataFrame({"Payer": ["Humana", "UnitedHealthcare"], "Status": ["Active", "Inactive"]}),
         "8d4c4326-e9de-4f45-9a4c-f8c36bff89ae": pd.DataFrame({"Payer": ["Humana", "UnitedHealthcare"], "Status": ["Inactive", "Active"]}),
@@ -62,6 +87,9 @@ def get_insurance(pid):
     return insurance_data.get(pid, pd.DataFrame())
 
 def get_medications(pid):
+    panel = _panel(pid, "medications")
+    if not panel.empty:
+        return panel
     medications_data = {
         "14289f20-085c-4fc8-bdd8-e2074166d91f": pd.DataFrame({"Medication": ["Hydrochlorothiazide", "Metformin"], "Continuity": ["Stable", "Interrupted"]}),
         "8d4c4326-e9de-4f45-9a4c-f8c36bff89ae": pd.DataFrame({"Medication": ["Etonogestrel Implant"], "Continuity": ["Stable"]}),
@@ -73,6 +101,9 @@ def get_medications(pid):
     return medications_data.get(pid, pd.DataFrame())
 
 def get_last_visit_summary(pid):
+    summary = _panel(pid, "summary")
+    if summary:
+        return summary
     summaries = {
         "14289f20-085c-4fc8-bdd8-e2074166d91f": "Last visit: Reviewed hypertension meds; BP stable but HbA1c elevated; advised diet changes.",
         "8d4c4326-e9de-4f45-9a4c-f8c36bff89ae": "Last visit: Wellness check; all vitals normal; allergy reviewed.",
@@ -83,6 +114,130 @@ def get_last_visit_summary(pid):
     }
     return summaries.get(pid, "No recent visit summary available.")
 
+def get_patient_profile(pid, search):
+    """Curated hero or stored per-patient record if there is one, otherwise a placeholder built from the search directory."""
+    record = get_patient_insight(pid)
+    if record is not None:
+        if "confidence_and_limitations" in record:
+            return record
+        # Generated records share the population-level confidence block.
+        return {**record, "confidence_and_limitations": get_insight("doctor", "confidence_and_limitations")}
+    entry = search.get(pid) or {}
+    missing = "Patient insight not available"
+    risk = entry.get("risk_score")
+    return {
+        "name": entry.get("name") or pid,
+        "age": entry.get("age"),
+        "gender": entry.get("gender"),
+        "archetype": entry.get("archetype"),
+        "risk_score": 0.0 if risk is None or pd.isna(risk) else risk,
+        "ai_patient_state": missing,
+        "predictions": missing,
+        "care_gaps": missing,
+        "suggested_action": missing,
+        "cost_coverage_insight": missing,
+        "ai_temporal_reasoning": missing,
+        "ai_recommended_focus": [],
+        "ai_conclusion": missing,
+        "co_pilot_prompts": {},
+        "confidence_and_limitations": get_insight("doctor", "confidence_and_limitations"),
+    }
+
+# TAB 1 — Patient Overview
+def _overview_tab(pid, patient):
+    section_header("Patient Overview – The patient, explained")
+    st.subheader("Patient Details")
+    st.write(f"Name: {patient['name']}")
+    st.write(f"Age: {patient['age']}")
+    st.write(f"Gender: {patient['gender']}")
+    st.write(f"Archetype: {patient['archetype']}")
+
+    st.subheader("Last Visit Summary")
+    st.write(get_last_visit_summary(pid))
+
+    ai_insight_box("AI Patient Narrative", patient["ai_patient_state"])
+
+    st.subheader("Conditions")
+    show_dataframe(get_conditions(pid), "conditions", use_container_width=True)
+
+    st.subheader("Observations")
+    show_dataframe(get_observations(pid), "observations", use_container_width=True)
+
+# TAB 2 — Clinical Risk & Predictions
+def _risk_tab(pid, patient):
+    section_header("Clinical Risk & Predictions")
+    ai_insight_box("AI Patient State", patient["ai_patient_state"])
+
+    st.subheader("Risk Gauge")
+    st.plotly_chart(patient_risk_gauge(patient["risk_score"]), use_container_width=True)
+
+    ai_insight_box("Prediction", patient["predictions"])
+
+# TAB 3 — Care Gaps & Coordination
+def _care_gaps_tab(pid, patient):
+    section_header("Care Gaps & Coordination")
+    ai_insight_box("AI Gap Alert", patient["care_gaps"])
+
+    st.subheader("Suggested Action")
+    st.markdown(patient["suggested_action"])
+
+    st.subheader("Encounter Timeline")
+    st.plotly_chart(encounter_timeline_chart(get_encounters(pid)), use_container_width=True)
+
+    st.subheader("Detected Care Gaps")
+    gaps = get_care_gaps(pid)
+    if gaps.empty:
+        st.caption("No overdue care gaps detected.")
+    else:
+        show_dataframe(gaps, "care_gaps", use_container_width=True)
+
+# TAB 4 — Cost & Coverage Impact
+def _cost_tab(pid, patient):
+    section_header("Cost & Coverage Impact (Doctor-Relevant)")
+    ai_insight_box("AI Cost & Coverage Insight", patient["cost_coverage_insight"])
+
+    st.subheader("Coverage")
+    show_dataframe(get_insurance(pid), "insurance", use_container_width=True)
+    coverage_summary = _panel(pid, "coverage_summary")
+    if coverage_summary:
+        st.caption(coverage_summary)
+
+    st.subheader("Medication Continuity")
+    show_dataframe(get_medications(pid), "medications", use_container_width=True)
+
+# TAB 5 — AI Clinical Co-Pilot
+def _copilot_tab(pid, patient):
+    section_header("AI Clinical Co-Pilot")
+    ai_insight_box("AI Temporal Reasoning", patient["ai_temporal_reasoning"])
+
+    st.subheader("AI-Recommended Focus")
+    for item in patient["ai_recommended_focus"]:
+        st.markdown(f"- {item}")
+
+    ai_insight_box("AI Conclusion", patient["ai_conclusion"])
+
+    prompts = patient["co_pilot_prompts"]
+    for prompt, response in prompts.items():
+        with st.expander(prompt):
+            st.write(response)
+
+    with st.expander("Confidence & Limitations"):
+        conf_lim = patient["confidence_and_limitations"]
+        st.subheader("Confidence")
+        for c in conf_lim["confidence"]:
+            st.markdown(f"- {c}")
+        st.subheader("Limitations")
+        for l in conf_lim["limitations"]:
+            st.markdown(f"- {l}")
+        st.caption(conf_lim["disclaimer"])
+
+    agent_fn = get_insight("doctor", "agent_footnote")
+    st.subheader("Agent Footnote")
+    st.write(f"Agents Involved: {agent_fn['agents_involved']}")
+    st.write(f"Datasets Analyzed: {agent_fn['datasets_analyzed']}")
+    st.write(f"Population Context: {agent_fn['population_context']}")
+    show_dataframe(pd.DataFrame(agent_fn["agent_details"]), "agent_details")
+
 def render_doctor_dashboard():
     # Logout in sidebar
     with st.sidebar:
@@ -93,112 +248,38 @@ def render_doctor_dashboard():
     st.markdown("## 👨‍⚕️ Clinical Intelligence – Doctor View")
     st.markdown("Patient-centric insights derived from longitudinal records. All data is de-identified.")
 
-    # Sidebar Patient Selector (below logout)
+    # Sidebar Patient Selector (below logout); only one page of search results is sent to the browser
     with st.sidebar:
         section_header("Select Patient")
-        hero_patients = get_insight("doctor", "hero_patients")
-        # Dropdown with ID only
-        selected_pid = st.selectbox("Patient ID", list(hero_patients.keys()))
+        search = get_patient_search()
+        query = st.text_input("Search patients", placeholder="ID, name, archetype or risk band")
+        page = st.session_state.get("patient_page", 0)
+        results, total = search.search(query, page=page)
+        pages = max(1, -(-total // PAGE_SIZE))
+        if page >= pages:
+            # The query changed under a later page; restart from the top.
+            st.session_state.patient_page = page = 0
+            results, total = search.search(query, page=page)
+        if pages > 1:
+            st.number_input(f"Page (of {pages})", min_value=0, max_value=pages - 1, step=1, key="patient_page")
+        st.caption(f"{total:,} matching patients, highest risk first")
+        labels = {
+            row.patient_id: f"{row.name} · {row.risk_band} · {row.patient_id[:8]}"
+            for row in results.itertuples()
+        }
+        selected_pid = st.selectbox("Patient ID", list(labels), format_func=labels.get, key="patient_id")
 
     if not selected_pid:
         st.warning("Select a patient to view insights.")
         return
 
     pid = selected_pid
-    patient = hero_patients[pid]
-
-    tab1, tab2, tab3, tab4, tab5 = st.tabs([
-        "Patient Overview",
-        "Clinical Risk & Predictions",
-        "Care Gaps & Coordination",
-        "Cost & Coverage Impact",
-        "AI Clinical Co-Pilot"
-    ])
-
-    # TAB 1 — Patient Overview
-    with tab1:
-        section_header("Patient Overview – The patient, explained")
-        st.subheader("Patient Details")
-        st.write(f"Name: {patient['name']}")
-        st.write(f"Age: {patient['age']}")
-        st.write(f"Gender: {patient['gender']}")
-        st.write(f"Archetype: {patient['archetype']}")
-
-        st.subheader("Last Visit Summary")
-        st.write(get_last_visit_summary(pid))
-
-        ai_insight_box("AI Patient Narrative", patient["ai_patient_state"])
-
-        st.subheader("Conditions")
-        st.dataframe(get_conditions(pid), use_container_width=True)
-
-        st.subheader("Observations")
-        st.dataframe(get_observations(pid), use_container_width=True)
-
-    # TAB 2 — Clinical Risk & Predictions
-    with tab2:
-        section_header("Clinical Risk & Predictions")
-        ai_insight_box("AI Patient State", patient["ai_patient_state"])
-
-        st.subheader("Risk Gauge")
-        st.plotly_chart(patient_risk_gauge(patient["risk_score"]), use_container_width=True)
-
-        ai_insight_box("Prediction", patient["predictions"])
-
-    # TAB 3 — Care Gaps & Coordination
-    with tab3:
-        section_header("Care Gaps & Coordination")
-        ai_insight_box("AI Gap Alert", patient["care_gaps"])
-
-        st.subheader("Suggested Action")
-        st.markdown(patient["suggested_action"])
-
-        # st.subheader("Encounter Timeline")
-        # st.plotly_chart(encounter_timeline_chart(get_encounters(pid)), use_container_width=True)
-
-        st.subheader("Detected Care Gaps")
-        st.dataframe(get_care_gaps(pid), use_container_width=True)
-
-    # TAB 4 — Cost & Coverage Impact
-    with tab4:
-        section_header("Cost & Coverage Impact (Doctor-Relevant)")
-        ai_insight_box("AI Cost & Coverage Insight", patient["cost_coverage_insight"])
-
-        st.subheader("Coverage")
-        st.dataframe(get_insurance(pid), use_container_width=True)
-
-        st.subheader("Medication Continuity")
-        st.dataframe(get_medications(pid), use_container_width=True)
-
-    # TAB 5 — AI Clinical Co-Pilot
-    with tab5:
-        section_header("AI Clinical Co-Pilot")
-        ai_insight_box("AI Temporal Reasoning", patient["ai_temporal_reasoning"])
-
-        st.subheader("AI-Recommended Focus")
-        for item in patient["ai_recommended_focus"]:
-            st.markdown(f"- {item}")
-
-        ai_insight_box("AI Conclusion", patient["ai_conclusion"])
-
-        prompts = patient["co_pilot_prompts"]
-        for prompt, response in prompts.items():
-            with st.expander(prompt):
-                st.write(response)
-
-        with st.expander("Confidence & Limitations"):
-            conf_lim = patient["confidence_and_limitations"]
-            st.subheader("Confidence")
-            for c in conf_lim["confidence"]:
-                st.markdown(f"- {c}")
-            st.subheader("Limitations")
-            for l in conf_lim["limitations"]:
-                st.markdown(f"- {l}")
-            st.caption(conf_lim["disclaimer"])
-
-        agent_fn = get_insight("doctor", "agent_footnote")
-        st.subheader("Agent Footnote")
-        st.write(f"Agents Involved: {agent_fn['agents_involved']}")
-        st.write(f"Datasets Analyzed: {agent_fn['datasets_analyzed']}")
-        st.write(f"Population Context: {agent_fn['population_context']}")
-        st.dataframe(pd.DataFrame(agent_fn["agent_details"]))
\ No newline at end of file
+    patient = get_patient_profile(pid, search)
+
+    render_tabs([
+        ("Patient Overview", partial(_overview_tab, pid, patient)),
+        ("Clinical Risk & Predictions", partial(_risk_tab, pid, patient)),
+        ("Care Gaps & Coordination", partial(_care_gaps_tab, pid, patient)),
+        ("Cost & Coverage Impact", partial(_cost_tab, pid, patient)),
+        ("AI Clinical Co-Pilot", partial(_copilot_tab, pid, patient))
+    ], key="doctor_tab")
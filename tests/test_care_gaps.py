@@ -0,0 +1,70 @@
+# tests/test_care_gaps.py
+"""Vectorized care-gap detection vs. a naive per-patient evaluation of the guidelines."""
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.care_gaps import DATE_COLUMN, detect_care_gaps, load_guidelines
+from utils.clinical_store import ClinicalStore
+from utils.ingest import ingest
+from utils.synthetic_population import generate
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    out = tmp_path_factory.mktemp("population")
+    generate(str(out), 300, seed=20, workers=1)
+    ingest(str(out / "raw"), str(out / "store"), n_buckets=4, rebuild=True)
+    return ClinicalStore(str(out / "store"))
+
+
+def _day(value):
+    return int(np.datetime64(pd.Timestamp(value).date(), "D").astype("int64"))
+
+
+def _naive_gaps(store, guidelines):
+    """Walk every patient and guideline one at a time; same columns as detect_care_gaps."""
+    tables = {t: store.read_table(t).to_pandas() for t in ["patients", "encounters", "conditions", "observations"]}
+    today = _day(tables["encounters"]["START"].max())
+    rows = []
+    for patient in tables["patients"].itertuples():
+        seen = tables["encounters"][tables["encounters"]["PATIENT"] == patient.Id]
+        if seen.empty:
+            continue
+        birth = _day(patient.BIRTHDATE)
+        conditions = tables["conditions"][(tables["conditions"]["PATIENT"] == patient.Id) & tables["conditions"]["STOP"].isna()]
+        for rule in guidelines.itertuples(index=False):
+            if rule.table not in tables:
+                continue
+            if not rule.min_age * 365.25 <= today - birth < rule.max_age * 365.25 or rule.sex and patient.GENDER != rule.sex:
+                continue
+            since = max(min(_day(d) for d in seen["START"]), birth + int(rule.min_age * 365.25))
+            if rule.condition:
+                onsets = [_day(c.START) for c in conditions.itertuples() if re.search(rule.condition, c.DESCRIPTION, re.I)]
+                if not onsets:
+                    continue
+                since = max(since, min(onsets))
+            data = tables[rule.table]
+            done = [_day(d) for d, value in zip(data.loc[data["PATIENT"] == patient.Id, DATE_COLUMN[rule.table]],
+                                                data.loc[data["PATIENT"] == patient.Id, rule.column])
+                    if re.search(rule.pattern, value, re.I) and _day(d) <= today]
+            due = (max(done) if done else since) + rule.interval_days
+            rows.append((patient.Id, rule.gap, max(done) if done else None, due, max(today - due, 0)))
+    return pd.DataFrame(rows, columns=["patient_id", "gap", "last_done", "due", "overdue_days"])
+
+
+def test_detect_care_gaps_matches_naive_evaluation(store):
+    guidelines = load_guidelines()
+    gaps = detect_care_gaps(store, guidelines)
+    expected = _naive_gaps(store, guidelines)
+    assert len(gaps) == len(expected) and gaps["overdue"].any() and not gaps["overdue"].all()
+    got = gaps.set_index(["patient_id", "gap"]).sort_index()
+    expected = expected.set_index(["patient_id", "gap"]).sort_index()
+    assert got.index.equals(expected.index)
+    last_done = got["last_done"].to_numpy().astype("datetime64[D]").astype("int64")
+    assert np.array_equal(np.where(got["last_done"].isna(), -1, last_done), expected["last_done"].fillna(-1).to_numpy())
+    assert np.array_equal(got["due_date"].to_numpy().astype("datetime64[D]").astype("int64"), expected["due"].to_numpy())
+    assert np.array_equal(got["overdue_days"].to_numpy(), expected["overdue_days"].to_numpy())
+    assert np.array_equal(got["overdue"].to_numpy(), expected["overdue_days"].to_numpy() > 0)
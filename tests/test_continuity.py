@@ -0,0 +1,82 @@
+# tests/test_continuity.py
+"""Continuity engine vs. a day-by-day reference on a generated population."""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from utils import continuity as C
+from utils.synthetic_population import AS_OF, make_tables
+
+TODAY = int(np.datetime64(AS_OF.date(), "D").astype("int64"))
+
+
+def _day(value):
+    return int(np.datetime64(pd.Timestamp(value).date(), "D").astype("int64"))
+
+
+@pytest.fixture(scope="module")
+def tables():
+    return make_tables(np.random.default_rng(21), 200)
+
+
+def test_union_intervals_matches_daily_union():
+    rng = np.random.default_rng(0)
+    group = np.sort(rng.integers(0, 40, 600))
+    start = rng.integers(-50, 300, len(group))
+    end = start + rng.integers(0, 60, len(group))
+    order = np.lexsort((start, group))
+    group, start, end = group[order], start[order], end[order]
+    covered, gap, _ = C.union_intervals(group, start, end)
+    for g in np.unique(group):
+        rows = group == g
+        days = set()
+        for s, e in zip(start[rows], end[rows]):
+            days.update(range(s, e))
+        reach = max(end[rows].max(), start[rows][0])
+        assert covered[rows].sum() == len(days)
+        assert gap[rows].sum() == reach - start[rows][0] - len(days)
+
+
+def test_medication_pdc_matches_daily_supply(tables):
+    patients, medications = tables["patients"], tables["medications"]
+    result, _, _ = C.medication_continuity(pa.array(patients["Id"]), pa.Table.from_pandas(medications, preserve_index=False), TODAY)
+    result = result.set_index([patients["Id"].to_numpy()[result["patient"]], result["medication"]])
+    window = TODAY - C.LOOKBACK_DAYS
+    checked = 0
+    for (pid, drug), rows in medications.groupby(["PATIENT", "DESCRIPTION"]):
+        supplied = np.zeros(C.LOOKBACK_DAYS + 1, dtype=bool)
+        first, last = TODAY, None
+        for row in rows.itertuples():
+            start = _day(row.START)
+            stop = TODAY if pd.isna(row.STOP) else min(_day(row.STOP), TODAY)
+            if start > TODAY or stop < window:
+                continue
+            first, last = min(first, max(start, window)), max(last or stop, stop)
+            fills = max(int(row.DISPENSES), 1)
+            for k in range(fills):
+                fill_start = start + int(np.floor(k * (stop - start) / fills))
+                fill_end = min(fill_start + C.DAYS_PER_DISPENSE, stop)
+                supplied[min(max(fill_start, window), TODAY) - window:min(max(fill_end, window), TODAY) - window] = True
+        if last is None:
+            assert (pid, drug) not in result.index
+            continue
+        period = supplied[first - window:last - window]
+        runs = [len(run) for run in "".join("x" if not day else " " for day in period).split()]
+        got = result.loc[(pid, drug)]
+        assert got["covered_days"] == period.sum()
+        assert got["pdc"] == pytest.approx(min(period.sum() / max(last - first, 1), 1.0), abs=5e-4)
+        assert got["gap_days"] == sum(runs)
+        assert got["interruptions"] == sum(run >= C.INTERRUPTION_DAYS for run in runs)
+        checked += 1
+    assert checked == len(result)
+
+
+def test_near_switch_matches_pairwise_check():
+    rng = np.random.default_rng(1)
+    break_patient, break_day = rng.integers(0, 30, 400), rng.integers(0, 2000, 400)
+    switch_patient, switch_day = rng.integers(0, 30, 150), rng.integers(0, 2000, 150)
+    expected = [any(p == q and abs(d - e) <= C.SWITCH_WINDOW_DAYS for q, e in zip(switch_patient, switch_day))
+                for p, d in zip(break_patient, break_day)]
+    assert C.near_switch(break_patient, break_day, switch_patient, switch_day).tolist() == expected
+    assert not C.near_switch(break_patient, break_day, switch_patient[:0], switch_day[:0]).any()
@@ -0,0 +1,196 @@
+# utils/care_flow.py
+import threading
+from functools import lru_cache
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from loguru import logger
+
+from utils.clinical_store import get_clinical_store
+from utils.snapshots import get_snapshot
+
+# Care-flow stages shown in the admin Sankey, in node order.
+STAGES = ["Primary Care", "Specialist", "Emergency", "Follow-up"]
+PRIMARY, SPECIALIST, EMERGENCY, FOLLOW_UP = range(len(STAGES))
+
+# Synthea ENCOUNTERCLASS -> stage. Anything non-acute within FOLLOW_UP_DAYS of an
+# emergency visit is re-labelled Follow-up.
+ENCOUNTER_STAGE = {
+    "wellness": PRIMARY, "ambulatory": PRIMARY, "virtual": PRIMARY, "home": PRIMARY,
+    "outpatient": SPECIALIST, "snf": SPECIALIST, "hospice": SPECIALIST,
+    "emergency": EMERGENCY, "urgentcare": EMERGENCY, "inpatient": EMERGENCY,
+}
+FOLLOW_UP_DAYS = 30
+
+
+def stage_codes(encounter_class):
+    """Vectorized ENCOUNTERCLASS -> stage code (Primary Care for unknown classes)."""
+    lowered = pc.utf8_lower(pc.fill_null(encounter_class, ""))
+    classes = pa.array(list(ENCOUNTER_STAGE))
+    stages = np.array(list(ENCOUNTER_STAGE.values()) + [PRIMARY], dtype="int8")
+    position = pc.fill_null(pc.index_in(lowered, value_set=classes), len(classes)).to_numpy()
+    return stages[position]
+
+
+def sequence_transitions(patient_codes, start, stages):
+    """
+    Stage-to-stage transitions between consecutive encounters of the same patient.
+    Inputs are aligned arrays (patient code, start as datetime64, stage code). Returns
+    (patient code, start of the later encounter, source stage, target stage) for every
+    transition that changes stage, using a sort and a shift rather than a per-patient loop.
+    """
+    order = np.lexsort((start, patient_codes))
+    patient, start, stage = patient_codes[order], start[order], stages[order].copy()
+
+    same_patient = np.r_[False, patient[1:] == patient[:-1]]
+    # Follow-up: a non-emergency visit shortly after an emergency visit of the same patient.
+    prev_emergency = np.r_[False, stage[:-1] == EMERGENCY] & same_patient
+    gap = np.r_[np.timedelta64(0, "D"), np.diff(start)] if len(start) else np.array([], dtype="timedelta64[D]")
+    follow_up = prev_emergency & (stage != EMERGENCY) & (gap <= np.timedelta64(FOLLOW_UP_DAYS, "D"))
+    stage[follow_up] = FOLLOW_UP
+
+    source = np.r_[np.int8(0), stage[:-1]] if len(stage) else stage
+    moved = same_patient & (source != stage)
+    return patient[moved], start[moved], source[moved], stage[moved]
+
+
+def age_band(age_years):
+    bands = np.array(["0-17", "18-44", "45-64", "65+"])
+    return bands[np.searchsorted([18, 45, 65], age_years, side="right")]
+
+
+class CareFlowIndex:
+    """
+    All stage transitions of the population, sorted by date, so a Sankey for any date
+    window is two binary searches plus one bincount over that window's transitions.
+    Cohort filters are boolean masks over patient codes. Results are memoized per
+    (window, cohort) for the lifetime of the index (i.e. until new data is ingested).
+    The index is plain arrays (see arrays()), so it can also be memory-mapped from a
+    shared snapshot instead of being built in every server process.
+    """
+
+    def __init__(self, encounters, patients, risk_scores=None, as_of=None, cache_size=256):
+        patient_ids = patients.column("Id").combine_chunks()
+        codes = pc.fill_null(pc.index_in(encounters.column("PATIENT"), value_set=patient_ids), -1).to_numpy()
+        keep = codes >= 0
+        start = encounters.column("START").to_numpy().astype("datetime64[D]")[keep]
+        stages = stage_codes(encounters.column("ENCOUNTERCLASS"))[keep]
+        patient, day, source, target = sequence_transitions(codes[keep], start, stages)
+
+        order = np.argsort(day, kind="stable")
+        self._day = day[order]
+        self._patient = patient[order]
+        self._pair = (source.astype("int8") * len(STAGES) + target)[order]
+
+        n = len(patient_ids)
+        self._cohorts = {"All patients": None}
+        if "GENDER" in patients.column_names:
+            gender = pc.fill_null(patients.column("GENDER"), "").to_numpy(zero_copy_only=False)
+            for value in sorted(set(gender) - {""}):
+                self._cohorts[f"Gender: {value}"] = gender == value
+        if "BIRTHDATE" in patients.column_names:
+            # Ages as of the latest encounter (or `as_of`), the reference date of the risk
+            # engine and the other batch engines, so "Age: 65+" is the same cohort everywhere.
+            latest = pc.max(encounters.column("START")).as_py() if encounters.num_rows else None
+            today = np.datetime64(as_of or latest or "today", "D")
+            birth = patients.column("BIRTHDATE").to_numpy().astype("datetime64[D]")
+            ages = (today - birth).astype("float64") / 365.25
+            bands = age_band(np.nan_to_num(ages, nan=-1))
+            for value in ["0-17", "18-44", "45-64", "65+"]:
+                self._cohorts[f"Age: {value}"] = (bands == value) & ~np.isnat(birth)
+        if risk_scores is not None:
+            position = pc.fill_null(pc.index_in(risk_scores.column("patient_id"), value_set=patient_ids), -1).to_numpy()
+            band = np.full(n, "", dtype=object)
+            band[position[position >= 0]] = risk_scores.column("risk_band").to_numpy(zero_copy_only=False)[position >= 0]
+            for value in ["high", "medium", "low"]:
+                self._cohorts[f"Risk: {value}"] = band == value
+
+        self.flows = lru_cache(maxsize=cache_size)(self._flows)
+
+    def arrays(self):
+        """The index as named numpy arrays (for snapshots.publish)."""
+        names = [name for name, mask in self._cohorts.items() if mask is not None]
+        n = len(next(iter(m for m in self._cohorts.values() if m is not None), []))
+        return {
+            "day": self._day, "patient": self._patient, "pair": self._pair,
+            "cohort_names": np.array(names, dtype="U"),
+            "cohort_masks": np.array([self._cohorts[name] for name in names], dtype=bool).reshape(len(names), n),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, cache_size=256):
+        index = cls.__new__(cls)
+        index._day, index._patient, index._pair = arrays["day"], arrays["patient"], arrays["pair"]
+        index._cohorts = {"All patients": None}
+        index._cohorts.update(zip(arrays["cohort_names"].tolist(), arrays["cohort_masks"]))
+        index.flows = lru_cache(maxsize=cache_size)(index._flows)
+        return index
+
+    def __len__(self):
+        return len(self._day)
+
+    def date_range(self):
+        """(first, last) transition dates as datetime.date, or (None, None) when empty."""
+        if not len(self._day):
+            return None, None
+        return self._day[0].astype(object), self._day[-1].astype(object)
+
+    def cohorts(self):
+        return list(self._cohorts)
+
+    def _flows(self, start=None, end=None, cohort="All patients"):
+        lo = 0 if start is None else np.searchsorted(self._day, np.datetime64(start, "D"), side="left")
+        hi = len(self._day) if end is None else np.searchsorted(self._day, np.datetime64(end, "D"), side="right")
+        pairs = self._pair[lo:hi]
+        mask = self._cohorts.get(cohort)
+        if mask is not None:
+            pairs = pairs[mask[self._patient[lo:hi]]]
+        k = len(STAGES)
+        counts = np.bincount(pairs, minlength=k * k)
+        links = [(i // k, i % k, int(v)) for i, v in enumerate(counts) if v]
+        return {
+            "nodes": STAGES,
+            "source": [s for s, _, _ in links],
+            "target": [t for _, t, _ in links],
+            "value": [v for _, _, v in links],
+        }
+
+
+_index = None
+_index_key = None
+_index_lock = threading.Lock()
+
+
+def build_care_flow_index(store):
+    """CareFlowIndex over the whole store, or None when encounters or patients are missing."""
+    encounters = store.read_table("encounters", ["PATIENT", "START", "ENCOUNTERCLASS"])
+    patients = store.read_table("patients", ["Id", "BIRTHDATE", "GENDER"])
+    if encounters is None or patients is None:
+        return None
+    return CareFlowIndex(encounters, patients, store.read_derived("risk_scores"))
+
+
+def get_care_flow_index():
+    """
+    Shared CareFlowIndex: memory-mapped from the current snapshot when SNAPSHOT_DIR is set,
+    otherwise built here and rebuilt when a new ingestion generation or risk score run lands.
+    """
+    global _index, _index_key
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        key = ("snapshot", snapshot.generation)
+    else:
+        store = get_clinical_store()
+        key = (store.generation, store.derived_version("risk_scores"))
+    if _index is None or key != _index_key:
+        with _index_lock:
+            if _index is None or key != _index_key:
+                if snapshot is not None:
+                    arrays = snapshot.arrays("care_flow")
+                    _index = CareFlowIndex.from_arrays(arrays) if arrays else None
+                else:
+                    _index = build_care_flow_index(store)
+                    if _index is not None:
+                        logger.info(f"Care-flow index built over {len(_index):,} transitions")
+                _index_key = key
+    return _index
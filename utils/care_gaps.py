@@ -0,0 +1,315 @@
+# utils/care_gaps.py
+"""
+Rule-driven care-gap detection over the clinical store.
+
+    python -m utils.care_gaps --store data/store
+    python -m utils.care_gaps --store data/store --guidelines my_guidelines.csv
+
+Each guideline says who is eligible (age range, sex, an active condition matching a
+pattern) and how often some evidence must appear (an observation, encounter class,
+procedure or immunization matching a pattern). The whole population is evaluated at once:
+eligibility comes from np.minimum.at over the condition rows, and each eligible
+(guideline, patient) pair is matched to its most recent evidence row with a single
+pd.merge_asof over every evidence event, so there are no per-patient loops.
+
+Every eligible pair is written as one row of the `care_gaps` derived table, with its
+last evidence, due date and days overdue. The doctor's "Detected Care Gaps" panel and the
+admin gap rates both read that table (get_care_gap_table).
+"""
+import argparse
+import os
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from loguru import logger
+
+from utils.clinical_store import DEFAULT_STORE, ClinicalStore, get_clinical_store
+from utils.insight_store import get_insight_store
+from utils.risk_engine import StageTimer, matches, patient_codes
+
+GUIDELINE_COLUMNS = ["gap", "table", "column", "pattern", "condition", "min_age", "max_age", "sex",
+                     "interval_days", "risk_impact"]
+# Evidence patterns and conditions are case-insensitive regexes over the store's descriptions;
+# an empty condition means "everyone in the age range", an empty sex means both.
+DEFAULT_GUIDELINES = pd.DataFrame([
+    ("Annual wellness visit", "encounters", "ENCOUNTERCLASS", r"^wellness$", "", 18, 200, "", 365, "Low"),
+    ("Blood pressure check", "observations", "DESCRIPTION", r"blood pressure", "", 18, 200, "", 365, "Medium"),
+    ("Hypertension BP follow-up", "observations", "DESCRIPTION", r"blood pressure", r"hypertension",
+     0, 200, "", 90, "High"),
+    ("Diabetes HbA1c monitoring", "observations", "DESCRIPTION", r"hemoglobin a1c", r"diabetes mellitus",
+     0, 200, "", 180, "High"),
+    ("Prediabetes HbA1c screening", "observations", "DESCRIPTION", r"hemoglobin a1c|glucose", r"prediabetes",
+     0, 200, "", 365, "Medium"),
+    ("Lipid screening", "observations", "DESCRIPTION", r"cholesterol|triglycerides|lipoprotein", "",
+     40, 75, "", 1825, "Medium"),
+    ("Cardiometabolic lipid panel", "observations", "DESCRIPTION", r"cholesterol|triglycerides|lipoprotein",
+     r"hypertension|diabetes mellitus|hyperlipidemia|coronary|heart failure", 0, 200, "", 365, "High"),
+    ("Kidney function monitoring", "observations", "DESCRIPTION", r"glomerular filtration|creatinine",
+     r"kidney disease|diabetes mellitus", 0, 200, "", 365, "High"),
+    ("Weight management check", "observations", "DESCRIPTION", r"body mass index|body weight", r"obesity",
+     0, 200, "", 365, "Low"),
+    ("Heart failure follow-up", "encounters", "ENCOUNTERCLASS", r"^(ambulatory|outpatient)$", r"heart failure",
+     0, 200, "", 90, "High"),
+    ("Influenza immunization", "immunizations", "DESCRIPTION", r"influenza", "", 65, 200, "", 365, "Medium"),
+    ("Bone density screening", "procedures", "DESCRIPTION", r"bone density|dual-energy x-ray", "",
+     65, 200, "F", 730, "Medium"),
+    ("Colorectal cancer screening", "procedures", "DESCRIPTION", r"colonoscopy|fecal|stool", "",
+     45, 75, "", 3650, "Medium"),
+], columns=GUIDELINE_COLUMNS)
+DATE_COLUMN = {"encounters": "START", "observations": "DATE", "procedures": "DATE", "immunizations": "DATE"}
+IMPACT_ORDER = {"High": 0, "Medium": 1, "Low": 2}
+NEVER = np.iinfo("int64").max
+STATE_TABLE = "care_gaps"
+SCHEMA = pa.schema([("patient_id", pa.string()), ("gap", pa.string()), ("risk_impact", pa.string()),
+                    ("interval_days", pa.int32()), ("last_done", pa.date32()), ("evidence", pa.string()),
+                    ("due_date", pa.date32()), ("overdue_days", pa.int32()), ("overdue", pa.bool_())])
+
+
+def load_guidelines(path=None):
+    """Guideline table from a CSV with GUIDELINE_COLUMNS (default: DEFAULT_GUIDELINES)."""
+    if path is None:
+        return DEFAULT_GUIDELINES.copy()
+    guidelines = pd.read_csv(path, dtype={"condition": str, "sex": str}, keep_default_na=False)
+    missing = [c for c in GUIDELINE_COLUMNS if c not in guidelines.columns]
+    if missing:
+        raise ValueError(f"Guidelines file {path} is missing columns: {', '.join(missing)}")
+    return guidelines[GUIDELINE_COLUMNS]
+
+
+def _days(column):
+    """Arrow timestamps as int64 days since the epoch (NEVER for nulls)."""
+    ms = pc.fill_null(pc.cast(pc.cast(column, pa.timestamp("ms")), pa.int64()), NEVER).to_numpy()
+    return np.where(ms == NEVER, NEVER, ms // 86_400_000)
+
+
+def _earliest(codes, days, n, mask=None):
+    """Per-patient minimum of `days` over rows in `mask` (NEVER when there are none)."""
+    keep = codes >= 0
+    if mask is not None:
+        keep &= mask
+    out = np.full(n, NEVER, dtype="int64")
+    np.minimum.at(out, codes[keep], days[keep])
+    return out
+
+
+def detect_care_gaps(store, guidelines=None, as_of=None, timer=None):
+    """
+    Evaluate every guideline for every patient in `store`. Returns a DataFrame with one row
+    per eligible (patient, guideline): patient_id, gap, risk_impact, interval_days,
+    last_done, evidence, due_date, overdue_days (0 when up to date) and overdue.
+    Guidelines whose evidence table is not in the store are skipped.
+    """
+    guidelines = load_guidelines() if guidelines is None else guidelines
+    timer = timer or StageTimer()
+    with timer.stage("load"):
+        patients = store.read_table("patients", ["Id", "BIRTHDATE", "GENDER"])
+        conditions = store.read_table("conditions", ["PATIENT", "START", "STOP", "DESCRIPTION"])
+        encounters = store.read_table("encounters", ["PATIENT", "START"])
+        if patients is None or encounters is None:
+            raise ValueError(f"Store {store.root} has no patients or encounters to evaluate")
+        patient_ids = patients.column("Id").combine_chunks()
+        n = len(patient_ids)
+        if as_of is None:
+            as_of = pc.max(encounters.column("START")).as_py() or pd.Timestamp.now()
+        today = int(np.datetime64(pd.Timestamp(as_of).date(), "D").astype("int64"))
+
+    with timer.stage("eligibility"):
+        birth = _days(patients.column("BIRTHDATE"))
+        age_days = np.where(birth == NEVER, -1, today - birth)
+        gender = pc.fill_null(patients.column("GENDER"), "").to_numpy(zero_copy_only=False).astype(str)
+        # Records start at the first encounter: a never-done check is due one interval after that.
+        first_seen = _earliest(patient_codes(patient_ids, encounters.column("PATIENT")), _days(encounters.column("START")), n)
+        if conditions is not None:
+            c_codes = patient_codes(patient_ids, conditions.column("PATIENT"))
+            c_onset = _days(conditions.column("START"))
+            c_active = pc.is_null(conditions.column("STOP")).to_numpy(zero_copy_only=False)
+        evaluated, skipped, pairs = [], [], []
+        for rule in guidelines.itertuples(index=False):
+            if not store.available(rule.table):
+                skipped.append(rule.gap)
+                continue
+            eligible_since = np.maximum(first_seen, today - age_days + int(rule.min_age * 365.25))
+            eligible = (first_seen != NEVER) & (age_days >= rule.min_age * 365.25) & (age_days < rule.max_age * 365.25)
+            if rule.sex:
+                eligible &= gender == rule.sex
+            if rule.condition:
+                if conditions is None:
+                    skipped.append(rule.gap)
+                    continue
+                onset = _earliest(c_codes, c_onset, n, c_active & matches(conditions.column("DESCRIPTION"), rule.condition))
+                eligible &= onset != NEVER
+                eligible_since = np.maximum(eligible_since, np.where(onset == NEVER, 0, onset))
+            rows = np.flatnonzero(eligible)
+            evaluated.append(rule)
+            pairs.append(pd.DataFrame({
+                "rule": np.full(len(rows), len(evaluated) - 1, dtype="int32"),
+                "patient": rows.astype("int64"),
+                "eligible_since": eligible_since[rows],
+            }))
+
+    with timer.stage("evidence"):
+        # Every evidence event of every evaluated rule, keyed by (rule, patient): one stacked table.
+        events = []
+        sources = {}
+        for i, rule in enumerate(evaluated):
+            key = (rule.table, rule.column, rule.pattern)
+            if key not in sources:
+                data = store.read_table(rule.table, ["PATIENT", DATE_COLUMN[rule.table], rule.column])
+                if data is None or rule.column not in data.column_names:
+                    sources[key] = None
+                else:
+                    hit = matches(data.column(rule.column), rule.pattern)
+                    codes = patient_codes(patient_ids, data.column("PATIENT"))
+                    days = _days(data.column(DATE_COLUMN[rule.table]))
+                    keep = np.flatnonzero(hit & (codes >= 0) & (days <= today))
+                    sources[key] = (codes[keep], days[keep],
+                                    data.column(rule.column).take(pa.array(keep)).to_numpy(zero_copy_only=False))
+            if sources[key] is not None:
+                codes, days, evidence = sources[key]
+                events.append(pd.DataFrame({"rule": np.full(len(codes), i, dtype="int32"), "patient": codes.astype("int64"),
+                                            "done": days, "evidence": evidence}))
+        pairs = pd.concat(pairs, ignore_index=True) if pairs else pd.DataFrame(
+            {"rule": pd.Series(dtype="int32"), "patient": pd.Series(dtype="int64"), "eligible_since": pd.Series(dtype="int64")})
+        events = pd.concat(events, ignore_index=True) if events else pd.DataFrame(
+            {"rule": pd.Series(dtype="int32"), "patient": pd.Series(dtype="int64"),
+             "done": pd.Series(dtype="int64"), "evidence": pd.Series(dtype=object)})
+
+    with timer.stage("merge"):
+        k = max(len(evaluated), 1)
+        pairs["key"] = pairs["patient"] * k + pairs["rule"]
+        pairs["as_of"] = np.int64(today)
+        events["key"] = events["patient"] * k + events["rule"]
+        # Most recent evidence on or before as_of for each eligible (patient, rule).
+        merged = pd.merge_asof(pairs.sort_values("as_of", kind="stable"),
+                               events[["key", "done", "evidence"]].sort_values("done", kind="stable"),
+                               left_on="as_of", right_on="done", by="key", direction="backward")
+        done = merged["done"].to_numpy(dtype="float64", na_value=np.nan)
+        interval = np.array([rule.interval_days for rule in evaluated], dtype="int64")[merged["rule"].to_numpy()]
+        due = np.where(np.isnan(done), merged["eligible_since"].to_numpy(), np.nan_to_num(done).astype("int64")) + interval
+        overdue_days = np.maximum(today - due, 0)
+        never = np.isnan(done)
+        last_done = np.nan_to_num(done).astype("int64").astype("datetime64[D]")
+        last_done[never] = np.datetime64("NaT")
+        rule = merged["rule"].to_numpy()
+        gaps = pd.DataFrame({
+            "patient_id": patient_ids.to_numpy(zero_copy_only=False)[merged["patient"].to_numpy()],
+            "gap": np.array([r.gap for r in evaluated], dtype=object)[rule],
+            "risk_impact": np.array([r.risk_impact for r in evaluated], dtype=object)[rule],
+            "interval_days": interval.astype("int32"),
+            "last_done": last_done,
+            "evidence": merged["evidence"].to_numpy(),
+            "due_date": due.astype("datetime64[D]"),
+            "overdue_days": overdue_days.astype("int32"),
+            "overdue": overdue_days > 0,
+        })
+        gaps = gaps.sort_values(["patient_id", "overdue_days"], ascending=[True, False], kind="stable", ignore_index=True)
+    if skipped:
+        logger.info(f"Skipped guidelines without evidence data in the store: {', '.join(skipped)}")
+    return gaps
+
+
+def run(store_root=DEFAULT_STORE, guidelines_path=None, as_of=None, publish=True):
+    """Detect gaps, persist the `care_gaps` derived table and record the run in the insight store."""
+    store = ClinicalStore(store_root)
+    timer = StageTimer()
+    gaps = detect_care_gaps(store, load_guidelines(guidelines_path), as_of, timer)
+    with timer.stage("persist"):
+        store.write_derived(STATE_TABLE, pa.Table.from_pandas(gaps, schema=SCHEMA, preserve_index=False))
+    overdue = int(gaps["overdue"].sum())
+    if publish:
+        get_insight_store().publish("engine_runs", {"care_gaps": {
+            "eligible_pairs": len(gaps),
+            "overdue": overdue,
+            "generation": store.generation,
+            "stages_seconds": timer.stages,
+        }})
+    logger.info(f"Found {overdue:,} overdue care gaps in {len(gaps):,} eligible patient-guideline pairs; "
+                f"stage timings (s): {timer.stages}")
+    return gaps, timer.stages
+
+
+class CareGapTable:
+    """Read side of the `care_gaps` derived table: per-patient panels and population gap rates."""
+
+    def __init__(self, table):
+        self.table = table
+        # Rows are sorted by patient_id, so one patient's rows are a contiguous slice.
+        self._ids = table.column("patient_id").to_numpy(zero_copy_only=False).astype("S")
+        self._rates = None
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def _slice(self, patient_id):
+        key = str(patient_id).encode("utf-8")
+        return np.searchsorted(self._ids, key, side="left"), np.searchsorted(self._ids, key, side="right")
+
+    def evaluated(self, patient_id):
+        """True when the run evaluated this patient against at least one guideline."""
+        lo, hi = self._slice(patient_id)
+        return hi > lo
+
+    def for_patient(self, patient_id):
+        """Overdue gaps for one patient, most overdue first, in the doctor panel's columns."""
+        lo, hi = self._slice(patient_id)
+        rows = self.table.slice(lo, hi - lo).to_pandas()
+        rows = rows[rows["overdue"]]
+        return pd.DataFrame({
+            "Gap": rows["gap"],
+            "Duration (days)": rows["overdue_days"],
+            "Risk Impact": rows["risk_impact"],
+            "Last done": rows["last_done"].astype(str).where(rows["last_done"].notna(), "Never"),
+        }).reset_index(drop=True)
+
+    def rates(self):
+        """Per guideline: eligible patients, overdue patients, overdue rate and median days overdue."""
+        if self._rates is None:
+            frame = self.table.select(["gap", "risk_impact", "overdue", "overdue_days"]).to_pandas()
+            grouped = frame.groupby(["gap", "risk_impact"], sort=False)
+            rates = grouped.agg(eligible=("overdue", "size"), overdue=("overdue", "sum")).reset_index()
+            late = frame[frame["overdue"]].groupby("gap")["overdue_days"].median()
+            rates["rate"] = (100 * rates["overdue"] / rates["eligible"]).round(1)
+            rates["median_overdue"] = rates["gap"].map(late).fillna(0).astype(int)
+            rates["order"] = rates["risk_impact"].map(IMPACT_ORDER)
+            rates = rates.sort_values(["order", "rate"], ascending=[True, False], ignore_index=True)
+            self._rates = pd.DataFrame({
+                "Gap": rates["gap"], "Risk Impact": rates["risk_impact"], "Eligible": rates["eligible"],
+                "Overdue": rates["overdue"].astype(int), "Overdue (%)": rates["rate"],
+                "Median days overdue": rates["median_overdue"],
+            })
+        return self._rates
+
+
+_table = None
+_table_version = None
+_table_lock = threading.Lock()
+
+
+def get_care_gap_table(store=None):
+    """Shared CareGapTable over the latest `care_gaps` run, or None if the engine has not run."""
+    global _table, _table_version
+    store = store or get_clinical_store()
+    version = (store.root, store.derived_version(STATE_TABLE))
+    if version != _table_version:
+        with _table_lock:
+            if version != _table_version:
+                data = store.read_derived(STATE_TABLE)
+                _table = CareGapTable(data) if data is not None else None
+                _table_version = version
+    return _table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detect overdue care gaps for the whole population.")
+    parser.add_argument("--store", default=os.getenv("CLINICAL_STORE_DIR", DEFAULT_STORE), help="Clinical store directory")
+    parser.add_argument("--guidelines", default=None, help=f"CSV with columns {', '.join(GUIDELINE_COLUMNS)}")
+    parser.add_argument("--as-of", default=None, help="Reference date (default: latest encounter)")
+    parser.add_argument("--no-publish", action="store_true", help="Only write care_gaps; leave the insight store alone")
+    args = parser.parse_args(argv)
+    run(args.store, args.guidelines, args.as_of, publish=not args.no_publish)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,22 @@
-import plotly.express as px
+import numpy as np
 import plotly.graph_objects as go
 import pandas as pd
 
+from utils.downsample import MAX_POINTS, bin_2d, bin_timeline, render_mode
+from utils.figure_cache import cached_figure
+
+
+def _px():
+    """plotly.express, imported on the first chart that needs it (it costs ~10x graph_objects)."""
+    import plotly.express as px
+    return px
+
 
 # -------------------------------------------------------------------
 # ADMIN CHARTS
 # -------------------------------------------------------------------
 
+@cached_figure
 def risk_distribution_chart(data: dict):
     """
     Pie chart showing population risk distribution.
@@ -16,7 +26,7 @@ def risk_distribution_chart(data: dict):
         return go.Figure()
 
     df = pd.DataFrame(list(data.items()), columns=['Risk Level', 'Percentage'])
-    fig = px.pie(
+    fig = _px().pie(
         df,
         names="Risk Level",
         values="Percentage",
@@ -34,6 +44,7 @@ def risk_distribution_chart(data: dict):
     return fig
 
 
+@cached_figure
 def risk_age_chart(data: dict):
     """
     Bar chart showing high-risk percentage by age band.
@@ -47,7 +58,7 @@ def risk_age_chart(data: dict):
     else:
         df = data
 
-    fig = px.bar(
+    fig = _px().bar(
         df,
         x="Age Band",
         y="High Risk %",
@@ -68,6 +79,7 @@ def risk_age_chart(data: dict):
     return fig
 
 
+@cached_figure
 def cost_treemap_chart(labels: list, values: list):
     """
     Treemap for cost breakdown.
@@ -76,7 +88,7 @@ def cost_treemap_chart(labels: list, values: list):
     if not labels or not values:
         return go.Figure()
 
-    fig = px.treemap(
+    fig = _px().treemap(
         names=labels,
         parents=[""] * len(labels),  # Flat treemap
         values=values,
@@ -92,20 +104,26 @@ def cost_treemap_chart(labels: list, values: list):
     return fig
 
 
-def equity_heatmap_chart(disparities: str):
+@cached_figure
+def equity_heatmap_chart(matrix: pd.DataFrame = None, metric: str = "Instability Factor"):
     """
-    Heatmap for equity disparities (simplified from description).
-    Uses sample data; adapt as needed.
+    Heatmap for equity disparities.
+    Expected: `matrix` a rows × columns DataFrame of one cohort metric (see
+    utils.cohort_cube.CohortCube.pivot); falls back to a hardcoded sample when not given.
     """
-    # Sample data based on disparities insight
-    df = pd.DataFrame({
-        'Cohort': ['Urban', 'Hispanic', 'Other'],
-        'Instability Factor': [1.5, 1.5, 1.0]
-    })
-
-    fig = px.imshow(
-        df.pivot(columns='Cohort', values='Instability Factor'),
+    if matrix is None:
+        # Static sample used until the cohort cube has been built
+        df = pd.DataFrame({
+            'Cohort': ['Urban', 'Hispanic', 'Other'],
+            'Instability Factor': [1.5, 1.5, 1.0]
+        })
+        matrix = df.pivot(columns='Cohort', values='Instability Factor')
+
+    fig = _px().imshow(
+        matrix,
         text_auto=True,
+        aspect="auto",
+        labels=dict(color=metric),
         color_continuous_scale="Reds"
     )
 
@@ -117,23 +135,34 @@ def equity_heatmap_chart(disparities: str):
     return fig
 
 
-def care_flow_sankey():
+@cached_figure
+def care_flow_sankey(flow: dict = None):
     """
-    Sankey diagram for care coordination flows (hardcoded sample).
+    Sankey diagram for care coordination flows.
+    Expected: dict with 'nodes' and parallel 'source'/'target'/'value' lists
+    (see utils.care_flow); falls back to the hardcoded sample when not given.
     """
+    if not flow:
+        flow = {
+            "nodes": ["Primary Care", "Specialist", "Emergency", "Follow-up"],
+            "source": [0, 1, 0, 2],  # From nodes
+            "target": [2, 3, 2, 3],  # To nodes
+            "value": [8, 4, 2, 2],
+        }
+
     fig = go.Figure(data=[go.Sankey(
         node=dict(
             pad=15,
             thickness=25,
             line=dict(color="black", width=0.5),
-            label=["Primary Care", "Specialist", "Emergency", "Follow-up"],
+            label=list(flow["nodes"]),
             color=["#2B60DE", "#6495ED", "#FF6347", "#3CB371"]  # Professional color palette
         ),
         textfont=dict(color="white", size=12),  # Set node label font to white for readability
         link=dict( 
-            source=[0, 1, 0, 2],  # From nodes
-            target=[2, 3, 2, 3],  # To nodes
-            value=[8, 4, 2, 2],
+            source=list(flow["source"]),
+            target=list(flow["target"]),
+            value=list(flow["value"]),
             color="rgba(200, 200, 200, 0.4)"  # Lighter, semi-transparent links
         )
     )])
@@ -146,26 +175,48 @@ def care_flow_sankey():
     return fig
 
 
-def hospitalization_scatter(data: dict):
+@cached_figure
+def hospitalization_scatter(data: dict, points=None):
     """
     Scatter plot for hospitalization risk vs age/condition.
-    Expected: dict like hospitalization_risk_distribution
+    Expected: `points` (DataFrame or Arrow table) with one row per patient and columns
+    ['Age', 'Risk'] (the risk engine's age and hospitalization_risk); without it, a sample
+    expanded from `data` (dict like hospitalization_risk_distribution). Large populations
+    are drawn with WebGL, or binned into a density grid (see utils.downsample).
     """
-    if not data:
-        return go.Figure()
-
-    # Sample expansion
-    df = pd.DataFrame({
-        'Risk': [0.2] * 50 + [0.5] * 30 + [0.8] * 20,
-        'Age': list(range(20, 70)) * 2  # Simulated
-    })
-
-    fig = px.scatter(
-        df,
-        x="Age",
-        y="Risk",
-        title="Hospitalization Risk vs Age"
-    )
+    if points is not None and not isinstance(points, pd.DataFrame):
+        points = points.to_pandas()
+    if points is None or points.empty:
+        if not data:
+            return go.Figure()
+        # Sample expansion
+        points = pd.DataFrame({
+            'Risk': [0.2] * 50 + [0.5] * 30 + [0.8] * 20,
+            'Age': list(range(20, 70)) * 2  # Simulated
+        })
+
+    mode = render_mode(len(points))
+    if mode == "binned":
+        risk_bins = 50
+        counts, ages, risks = bin_2d(points["Age"], points["Risk"], max(1, MAX_POINTS // risk_bins), risk_bins,
+                                     y_range=(0.0, 1.0))
+        fig = go.Figure(go.Heatmap(
+            z=np.where(counts > 0, counts, np.nan),
+            x=ages,
+            y=risks,
+            colorscale="Blues",
+            colorbar=dict(title="Patients"),
+            hovertemplate="Age %{x:.0f}, risk %{y:.2f}: %{z} patients<extra></extra>"
+        ))
+        fig.update_layout(title="Hospitalization Risk vs Age")
+    else:
+        fig = _px().scatter(
+            points,
+            x="Age",
+            y="Risk",
+            render_mode=mode,
+            title="Hospitalization Risk vs Age"
+        )
 
     fig.update_layout(
         xaxis_title="Age",
@@ -176,10 +227,39 @@ def hospitalization_scatter(data: dict):
     return fig
 
 
+@cached_figure
+def what_if_band_chart(sweep: pd.DataFrame, selected: int = None, title: str = "Avoidable Cost vs. Care Gaps Closed"):
+    """
+    Median line with a 5th–95th percentile band across intervention levels.
+    Expected: DataFrame with columns level (0–100), p5, median, p95 (see utils.what_if.WhatIfSimulator.sweep).
+    """
+    if sweep is None or sweep.empty:
+        return go.Figure()
+
+    fig = go.Figure([
+        go.Scatter(x=sweep["level"], y=sweep["p95"], mode="lines", line=dict(width=0), showlegend=False, hoverinfo="skip"),
+        go.Scatter(x=sweep["level"], y=sweep["p5"], mode="lines", line=dict(width=0), fill="tonexty",
+                   fillcolor="rgba(255, 127, 14, 0.25)", name="90% band"),
+        go.Scatter(x=sweep["level"], y=sweep["median"], mode="lines+markers", line=dict(color="darkorange"), name="Median"),
+    ])
+    if selected is not None:
+        fig.add_vline(x=selected, line_dash="dash", line_color="gray")
+
+    fig.update_layout(
+        title=title,
+        xaxis_title="Overdue care gaps closed (%)",
+        yaxis_title="Avoidable cost ($)",
+        margin=dict(t=50, b=40, l=40, r=20)
+    )
+
+    return fig
+
+
 # -------------------------------------------------------------------
 # DOCTOR CHARTS
 # -------------------------------------------------------------------
 
+@cached_figure
 def patient_risk_gauge(risk_score: float):
     """
     Gauge chart for individual patient risk.
@@ -216,25 +296,40 @@ def patient_risk_gauge(risk_score: float):
     return fig
 
 
+@cached_figure
 def encounter_timeline_chart(df: pd.DataFrame):
     """
     Timeline chart of patient encounters.
-    Expected columns: ['Date', 'Type']
+    Expected columns: ['Date', 'Type']. Long histories are drawn with WebGL, or binned
+    into per-type time buckets with marker size showing the encounter count.
     """
     if df.empty:
         return go.Figure()
 
-    df = df.copy()
-    df["Date"] = pd.to_datetime(df["Date"])
-
-    fig = px.scatter(
-        df,
-        x="Date",
-        y="Type",
-        color="Type",
-        symbol="Type",
-        size_max=10
-    )
+    mode = render_mode(len(df))
+    if mode == "binned":
+        fig = _px().scatter(
+            bin_timeline(df["Date"], df["Type"]),
+            x="Date",
+            y="Type",
+            color="Type",
+            size="Count",
+            size_max=18,
+            render_mode="webgl"
+        )
+    else:
+        df = df.copy()
+        df["Date"] = pd.to_datetime(df["Date"])
+
+        fig = _px().scatter(
+            df,
+            x="Date",
+            y="Type",
+            color="Type",
+            symbol="Type",
+            size_max=10,
+            render_mode=mode
+        )
 
     fig.update_layout(
         title="Encounter Timeline",
@@ -0,0 +1,260 @@
+# utils/clinical_store.py
+import json
+import os
+import threading
+import uuid
+import pandas as pd
+import pyarrow as pa
+from loguru import logger
+
+from utils.snapshots import get_snapshot
+
+# Synthea export tables. "key" is the patient-ID column the store is bucketed and sorted by
+# (None = small reference table stored whole), "sort" orders rows within a patient.
+TABLES = {
+    "patients": {"key": "Id", "sort": [], "dates": ["BIRTHDATE", "DEATHDATE"],
+                 "numeric": ["LAT", "LON", "HEALTHCARE_EXPENSES", "HEALTHCARE_COVERAGE"]},
+    "conditions": {"key": "PATIENT", "sort": ["START"], "dates": ["START", "STOP"], "numeric": []},
+    "observations": {"key": "PATIENT", "sort": ["DATE"], "dates": ["DATE"], "numeric": []},
+    "encounters": {"key": "PATIENT", "sort": ["START"], "dates": ["START", "STOP"],
+                   "numeric": ["BASE_ENCOUNTER_COST", "TOTAL_CLAIM_COST", "PAYER_COVERAGE"]},
+    "careplans": {"key": "PATIENT", "sort": ["START"], "dates": ["START", "STOP"], "numeric": []},
+    "allergies": {"key": "PATIENT", "sort": ["START"], "dates": ["START", "STOP"], "numeric": []},
+    "devices": {"key": "PATIENT", "sort": ["START"], "dates": ["START", "STOP"], "numeric": []},
+    "immunizations": {"key": "PATIENT", "sort": ["DATE"], "dates": ["DATE"], "numeric": ["BASE_COST"]},
+    "procedures": {"key": "PATIENT", "sort": ["DATE"], "dates": ["DATE"], "numeric": ["BASE_COST"]},
+    "imaging_studies": {"key": "PATIENT", "sort": ["DATE"], "dates": ["DATE"], "numeric": []},
+    "medications": {"key": "PATIENT", "sort": ["START"], "dates": ["START", "STOP"],
+                    "numeric": ["BASE_COST", "PAYER_COVERAGE", "DISPENSES", "TOTALCOST"]},
+    "payer_transitions": {"key": "PATIENT", "sort": ["START_YEAR"], "dates": [],
+                          "numeric": ["START_YEAR", "END_YEAR"]},
+    "payers": {"key": None, "sort": [], "dates": [], "numeric": ["AMOUNT_COVERED", "AMOUNT_UNCOVERED", "REVENUE"]},
+    "organizations": {"key": None, "sort": [], "dates": [], "numeric": ["LAT", "LON", "REVENUE", "UTILIZATION"]},
+}
+
+DEFAULT_STORE = "data/store"
+MANIFEST = "manifest.json"
+
+
+def bucket_of(patient_ids, n_buckets):
+    """Stable bucket number per patient ID (same in every process and every run)."""
+    ids = pd.Series(patient_ids, dtype="object").fillna("")
+    return (pd.util.hash_pandas_object(ids, index=False).to_numpy() % n_buckets).astype("int64")
+
+
+def bucket_path(root, table, bucket):
+    return os.path.join(root, table, f"bucket-{bucket:04d}.arrow")
+
+
+def index_path(root, table, bucket):
+    return os.path.join(root, table, f"bucket-{bucket:04d}.index.arrow")
+
+
+def reference_path(root, table):
+    return os.path.join(root, table, "table.arrow")
+
+
+def derived_path(root, name):
+    return os.path.join(root, "derived", f"{name}.arrow")
+
+
+def atomic_write(path, table):
+    """Write an uncompressed Arrow IPC file via temp file + rename (readers never see a partial file)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, path)
+
+
+def read_manifest(root):
+    try:
+        with open(os.path.join(root, MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"generation": 0, "buckets": None, "sources": {}}
+
+
+def _read_ipc(path):
+    # Uncompressed IPC files map straight into Arrow buffers: no parse, no copy.
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+class ClinicalStore:
+    """
+    Read side of the ingested store: per-patient rows through a patient-ID -> (offset, length)
+    index over memory-mapped, patient-sorted Arrow IPC buckets. Opened buckets are cached
+    until the manifest generation changes (i.e. until the next ingestion run lands).
+    With `follow_snapshot`, derived tables are read from the live serving snapshot's pinned
+    copies (utils.snapshots) when one was published from this store.
+    """
+
+    def __init__(self, root=DEFAULT_STORE, follow_snapshot=False):
+        self.root = root
+        self.follow_snapshot = follow_snapshot
+        self._lock = threading.Lock()
+        self._manifest_mtime = None
+        self._manifest = read_manifest(root)
+        self._buckets = {}      # (table, bucket) -> (pa.Table, {patient_id: (offset, length)})
+        self._references = {}   # table -> pd.DataFrame
+        self._derived = {}      # name -> ((path, mtime_ns), pa.Table)
+
+    def _check_generation(self):
+        try:
+            mtime = os.stat(os.path.join(self.root, MANIFEST)).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._manifest_mtime:
+            with self._lock:
+                self._manifest_mtime = mtime
+                self._manifest = read_manifest(self.root)
+                self._buckets = {}
+                self._references = {}
+
+    @property
+    def generation(self):
+        self._check_generation()
+        return self._manifest.get("generation", 0)
+
+    @property
+    def n_buckets(self):
+        self._check_generation()
+        return self._manifest.get("buckets")
+
+    def available(self, table):
+        self._check_generation()
+        return table in self._manifest.get("tables", [])
+
+    def _bucket(self, table, bucket):
+        cached = self._buckets.get((table, bucket))
+        if cached is not None:
+            return cached
+        path = bucket_path(self.root, table, bucket)
+        if not os.path.exists(path):
+            entry = (None, {})
+        else:
+            idx = _read_ipc(index_path(self.root, table, bucket)).to_pydict()
+            index = dict(zip(idx["patient"], zip(idx["offset"], idx["length"])))
+            entry = (_read_ipc(path), index)
+        self._buckets[(table, bucket)] = entry
+        return entry
+
+    def read_arrow(self, table, patient_id):
+        """Zero-copy Arrow slice with one patient's rows (None if the patient has none)."""
+        return self.read_patient(patient_id, [table])[table]
+
+    def read_patient(self, patient_id, tables):
+        """One patient's rows from several tables: a single bucket hash, then one index probe per table."""
+        self._check_generation()
+        present = [t for t in tables if self.available(t) and TABLES[t]["key"] is not None]
+        if not present:
+            return {t: None for t in tables}
+        bucket = int(bucket_of([patient_id], self.n_buckets)[0])
+        rows = {}
+        for table in tables:
+            rows[table] = None
+            if table in present:
+                data, index = self._bucket(table, bucket)
+                hit = index.get(patient_id)
+                if hit is not None:
+                    rows[table] = data.slice(hit[0], hit[1])
+        return rows
+
+    def read_patients(self, table, patient_ids, columns=None):
+        """Rows of many patients from one table in a single pass over the buckets they hash to."""
+        if not self.available(table) or TABLES[table]["key"] is None:
+            return None
+        patient_ids = list(dict.fromkeys(patient_ids))
+        by_bucket = {}
+        for pid, bucket in zip(patient_ids, bucket_of(patient_ids, self.n_buckets).tolist()):
+            by_bucket.setdefault(bucket, []).append(pid)
+        slices = []
+        for bucket, pids in sorted(by_bucket.items()):
+            data, index = self._bucket(table, bucket)
+            hits = [index[p] for p in pids if p in index]
+            slices.extend(data.slice(offset, length) for offset, length in hits)
+        if not slices:
+            return None
+        rows = pa.concat_tables(slices)
+        return rows.select([c for c in columns if c in rows.column_names]) if columns else rows
+
+    def read(self, table, patient_id):
+        """One patient's rows as a DataFrame (empty if none)."""
+        rows = self.read_arrow(table, patient_id)
+        return rows.to_pandas() if rows is not None else pd.DataFrame()
+
+    def reference(self, table):
+        """Whole reference table (payers, organizations) as a DataFrame."""
+        self._check_generation()
+        if table not in self._references:
+            path = reference_path(self.root, table)
+            self._references[table] = _read_ipc(path).to_pandas() if os.path.exists(path) else pd.DataFrame()
+        return self._references[table]
+
+    def scan(self, table, columns=None):
+        """Yield one bucket at a time as an Arrow table, for population-wide batch jobs."""
+        if not self.available(table):
+            return
+        for bucket in range(self.n_buckets):
+            data, _ = self._bucket(table, bucket)
+            if data is not None and data.num_rows:
+                yield data.select([c for c in columns if c in data.column_names]) if columns else data
+
+    def write_derived(self, name, table):
+        """Publish a batch-engine output table (risk scores, care gaps, ...) next to the raw tables."""
+        atomic_write(derived_path(self.root, name), table)
+
+    def _derived_path(self, name):
+        if self.follow_snapshot:
+            snapshot = get_snapshot()
+            if snapshot is not None and snapshot.pins(self.root):
+                return snapshot.derived_path(name)
+        return derived_path(self.root, name)
+
+    def derived_version(self, name):
+        """mtime of a derived table's file (None if absent); changes whenever it is rewritten."""
+        path = self._derived_path(name)
+        try:
+            return os.stat(path).st_mtime_ns if path else None
+        except OSError:
+            return None
+
+    def read_derived(self, name):
+        """Memory-mapped derived table, re-opened when its file is replaced; None if never written."""
+        path = self._derived_path(name)
+        try:
+            version = (path, os.stat(path).st_mtime_ns) if path else None
+        except OSError:
+            version = None
+        if version is None:
+            return None
+        cached = self._derived.get(name)
+        if cached is None or cached[0] != version:
+            cached = self._derived[name] = (version, _read_ipc(path))
+        return cached[1]
+
+    def read_table(self, table, columns=None):
+        """Whole table (selected columns) as one Arrow table; buckets are memory-mapped, not parsed."""
+        parts = list(self.scan(table, columns))
+        if not parts:
+            return None
+        return pa.concat_tables(parts, promote_options="default")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_clinical_store(root=None):
+    """
+    Shared ClinicalStore for this server process (CLINICAL_STORE_DIR, default data/store).
+    It serves derived tables from the live snapshot when SNAPSHOT_DIR is set.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                root = root or os.getenv("CLINICAL_STORE_DIR", DEFAULT_STORE)
+                _store = ClinicalStore(root, follow_snapshot=True)
+                logger.info(f"Clinical store opened at {root} (generation {_store.generation})")
+    return _store
@@ -0,0 +1,346 @@
+# utils/cohort_cube.py
+"""
+Cohort aggregation cube over the clinical store.
+
+    python -m utils.cohort_cube --store data/store
+
+Every patient is mapped to one cell of a dense array with one axis per dimension
+(race, ethnicity, gender, age band, city, current payer, risk band) and additive measures
+(patient count, high-risk count, summed risk, cost, payer churn, ...) are accumulated
+with one np.bincount per measure. Any slice or drill-down the admin page asks for
+(e.g. Urban × hispanic × Medicaid) is then a np.take per filtered axis and a sum over
+the rest: the cost depends on the number of cells, not the number of patients.
+
+Setting (Urban / Suburban & rural) is a grouping of the city axis rather than an axis of
+its own: cities holding at least URBAN_MIN_SHARE of the population count as urban.
+Synthea samples patients in proportion to town population, so a city's share of
+patients stands in for its size. Cities beyond the MAX_CITIES largest are folded
+into "Other".
+
+The non-empty cells are persisted as the `cohort_cube` derived table (one int16 code
+column per axis plus the measures, axis labels in the schema metadata) and expanded
+back into the dense float32 array when loaded.
+"""
+import argparse
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from loguru import logger
+
+from utils.care_flow import age_band
+from utils.care_gaps import STATE_TABLE as CARE_GAPS
+from utils.clinical_store import DEFAULT_STORE, ClinicalStore, get_clinical_store
+from utils.continuity import CHURN_YEARS, coverage_continuity
+from utils.insight_store import get_insight_store
+from utils.risk_engine import StageTimer, patient_codes
+
+STATE_TABLE = "cohort_cube"
+DIMENSIONS = ["race", "ethnicity", "gender", "age_band", "city", "payer", "risk_band"]
+DIMENSION_LABELS = {"race": "Race", "ethnicity": "Ethnicity", "gender": "Gender", "age_band": "Age band",
+                    "city": "City", "setting": "Setting", "payer": "Current payer", "risk_band": "Risk band"}
+MEASURES = ["patients", "high_risk", "risk_sum", "hospitalization_sum", "chronic", "acute_visits",
+            "inpatient_stays", "total_cost", "churned", "coverage_gap", "care_gap"]
+MAX_CITIES = 20
+MAX_PAYERS = 12
+URBAN_MIN_SHARE = 0.02
+UNKNOWN = "Unknown"
+OTHER = "Other"
+
+# Display metric -> (numerator measure, denominator measure, scale).
+METRICS = {
+    "Insurance instability (× population)": ("churned", "patients", None),
+    "High risk (%)": ("high_risk", "patients", 100),
+    "Mean risk score": ("risk_sum", "patients", 1),
+    "Mean hospitalization risk": ("hospitalization_sum", "patients", 1),
+    "Chronic condition (%)": ("chronic", "patients", 100),
+    "Acute visits per 100": ("acute_visits", "patients", 100),
+    "Inpatient stays per 100": ("inpatient_stays", "patients", 100),
+    "Cost per patient": ("total_cost", "patients", 1),
+    f"Payer change, last {CHURN_YEARS}y (%)": ("churned", "patients", 100),
+    "Coverage gap (%)": ("coverage_gap", "patients", 100),
+    "Overdue care gap (%)": ("care_gap", "patients", 100),
+}
+
+# Risk ownership lens: (risk type, owning function, measure counting the patients it covers).
+OWNERSHIP = [
+    ("Clinical risk (high risk band)", "Care Management", "high_risk"),
+    ("Screening gaps (overdue guideline care)", "Preventive Programs", "care_gap"),
+    (f"Insurance-driven risk (payer change in the last {CHURN_YEARS} years)", "Revenue Cycle & Payer Ops", "churned"),
+    ("Coverage gaps (uninsured stretches)", "Revenue Cycle & Payer Ops", "coverage_gap"),
+]
+
+
+def encode(values, max_labels=None):
+    """(int codes, labels) for a string column, most frequent first; nulls become UNKNOWN, the tail OTHER."""
+    values = pc.fill_null(pc.cast(values, pa.string()), "")
+    values = pc.if_else(pc.equal(values, ""), UNKNOWN, values)
+    counts = pc.value_counts(values).to_pylist()
+    labels = [c["values"] for c in sorted(counts, key=lambda c: (-c["counts"], c["values"]))]
+    if max_labels is not None and len(labels) > max_labels:
+        labels = labels[:max_labels] + [OTHER]
+    codes = pc.fill_null(pc.index_in(values, value_set=pa.array(labels)), len(labels) - 1).to_numpy()
+    return codes.astype("int64"), labels
+
+
+def encode_ordered(values, order):
+    """(int codes, labels) for values drawn from a fixed `order`; labels keep that order, absent ones dropped."""
+    present = set(pd.unique(values))
+    labels = [label for label in order if label in present]
+    return pd.Categorical(values, categories=labels).codes.astype("int64"), labels
+
+
+def cube_from_codes(axes, measures):
+    """
+    Dense (axis sizes..., len(measures)) float32 array from per-patient axis codes.
+    `axes` maps dimension -> (codes, labels); `measures` maps measure -> per-patient weights.
+    """
+    shape = tuple(len(labels) for _, labels in axes.values())
+    cell = np.ravel_multi_index([codes for codes, _ in axes.values()], shape)
+    size = int(np.prod(shape))
+    data = np.stack([np.bincount(cell, weights=np.asarray(w, dtype="float64"), minlength=size)
+                     for w in measures.values()], axis=-1)
+    return data.astype("float32").reshape(shape + (len(measures),))
+
+
+class CohortCube:
+    """Dense cohort cube plus axis labels; slicing never touches patient rows."""
+
+    def __init__(self, data, labels, groupings=None, meta=None):
+        self.data = data
+        self.labels_by_dim = labels                  # dimension -> list of labels, in axis order
+        self.groupings = groupings or {}             # virtual dimension -> (base dimension, {base label: group})
+        self.meta = meta or {}
+        self._axis = {dim: i for i, dim in enumerate(labels)}
+        self._measure = {m: i for i, m in enumerate(MEASURES)}
+
+    def dimensions(self):
+        return list(self.labels_by_dim) + list(self.groupings)
+
+    def labels(self, dim):
+        if dim in self.groupings:
+            base, group_of = self.groupings[dim]
+            return list(dict.fromkeys(group_of[label] for label in self.labels_by_dim[base]))
+        return list(self.labels_by_dim[dim])
+
+    def _keep(self, filters):
+        """Kept label positions per axis for {dimension: [labels]} filters."""
+        keep = {dim: np.ones(len(labels), dtype=bool) for dim, labels in self.labels_by_dim.items()}
+        for dim, chosen in (filters or {}).items():
+            if not chosen:
+                continue
+            if dim in self.groupings:
+                base, group_of = self.groupings[dim]
+                keep[base] &= np.array([group_of[label] in chosen for label in self.labels_by_dim[base]])
+            else:
+                keep[dim] &= np.isin(np.array(self.labels_by_dim[dim], dtype=object), list(chosen))
+        return {dim: np.flatnonzero(mask) for dim, mask in keep.items()}
+
+    def aggregate(self, by=(), filters=None):
+        """Measure sums (and display metrics) per combination of `by` dimensions, empty groups dropped."""
+        by = list(by)
+        keep = self._keep(filters)
+        bases = list(dict.fromkeys(self.groupings[d][0] if d in self.groupings else d for d in by))
+        data = self.data
+        for dim, index in keep.items():
+            if len(index) < data.shape[self._axis[dim]]:
+                data = np.take(data, index, axis=self._axis[dim])
+        others = tuple(self._axis[d] for d in self.labels_by_dim if d not in bases)
+        data = data.sum(axis=others, dtype="float64")
+        kept_bases = [d for d in self.labels_by_dim if d in bases]          # remaining axes, in axis order
+        frame = pd.DataFrame(data.reshape(-1, len(MEASURES)), columns=MEASURES)
+        if kept_bases:
+            index = pd.MultiIndex.from_product(
+                [[self.labels_by_dim[d][i] for i in keep[d]] for d in kept_bases], names=kept_bases)
+            frame = pd.concat([index.to_frame(index=False), frame], axis=1)
+            for dim in by:
+                if dim in self.groupings:
+                    base, group_of = self.groupings[dim]
+                    frame[dim] = frame[base].map(group_of)
+            frame = frame.groupby(by, sort=False)[MEASURES].sum().reset_index()
+        frame = frame[frame["patients"] > 0].reset_index(drop=True)
+        return self._with_metrics(frame)
+
+    def _with_metrics(self, frame):
+        total = self.data[..., self._measure["patients"]].sum(dtype="float64")
+        population_churn = self.data[..., self._measure["churned"]].sum(dtype="float64") / total if total else 0.0
+        for name, (numerator, denominator, scale) in METRICS.items():
+            rate = frame[numerator] / frame[denominator]
+            if scale is None:
+                # Relative to the whole population, so 1.5 reads "1.5x the average rate".
+                rate = rate / population_churn if population_churn else rate * np.nan
+            else:
+                rate = rate * scale
+            frame[name] = rate.round(2)
+        return frame
+
+    def pivot(self, rows, columns, metric, filters=None):
+        """rows × columns matrix of one display metric (NaN where a combination has no patients)."""
+        if rows == columns:
+            frame = self.aggregate([rows], filters)
+            return frame.set_index(rows)[[metric]].rename(columns={metric: DIMENSION_LABELS.get(rows, rows)})
+        frame = self.aggregate([rows, columns], filters)
+        matrix = frame.pivot(index=rows, columns=columns, values=metric)
+        return matrix.reindex(index=[l for l in self.labels(rows) if l in matrix.index],
+                              columns=[l for l in self.labels(columns) if l in matrix.columns])
+
+    def ownership_lens(self, filters=None):
+        """Risk ownership lens for the selected cohort: patients each owning function is accountable for."""
+        total = self.aggregate((), filters)
+        patients = float(total["patients"].iloc[0]) if len(total) else 0.0
+        rows = []
+        for kind, owner, measure in OWNERSHIP:
+            count = float(total[measure].iloc[0]) if len(total) else 0.0
+            rows.append({"type": kind, "ownership": owner, "patients": int(round(count)),
+                         "share (%)": round(100 * count / patients, 1) if patients else 0.0})
+        return pd.DataFrame(rows)
+
+    def to_table(self):
+        patients = self.data[..., self._measure["patients"]]
+        cells = np.flatnonzero(patients.reshape(-1) > 0)
+        coordinates = np.unravel_index(cells, patients.shape)
+        flat = self.data.reshape(-1, len(MEASURES))[cells]
+        columns = {dim: pa.array(c.astype("int16")) for dim, c in zip(self.labels_by_dim, coordinates)}
+        columns.update({m: pa.array(flat[:, i].astype("float64")) for i, m in enumerate(MEASURES)})
+        meta = dict(self.meta, labels=self.labels_by_dim,
+                    groupings={d: [base, group_of] for d, (base, group_of) in self.groupings.items()})
+        return pa.table(columns).replace_schema_metadata({"cohort_cube": json.dumps(meta)})
+
+    @classmethod
+    def from_table(cls, table):
+        meta = json.loads(table.schema.metadata[b"cohort_cube"])
+        labels = meta.pop("labels")
+        groupings = {d: (base, group_of) for d, (base, group_of) in meta.pop("groupings").items()}
+        shape = tuple(len(v) for v in labels.values())
+        data = np.zeros(shape + (len(MEASURES),), dtype="float32")
+        coordinates = tuple(table.column(dim).to_numpy().astype("int64") for dim in labels)
+        data[coordinates] = np.stack([table.column(m).to_numpy() for m in MEASURES], axis=-1)
+        return cls(data, labels, groupings, meta)
+
+
+def build(store, as_of=None, timer=None):
+    """Aggregate every patient of `store` into a CohortCube (needs the risk_scores derived table)."""
+    timer = timer or StageTimer()
+    with timer.stage("load"):
+        patients = store.read_table("patients", ["Id", "RACE", "ETHNICITY", "GENDER", "CITY"])
+        scores = store.read_derived("risk_scores")
+        if patients is None or scores is None:
+            raise ValueError(f"Store {store.root} needs patients and risk_scores (run utils.risk_engine first)")
+        transitions = store.read_table("payer_transitions", ["PATIENT", "START_YEAR", "END_YEAR", "PAYER"])
+        gaps = store.read_derived(CARE_GAPS)
+        patient_ids = patients.column("Id").combine_chunks()
+        n = len(patient_ids)
+        if as_of is None:
+            encounters = store.read_table("encounters", ["START"])
+            latest = pc.max(encounters.column("START")).as_py() if encounters is not None else None
+            as_of = latest or pd.Timestamp.now()
+        today = int(np.datetime64(pd.Timestamp(as_of).date(), "D").astype("int64"))
+
+    with timer.stage("features"):
+        position = patient_codes(patient_ids, scores.column("patient_id"))
+        scored = position >= 0
+
+        def per_patient(column, fill):
+            out = np.full(n, fill, dtype=object if isinstance(fill, str) else "float64")
+            out[position[scored]] = scores.column(column).to_numpy(zero_copy_only=False)[scored]
+            return out
+
+        risk_band = per_patient("risk_band", UNKNOWN)
+        age = per_patient("age", -1.0)
+        coverage, _, _ = coverage_continuity(patient_ids, transitions, today, n)
+        payers = store.reference("payers")
+        names = dict(zip(payers["Id"], payers["NAME"])) if not payers.empty else {}
+        payer = pd.Series(coverage["current_payer"]).map(lambda p: names.get(p, p) if p else UNKNOWN).to_numpy(dtype=object)
+        overdue = np.zeros(n)
+        if gaps is not None:
+            gap_codes = patient_codes(patient_ids, gaps.column("patient_id"))
+            overdue = np.bincount(gap_codes[(gap_codes >= 0) & gaps.column("overdue").to_numpy(zero_copy_only=False)],
+                                  minlength=n) > 0
+
+        city_codes, cities = encode(patients.column("CITY"), MAX_CITIES)
+        share = np.bincount(city_codes, minlength=len(cities)) / max(n, 1)
+        setting = {city: ("Urban" if city not in (UNKNOWN, OTHER) and s >= URBAN_MIN_SHARE else "Suburban & rural")
+                   for city, s in zip(cities, share)}
+        axes = {
+            "race": encode(patients.column("RACE")),
+            "ethnicity": encode(patients.column("ETHNICITY")),
+            "gender": encode(patients.column("GENDER")),
+            "age_band": encode_ordered(np.where(age < 0, UNKNOWN, age_band(np.maximum(age, 0))).astype(object),
+                                       ["0-17", "18-44", "45-64", "65+", UNKNOWN]),
+            "city": (city_codes, cities),
+            "payer": encode(pa.array(payer, pa.string()), MAX_PAYERS),
+            "risk_band": encode_ordered(risk_band, ["high", "medium", "low", UNKNOWN]),
+        }
+        measures = {
+            "patients": np.ones(n),
+            "high_risk": risk_band == "high",
+            "risk_sum": np.nan_to_num(per_patient("risk_score", 0.0)),
+            "hospitalization_sum": np.nan_to_num(per_patient("hospitalization_risk", 0.0)),
+            "chronic": per_patient("chronic_conditions", 0.0) > 0,
+            "acute_visits": per_patient("acute_visits", 0.0),
+            "inpatient_stays": per_patient("inpatient_stays", 0.0),
+            "total_cost": np.nan_to_num(per_patient("total_cost", 0.0)),
+            "churned": coverage["recent_payer_changes"] > 0,
+            "coverage_gap": coverage["coverage_gaps"] > 0,
+            "care_gap": overdue,
+        }
+
+    with timer.stage("aggregate"):
+        data = cube_from_codes(axes, measures)
+    meta = {"patients": int(n), "as_of": str(pd.Timestamp(as_of).date()), "generation": store.generation}
+    return CohortCube(data, {dim: labels for dim, (_, labels) in axes.items()}, {"setting": ("city", setting)}, meta)
+
+
+def run(store_root=DEFAULT_STORE, as_of=None, publish=True):
+    """Build the cube for a store, persist it as the `cohort_cube` derived table and record the run."""
+    store = ClinicalStore(store_root)
+    timer = StageTimer()
+    cube = build(store, as_of, timer)
+    with timer.stage("persist"):
+        table = cube.to_table()
+        store.write_derived(STATE_TABLE, table)
+    if publish:
+        get_insight_store().publish("engine_runs", {"cohort_cube": {
+            "patients": cube.meta["patients"],
+            "cells": table.num_rows,
+            "generation": store.generation,
+            "stages_seconds": timer.stages,
+        }})
+    logger.info(f"Cohort cube for {cube.meta['patients']:,} patients: {table.num_rows:,} non-empty cells of "
+                f"{int(np.prod(cube.data.shape[:-1])):,}; stage timings (s): {timer.stages}")
+    return cube
+
+
+_cube = None
+_cube_version = None
+_cube_lock = threading.Lock()
+
+
+def get_cohort_cube(store=None):
+    """Shared CohortCube over the latest cube run, or None if it has not been built."""
+    global _cube, _cube_version
+    store = store or get_clinical_store()
+    version = (store.root, store.derived_version(STATE_TABLE))
+    if version != _cube_version:
+        with _cube_lock:
+            if version != _cube_version:
+                table = store.read_derived(STATE_TABLE)
+                _cube = CohortCube.from_table(table) if table is not None else None
+                _cube_version = version
+    return _cube
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the cohort aggregation cube behind the admin equity views.")
+    parser.add_argument("--store", default=os.getenv("CLINICAL_STORE_DIR", DEFAULT_STORE), help="Clinical store directory")
+    parser.add_argument("--as-of", default=None, help="Reference date (default: latest encounter)")
+    parser.add_argument("--no-publish", action="store_true", help="Only write the derived table; leave the insight store alone")
+    args = parser.parse_args(argv)
+    run(args.store, args.as_of, publish=not args.no_publish)
+
+
+if __name__ == "__main__":
+    main()
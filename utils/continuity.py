@@ -0,0 +1,416 @@
+# utils/continuity.py
+"""
+Medication continuity and insurance churn over the clinical store.
+
+    python -m utils.continuity --store data/store
+
+Medication: Synthea records how many times a prescription was filled (DISPENSES), not
+when, so each prescription's fills are spread evenly over its START..STOP period (open
+prescriptions run to `as_of`), each supplying DAYS_PER_DISPENSE days. Within the last
+LOOKBACK_DAYS the fill intervals of every (patient, medication) are sorted once and
+unioned with a running maximum of interval ends; from that single pass come the
+proportion of days covered (PDC), the interruptions (uncovered stretches of at least
+INTERRUPTION_DAYS) and the days without supply.
+
+Coverage: payer_transitions rows become [Jan 1 START_YEAR, Jan 1 END_YEAR + 1) intervals,
+unioned the same way to find uncovered stretches; consecutive rows with different payers
+are payer changes. Medication interruptions that start within SWITCH_WINDOW_DAYS of a
+payer change are counted separately: the churn-driven non-adherence the admin
+insurance story is about.
+
+Outputs (derived tables): `medication_continuity` (one row per patient and medication),
+`coverage_continuity` (one row per patient) and `continuity_cohorts` (the per-patient
+numbers aggregated over the same cohorts as the care-flow filter, plus current payer).
+"""
+import argparse
+import os
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from loguru import logger
+
+from utils.care_flow import age_band
+from utils.clinical_store import DEFAULT_STORE, ClinicalStore, get_clinical_store
+from utils.insight_store import get_insight_store
+from utils.risk_engine import StageTimer, patient_codes
+
+LOOKBACK_DAYS = 365
+DAYS_PER_DISPENSE = 30
+INTERRUPTION_DAYS = 30
+ADHERENT_PDC = 0.8
+SWITCH_WINDOW_DAYS = 90
+CHURN_YEARS = 3
+MISSING = -(2 ** 40)     # day number standing in for null dates (real ones before 1970 are negative)
+MEDICATION_TABLE = "medication_continuity"
+COVERAGE_TABLE = "coverage_continuity"
+COHORT_TABLE = "continuity_cohorts"
+
+
+def _days(column):
+    """Arrow timestamps as int64 days since the epoch (MISSING for nulls)."""
+    ms = pc.fill_null(pc.cast(pc.cast(column, pa.timestamp("ms")), pa.int64()), MISSING).to_numpy()
+    return np.where(ms == MISSING, MISSING, ms // 86_400_000)
+
+
+def _year_start(years):
+    return (np.asarray(years, dtype="int64") - 1970).astype("datetime64[Y]").astype("datetime64[D]").astype("int64")
+
+
+def union_intervals(group, start, end):
+    """
+    Sorted-array union of half-open intervals per group. `group` must be sorted and `start`
+    sorted within each group. Returns (covered days per row, uncovered days before each row
+    within its group, running end before each row; its own start for a group's first row).
+    """
+    first = np.ones(len(group), dtype=bool)
+    first[1:] = group[1:] != group[:-1]
+    # Running max of ends within each group: lift every group above the previous one so a
+    # single np.maximum.accumulate over the whole array never leaks across groups.
+    low = min(start.min(initial=0), end.min(initial=0))
+    span = int(max(end.max(initial=0), start.max(initial=0)) - low) + 1
+    lift = group.astype("int64") * span - low
+    reach = np.maximum.accumulate(lift + end) - lift
+    before = np.empty_like(reach)
+    before[1:] = reach[:-1]
+    before[first] = start[first]
+    covered = np.maximum(end - np.maximum(start, before), 0)
+    gap = np.where(first, 0, np.maximum(start - before, 0))
+    return covered, gap, before
+
+
+def _group_sums(group, values, n):
+    return np.bincount(group, weights=values, minlength=n)
+
+
+def medication_continuity(patient_ids, medications, today):
+    """
+    Per (patient, medication) PDC, interruptions and gap days over the lookback window, plus
+    (patient code, first uncovered day) of every interruption.
+    """
+    window = today - LOOKBACK_DAYS
+    codes = patient_codes(patient_ids, medications.column("PATIENT"))
+    start = _days(medications.column("START"))
+    stop = _days(medications.column("STOP"))
+    ongoing = stop == MISSING
+    stop = np.where(ongoing, today, np.minimum(stop, today))
+    keep = (codes >= 0) & (start != MISSING) & (start <= today) & (stop >= window)
+    encoded = pc.dictionary_encode(pc.fill_null(medications.column("DESCRIPTION"), "Unknown")).combine_chunks()
+    drug, drug_names = encoded.indices.to_numpy(), encoded.dictionary
+    fills = np.maximum(pc.fill_null(pc.cast(medications.column("DISPENSES"), pa.float64()), 1.0).to_numpy(), 1.0)
+
+    rows = np.flatnonzero(keep)
+    key = codes[rows].astype("int64") * len(drug_names) + drug[rows]
+    groups, group = np.unique(key, return_inverse=True)
+    count = fills[rows].astype("int64")
+    # One interval per fill, spread evenly over the prescription period.
+    owner = np.repeat(np.arange(len(rows)), count)
+    nth = np.arange(len(owner)) - np.repeat(np.cumsum(count) - count, count)
+    step = (stop[rows] - start[rows]) / count
+    fill_start = start[rows][owner] + np.floor(nth * step[owner]).astype("int64")
+    fill_end = np.minimum(fill_start + DAYS_PER_DISPENSE, stop[rows][owner])
+    # Clip to the window; fills that ran out before it become empty intervals.
+    fill_start, fill_end = np.clip(fill_start, window, today), np.clip(fill_end, window, today)
+    fill_group = group[owner]
+    order = np.lexsort((fill_start, fill_group))
+    fill_group, fill_start, fill_end = fill_group[order], fill_start[order], fill_end[order]
+    covered, gap, _ = union_intervals(fill_group, fill_start, fill_end)
+
+    g = len(groups)
+    period_start = np.full(g, today, dtype="int64")
+    np.minimum.at(period_start, group, np.maximum(start[rows], window))
+    period_end = np.zeros(g, dtype="int64")
+    np.maximum.at(period_end, group, np.where(ongoing[rows], today, stop[rows]))
+    is_ongoing = np.zeros(g, dtype=bool)
+    np.logical_or.at(is_ongoing, group, ongoing[rows])
+    reach = np.full(g, window, dtype="int64")
+    np.maximum.at(reach, fill_group, fill_end)
+    covered_days = _group_sums(fill_group, covered, g)
+    period_days = np.maximum(period_end - period_start, 1)
+    trailing = np.maximum(period_end - reach, 0)
+    interruptions = _group_sums(fill_group, (gap >= INTERRUPTION_DAYS).astype("float64"), g) + (trailing >= INTERRUPTION_DAYS)
+    gap_days = _group_sums(fill_group, gap, g) + trailing
+    # Where each interruption starts, for matching against payer changes.
+    breaks = np.flatnonzero(gap >= INTERRUPTION_DAYS)
+    break_day = fill_start[breaks] - gap[breaks]
+    break_group = fill_group[breaks]
+    tail = np.flatnonzero(trailing >= INTERRUPTION_DAYS)
+
+    pdc = np.minimum(covered_days / period_days, 1.0)
+    return pd.DataFrame({
+        "patient": (groups // len(drug_names)).astype("int64"),
+        "medication": drug_names.take(pa.array(groups % len(drug_names))).to_numpy(zero_copy_only=False),
+        "measured_from": period_start,
+        "pdc": pdc.round(3),
+        "covered_days": covered_days,
+        "period_days": period_days,
+        "interruptions": interruptions.astype("int32"),
+        "gap_days": gap_days.astype("int32"),
+        "ongoing": is_ongoing,
+    }), np.concatenate([groups[break_group], groups[tail]]) // len(drug_names), np.concatenate([break_day, reach[tail]])
+
+
+def coverage_continuity(patient_ids, transitions, today, n):
+    """Per patient payer changes, coverage gaps and current payer from payer_transitions (may be None)."""
+    if transitions is None:
+        transitions = pa.table({"PATIENT": pa.array([], pa.string()), "START_YEAR": pa.array([], pa.int64()),
+                                "END_YEAR": pa.array([], pa.int64()), "PAYER": pa.array([], pa.string())})
+    codes = patient_codes(patient_ids, transitions.column("PATIENT"))
+    first_year = pc.fill_null(pc.cast(transitions.column("START_YEAR"), pa.int64()), 0).to_numpy()
+    last_year = pc.fill_null(pc.cast(transitions.column("END_YEAR"), pa.int64()), 0).to_numpy()
+    keep = (codes >= 0) & (first_year > 0) & (last_year >= first_year)
+    codes, first_year, last_year = codes[keep].astype("int64"), first_year[keep], last_year[keep]
+    payer = pc.fill_null(transitions.column("PAYER"), "").to_numpy(zero_copy_only=False)[keep]
+    start = _year_start(first_year)
+    end = np.minimum(_year_start(last_year + 1), today)
+    keep = start <= today
+    codes, start, end, payer = codes[keep], start[keep], end[keep], payer[keep]
+    order = np.lexsort((start, codes))
+    codes, start, end, payer = codes[order], start[order], end[order], payer[order]
+    _, gap, _ = union_intervals(codes, start, end)
+
+    first = np.ones(len(codes), dtype=bool)
+    first[1:] = codes[1:] != codes[:-1]
+    switch = ~first & (payer != np.roll(payer, 1))
+    reach = np.full(n, MISSING, dtype="int64")
+    np.maximum.at(reach, codes, end)
+    has_record = reach != MISSING
+    trailing = np.where(has_record, np.maximum(today - reach, 0), 0)
+    current = np.full(n, "", dtype=object)
+    current[codes] = payer        # sorted by start, so the last write per patient is the latest payer
+    recent = switch & (start >= today - int(CHURN_YEARS * 365.25))
+    return {
+        "has_coverage_record": has_record,
+        "covered_now": has_record & (trailing == 0),
+        "current_payer": current,
+        "payer_changes": np.bincount(codes[switch], minlength=n).astype("int32"),
+        "recent_payer_changes": np.bincount(codes[recent], minlength=n).astype("int32"),
+        "coverage_gaps": (np.bincount(codes[gap > 0], minlength=n) + (trailing > 0)).astype("int32"),
+        "coverage_gap_days": (np.bincount(codes, weights=gap, minlength=n) + trailing).astype("int32"),
+    }, codes[switch], start[switch]
+
+
+def near_switch(break_patient, break_day, switch_patient, switch_day):
+    """For each medication interruption: did the same patient change payer within SWITCH_WINDOW_DAYS?"""
+    if not len(switch_patient) or not len(break_patient):
+        return np.zeros(len(break_patient), dtype=bool)
+    low = min(break_day.min(), switch_day.min()) - SWITCH_WINDOW_DAYS
+    span = int(max(break_day.max(), switch_day.max()) - low) + SWITCH_WINDOW_DAYS + 1
+    switches = np.sort(switch_patient * span + switch_day - low)
+    probe = break_patient * span + break_day - low
+    i = np.searchsorted(switches, probe - SWITCH_WINDOW_DAYS, side="left")
+    j = np.searchsorted(switches, probe + SWITCH_WINDOW_DAYS, side="right")
+    return j > i
+
+
+def cohort_masks(patients, risk_scores, current_payer, payer_names, today):
+    """(label, boolean mask) pairs: the care-flow cohorts plus current payer."""
+    n = patients.num_rows
+    cohorts = [("All patients", np.ones(n, dtype=bool))]
+    gender = pc.fill_null(patients.column("GENDER"), "").to_numpy(zero_copy_only=False)
+    cohorts += [(f"Gender: {g}", gender == g) for g in sorted(set(gender) - {""})]
+    birth = _days(patients.column("BIRTHDATE"))
+    known = birth != MISSING
+    bands = age_band(np.where(known, (today - birth) / 365.25, -1))
+    cohorts += [(f"Age: {b}", (bands == b) & known) for b in ["0-17", "18-44", "45-64", "65+"]]
+    if risk_scores is not None:
+        position = patient_codes(patients.column("Id").combine_chunks(), risk_scores.column("patient_id"))
+        band = np.full(n, "", dtype=object)
+        band[position[position >= 0]] = risk_scores.column("risk_band").to_numpy(zero_copy_only=False)[position >= 0]
+        cohorts += [(f"Risk: {b}", band == b) for b in ["high", "medium", "low"]]
+    for payer in sorted(set(current_payer) - {""}):
+        cohorts.append((f"Payer: {payer_names.get(payer, payer)}", current_payer == payer))
+    return cohorts
+
+
+def run(store_root=DEFAULT_STORE, as_of=None, publish=True):
+    """Compute continuity for every patient, persist the three derived tables and record the run."""
+    store = ClinicalStore(store_root)
+    timer = StageTimer()
+    with timer.stage("load"):
+        patients = store.read_table("patients", ["Id", "BIRTHDATE", "GENDER"])
+        medications = store.read_table("medications", ["PATIENT", "START", "STOP", "DESCRIPTION", "DISPENSES"])
+        transitions = store.read_table("payer_transitions", ["PATIENT", "START_YEAR", "END_YEAR", "PAYER"])
+        if patients is None:
+            raise ValueError(f"Store {store.root} has no patients")
+        patient_ids = patients.column("Id").combine_chunks()
+        n = len(patient_ids)
+        if as_of is None:
+            encounters = store.read_table("encounters", ["START"])
+            latest = pc.max(encounters.column("START")).as_py() if encounters is not None else None
+            as_of = latest or pd.Timestamp.now()
+        today = int(np.datetime64(pd.Timestamp(as_of).date(), "D").astype("int64"))
+
+    with timer.stage("medications"):
+        if medications is not None and "DISPENSES" in medications.column_names:
+            per_drug, break_patient, break_day = medication_continuity(patient_ids, medications, today)
+        else:
+            per_drug = pd.DataFrame({"patient": pd.Series(dtype="int64"), "medication": pd.Series(dtype=object),
+                                     "measured_from": pd.Series(dtype="int64"), "pdc": pd.Series(dtype="float64"),
+                                     "covered_days": pd.Series(dtype="float64"), "period_days": pd.Series(dtype="int64"),
+                                     "interruptions": pd.Series(dtype="int32"), "gap_days": pd.Series(dtype="int32"),
+                                     "ongoing": pd.Series(dtype=bool)})
+            break_patient, break_day = np.empty(0, dtype="int64"), np.empty(0, dtype="int64")
+
+    with timer.stage("coverage"):
+        coverage, switch_patient, switch_day = coverage_continuity(patient_ids, transitions, today, n)
+        churned = near_switch(break_patient, break_day, switch_patient, switch_day)
+
+    with timer.stage("per_patient"):
+        drug_patient = per_drug["patient"].to_numpy()
+        # Patient PDC pools every medication's days: supplied days over days on therapy.
+        period = np.bincount(drug_patient, weights=per_drug["period_days"], minlength=n)
+        supplied = np.bincount(drug_patient, weights=per_drug["covered_days"], minlength=n)
+        on_medication = period > 0
+        pdc = np.where(on_medication, np.minimum(supplied / np.maximum(period, 1), 1.0), np.nan)
+        patients_frame = pd.DataFrame({
+            "patient_id": patient_ids.to_numpy(zero_copy_only=False),
+            "medications": np.bincount(drug_patient, minlength=n).astype("int32"),
+            "pdc": pdc.round(3),
+            "adherent": on_medication & (np.nan_to_num(pdc) >= ADHERENT_PDC),
+            "interruptions": np.bincount(drug_patient, weights=per_drug["interruptions"], minlength=n).astype("int32"),
+            "medication_gap_days": np.bincount(drug_patient, weights=per_drug["gap_days"], minlength=n).astype("int32"),
+            "interruptions_near_payer_change": np.bincount(break_patient[churned], minlength=n).astype("int32"),
+            **coverage,
+        })
+        per_drug.insert(0, "patient_id", patients_frame["patient_id"].to_numpy()[drug_patient])
+        per_drug["measured_from"] = per_drug["measured_from"].to_numpy().astype("datetime64[D]")
+        per_drug["continuity"] = np.select(
+            [~per_drug["ongoing"], (per_drug["pdc"] >= ADHERENT_PDC) & (per_drug["interruptions"] == 0)],
+            ["Stopped", "Stable"], default="Interrupted")
+        per_drug = per_drug.drop(columns=["patient", "covered_days", "period_days"]).sort_values(["patient_id", "medication"], ignore_index=True)
+
+    with timer.stage("cohorts"):
+        payers = store.reference("payers")
+        names = dict(zip(payers["Id"], payers["NAME"])) if not payers.empty else {}
+        rows = []
+        for label, mask in cohort_masks(patients, store.read_derived("risk_scores"), coverage["current_payer"], names, today):
+            members = int(mask.sum())
+            if not members:
+                continue
+            treated = mask & on_medication
+            rows.append({
+                "cohort": label,
+                "patients": members,
+                "on_medication": int(treated.sum()),
+                "mean_pdc": round(float(np.nanmean(pdc[treated])), 3) if treated.any() else None,
+                "adherent_pct": round(100 * float(patients_frame["adherent"].to_numpy()[treated].mean()), 1) if treated.any() else None,
+                "interrupted_pct": round(100 * float((patients_frame["interruptions"].to_numpy()[treated] > 0).mean()), 1) if treated.any() else None,
+                "churned_pct": round(100 * float((coverage["recent_payer_changes"][mask] > 0).mean()), 1),
+                "coverage_gap_pct": round(100 * float((coverage["coverage_gaps"][mask] > 0).mean()), 1),
+                "interrupted_near_payer_change_pct": round(100 * float(
+                    (patients_frame["interruptions_near_payer_change"].to_numpy()[treated] > 0).mean()), 1) if treated.any() else None,
+            })
+        cohorts = pd.DataFrame(rows)
+
+    with timer.stage("persist"):
+        store.write_derived(MEDICATION_TABLE, pa.Table.from_pandas(per_drug, preserve_index=False))
+        store.write_derived(COVERAGE_TABLE, pa.Table.from_pandas(
+            patients_frame.sort_values("patient_id", ignore_index=True), preserve_index=False))
+        store.write_derived(COHORT_TABLE, pa.Table.from_pandas(cohorts, preserve_index=False))
+    if publish:
+        get_insight_store().publish("engine_runs", {"continuity": {
+            "patients": n,
+            "patient_medications": len(per_drug),
+            "generation": store.generation,
+            "stages_seconds": timer.stages,
+        }})
+    logger.info(f"Continuity for {n:,} patients ({len(per_drug):,} patient-medications); "
+                f"stage timings (s): {timer.stages}")
+    return patients_frame, per_drug, cohorts
+
+
+class ContinuityTables:
+    """Read side of the continuity derived tables: per-patient panels and the cohort table."""
+
+    def __init__(self, medications, coverage, cohorts):
+        self.medications = medications
+        self.coverage = coverage
+        self.cohorts = cohorts.to_pandas() if cohorts is not None else pd.DataFrame()
+        # Both per-patient tables are sorted by patient_id: one patient is a contiguous slice.
+        self._medication_ids = medications.column("patient_id").to_numpy(zero_copy_only=False).astype("S")
+        self._coverage_ids = coverage.column("patient_id").to_numpy(zero_copy_only=False).astype("S")
+
+    @staticmethod
+    def _slice(table, ids, patient_id):
+        key = str(patient_id).encode("utf-8")
+        lo, hi = np.searchsorted(ids, key, side="left"), np.searchsorted(ids, key, side="right")
+        return table.slice(lo, hi - lo)
+
+    def medication_panel(self, patient_id):
+        """Medications active in the lookback window, in the doctor panel's columns."""
+        rows = self._slice(self.medications, self._medication_ids, patient_id).to_pandas()
+        return pd.DataFrame({
+            "Medication": rows["medication"],
+            "Measured from": pd.to_datetime(rows["measured_from"]).dt.date,
+            "PDC (%)": (100 * rows["pdc"]).round().astype("Int64"),
+            "Interruptions": rows["interruptions"].astype("Int64"),
+            "Continuity": rows["continuity"],
+        })
+
+    def cohort_rates(self):
+        """The cohort aggregates with display column names for the admin view."""
+        return self.cohorts.rename(columns={
+            "cohort": "Cohort",
+            "patients": "Patients",
+            "on_medication": "On medication",
+            "mean_pdc": "Mean PDC",
+            "adherent_pct": f"Adherent, PDC ≥ {ADHERENT_PDC:.0%} (%)",
+            "interrupted_pct": "Interrupted (%)",
+            "churned_pct": f"Changed payer, last {CHURN_YEARS}y (%)",
+            "coverage_gap_pct": "Coverage gap (%)",
+            "interrupted_near_payer_change_pct": "Interruption near payer change (%)",
+        })
+
+    def coverage_summary(self, patient_id):
+        """One-line coverage and continuity summary for the doctor view, or None."""
+        rows = self._slice(self.coverage, self._coverage_ids, patient_id).to_pylist()
+        if not rows:
+            return None
+        r = rows[0]
+        parts = [f"{r['payer_changes']} payer change(s), {r['recent_payer_changes']} in the last {CHURN_YEARS} years"]
+        if not r["has_coverage_record"]:
+            parts = ["No coverage on record"]
+        elif r["coverage_gaps"]:
+            parts.append(f"{r['coverage_gaps']} coverage gap(s) totalling {r['coverage_gap_days']} days"
+                         + ("" if r["covered_now"] else ", currently uncovered"))
+        if r["medications"]:
+            parts.append(f"medication PDC {100 * r['pdc']:.0f}% over the last {LOOKBACK_DAYS} days")
+        if r["interruptions_near_payer_change"]:
+            parts.append(f"{r['interruptions_near_payer_change']} medication interruption(s) within "
+                         f"{SWITCH_WINDOW_DAYS} days of a payer change")
+        return "; ".join(parts) + "."
+
+
+_tables = None
+_tables_version = None
+_tables_lock = threading.Lock()
+
+
+def get_continuity(store=None):
+    """Shared ContinuityTables over the latest continuity run, or None if the engine has not run."""
+    global _tables, _tables_version
+    store = store or get_clinical_store()
+    version = (store.root,) + tuple(store.derived_version(t) for t in (MEDICATION_TABLE, COVERAGE_TABLE, COHORT_TABLE))
+    if version != _tables_version:
+        with _tables_lock:
+            if version != _tables_version:
+                medications, coverage = store.read_derived(MEDICATION_TABLE), store.read_derived(COVERAGE_TABLE)
+                _tables = (ContinuityTables(medications, coverage, store.read_derived(COHORT_TABLE))
+                           if medications is not None and coverage is not None else None)
+                _tables_version = version
+    return _tables
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Medication continuity and insurance churn for the whole population.")
+    parser.add_argument("--store", default=os.getenv("CLINICAL_STORE_DIR", DEFAULT_STORE), help="Clinical store directory")
+    parser.add_argument("--as-of", default=None, help="Reference date (default: latest encounter)")
+    parser.add_argument("--no-publish", action="store_true", help="Only write the derived tables; leave the insight store alone")
+    args = parser.parse_args(argv)
+    run(args.store, args.as_of, publish=not args.no_publish)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+# utils/derivation.py
+import asyncio
+import os
+import threading
+import time
+from loguru import logger
+
+from utils.insight_store import get_insight_store
+from utils.llm_cache import STALE, get_llm_cache
+
+SIMULATED_RESPONSE = "Simulated AI response for query: '{query}' (enable LLM for real derivation)."
+FAILED_RESPONSE = "Unable to derive insight at this time."
+INCOMPLETE_SUFFIX = " … (response incomplete)"
+
+
+def normalize_prompt(prompt):
+    """Prompts differing only in whitespace are the same request."""
+    return " ".join(str(prompt).split())
+
+
+class Derivation:
+    """
+    One upstream completion, shared by every caller that asked for the same prompt while
+    it was in flight. Chunks are appended by the event loop thread and read by any number
+    of Streamlit script threads; late joiners replay from the first chunk.
+    """
+
+    def __init__(self, prompt, cached=None):
+        self.prompt = prompt
+        self.cached = cached          # None (upstream call), "fresh" or "stale" (served from the cache)
+        self.started = time.monotonic()
+        self.finished = None
+        self.error = None
+        self._chunks = []
+        self._done = False
+        self._cond = threading.Condition()
+
+    def _append(self, text):
+        with self._cond:
+            self._chunks.append(text)
+            self._cond.notify_all()
+
+    def _finish(self, error=None):
+        with self._cond:
+            self.error = error
+            self._done = True
+            self.finished = time.monotonic()
+            self._cond.notify_all()
+
+    @classmethod
+    def completed(cls, prompt, text, cached):
+        derivation = cls(prompt, cached)
+        derivation._append(text)
+        derivation._finish()
+        return derivation
+
+    @property
+    def done(self):
+        return self._done
+
+    def stream(self, timeout=None):
+        """Yield text chunks as they arrive; `timeout` bounds each wait for the next chunk."""
+        position = 0
+        while True:
+            with self._cond:
+                if position >= len(self._chunks) and not self._done:
+                    if not self._cond.wait_for(lambda: position < len(self._chunks) or self._done, timeout):
+                        raise TimeoutError(f"No response for prompt within {timeout}s")
+                fresh = self._chunks[position:]
+                finished = self._done
+            position += len(fresh)
+            yield from fresh
+            if finished and position >= len(self._chunks):
+                return
+
+    def result(self, timeout=None):
+        return "".join(self.stream(timeout))
+
+
+def make_client():
+    """(client, model) from the environment; client is None when no LLM is configured."""
+    # Imported here: openai takes ~0.7s to import and the login page never needs it.
+    from openai import AsyncAzureOpenAI, AsyncOpenAI
+
+    base_url = os.getenv("LLM_BASE_URL")
+    if base_url:
+        # Any OpenAI-compatible endpoint, e.g. utils.mock_llm_server.
+        return AsyncOpenAI(base_url=base_url, api_key=os.getenv("OPENAI_API_KEY") or "mock"), \
+            os.getenv("DEPLOYMENT") or "mock"
+    endpoint = os.getenv("LLM_ENDPOINT") or os.getenv("AZURE_OPENAI_ENDPOINT")
+    if os.getenv("OPENAI_API_KEY") and endpoint:
+        return AsyncAzureOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            azure_endpoint=endpoint,
+            api_version=os.getenv("OPENAI_API_VERSION"),
+        ), os.getenv("DEPLOYMENT")
+    return None, None
+
+
+class DerivationService:
+    """
+    Runs LLM derivations on a private asyncio loop (one daemon thread per process), so a
+    Streamlit rerun can submit all of its prompts at once and stream the answers instead
+    of blocking on each call in turn. At most `concurrency` upstream calls run at a time,
+    each bounded by `timeout` seconds, and identical in-flight prompts from any session
+    share one upstream call.
+
+    With a `cache` (LLMCache), fresh answers are returned without an upstream call and
+    stale ones are returned immediately while a background call refreshes them.
+    """
+
+    def __init__(self, client=None, model=None, concurrency=4, timeout=30.0, cache=None, api_version=None):
+        self.client = client
+        self.model = model
+        self.api_version = api_version
+        self.cache = cache
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, name="derivation-loop", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._submitted = 0
+        self._coalesced = 0
+        self._upstream = 0
+        self._failures = 0
+        self._timeouts = 0
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._ready.set()
+        self._loop.run_forever()
+
+    def submit(self, prompt, data_version=None):
+        """
+        Return the Derivation for `prompt` immediately: a cached answer when there is one,
+        otherwise the new or already in-flight upstream call. `data_version` identifies the
+        data the answer depends on (default: the insight store version).
+        """
+        key = normalize_prompt(prompt)
+        with self._lock:
+            self._submitted += 1
+        if self.cache is not None:
+            data_version = data_version or get_insight_store().version
+            text, state = self.cache.get(key, self.model, self.api_version, data_version)
+            if text is not None:
+                if state == STALE:
+                    self._start(key, data_version)   # stale-while-revalidate
+                return Derivation.completed(key, text, state)
+        return self._start(key, data_version)
+
+    def _start(self, key, data_version):
+        with self._lock:
+            derivation = self._inflight.get(key)
+            if derivation is not None:
+                self._coalesced += 1
+                return derivation
+            derivation = self._inflight[key] = Derivation(key)
+            self._upstream += 1
+        asyncio.run_coroutine_threadsafe(self._derive(key, derivation, data_version), self._loop)
+        return derivation
+
+    def submit_many(self, prompts):
+        return [self.submit(prompt) for prompt in prompts]
+
+    def derive(self, prompt, timeout=None):
+        """Blocking convenience wrapper: the full response text."""
+        return self.submit(prompt).result(timeout)
+
+    async def _derive(self, key, derivation, data_version):
+        error = None
+        try:
+            async with self._semaphore:
+                await asyncio.wait_for(self._complete(key, derivation), self.timeout)
+        except asyncio.TimeoutError:
+            error = f"timed out after {self.timeout}s"
+            self._timeouts += 1
+        except Exception as e:
+            error = str(e)
+            self._failures += 1
+        if error:
+            logger.error(f"Error in agent derivation: {error}")
+            derivation._append(INCOMPLETE_SUFFIX if derivation._chunks else FAILED_RESPONSE)
+        elif self.cache is not None and self.client is not None:
+            # Written before the call leaves _inflight so no later submit falls between the two.
+            try:
+                await self._loop.run_in_executor(
+                    None, self.cache.put, key, self.model, self.api_version, data_version, "".join(derivation._chunks))
+            except Exception as e:
+                logger.error(f"Error caching derivation: {e}")
+        with self._lock:
+            self._inflight.pop(key, None)
+        derivation._finish(error)
+
+    async def _complete(self, prompt, derivation):
+        if self.client is None:
+            derivation._append(SIMULATED_RESPONSE.format(query=prompt))
+            return
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            stream=True,
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                derivation._append(chunk.choices[0].delta.content)
+
+    def stats(self):
+        return {
+            "submitted": self._submitted,
+            "coalesced": self._coalesced,
+            "upstream_calls": self._upstream,
+            "in_flight": len(self._inflight),
+            "failures": self._failures,
+            "timeouts": self._timeouts,
+            "concurrency": self.concurrency,
+            "timeout": self.timeout,
+            "cache": self.cache.stats() if self.cache is not None else None,
+        }
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_derivation_service():
+    """Shared DerivationService for this server process."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                logger.info(f"LLM config: OPENAI_API_KEY loaded: {'Yes' if os.getenv('OPENAI_API_KEY') else 'No'}, "
+                            f"endpoint: {os.getenv('LLM_BASE_URL') or os.getenv('AZURE_OPENAI_ENDPOINT')}, "
+                            f"deployment: {os.getenv('DEPLOYMENT')}, api version: {os.getenv('OPENAI_API_VERSION')}")
+                client, model = make_client()
+                _service = DerivationService(
+                    client, model,
+                    concurrency=int(os.getenv("LLM_CONCURRENCY", 4)),
+                    timeout=float(os.getenv("LLM_TIMEOUT", 30)),
+                    # Simulated answers are free; only real completions are worth persisting.
+                    cache=get_llm_cache() if client is not None else None,
+                    api_version=os.getenv("OPENAI_API_VERSION"),
+                )
+                mode = "simulated" if client is None else f"model {model}"
+                logger.info(f"Derivation service ready ({mode}, concurrency {_service.concurrency})")
+    return _service
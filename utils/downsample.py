@@ -0,0 +1,62 @@
+# utils/downsample.py
+"""
+Server-side reduction for point-heavy charts, so the figure sent to the browser stays
+bounded whatever the size of the data.
+
+Up to WEBGL_POINTS points a chart is drawn as-is (SVG), up to MAX_POINTS with WebGL
+(scattergl), and beyond that the points are binned here first: a 2D histogram for
+numeric scatters, per-category time buckets for timelines. The bin grids are sized so
+a binned chart never carries more than MAX_POINTS cells or markers.
+"""
+import os
+import numpy as np
+import pandas as pd
+
+WEBGL_POINTS = int(os.getenv("CHART_WEBGL_POINTS", 1000))
+MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", 5000))
+
+
+def render_mode(n_points):
+    """"svg", "webgl" or "binned" for a chart of `n_points` points."""
+    if n_points > MAX_POINTS:
+        return "binned"
+    return "webgl" if n_points > WEBGL_POINTS else "svg"
+
+
+def bin_2d(x, y, x_bins, y_bins, x_range=None, y_range=None):
+    """
+    Point counts on an x_bins × y_bins grid (NaNs dropped). Returns (counts with y along
+    rows, x bin centres, y bin centres), ready for a go.Heatmap.
+    """
+    x, y = np.asarray(x, dtype="float64"), np.asarray(y, dtype="float64")
+    keep = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[keep], y[keep]
+    x_range = x_range or ((float(x.min()), float(x.max())) if len(x) else (0.0, 1.0))
+    y_range = y_range or ((float(y.min()), float(y.max())) if len(y) else (0.0, 1.0))
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=(x_bins, y_bins), range=(x_range, y_range))
+    return counts.T, (x_edges[:-1] + x_edges[1:]) / 2, (y_edges[:-1] + y_edges[1:]) / 2
+
+
+def bin_timeline(dates, categories, max_points=MAX_POINTS):
+    """
+    Events per (category, time bucket), empty buckets dropped. Bucket width is chosen so
+    there are at most `max_points` buckets across all categories. Returns a DataFrame
+    with columns Date (bucket centre), Type and Count.
+    """
+    dates = pd.to_datetime(pd.Series(dates)).to_numpy("datetime64[ns]")
+    codes, labels = pd.factorize(pd.Series(categories).fillna("Unknown"), sort=True)
+    keep = ~np.isnat(dates)
+    days = dates[keep].astype("datetime64[D]").astype("int64")
+    codes = codes[keep]
+    buckets = max(1, max_points // max(len(labels), 1))
+    lo, hi = (int(days.min()), int(days.max()) + 1) if len(days) else (0, 1)
+    bucket = np.minimum((days - lo) * buckets // max(hi - lo, 1), buckets - 1)
+    counts = np.bincount(codes * buckets + bucket, minlength=len(labels) * buckets)
+    cells = np.flatnonzero(counts)
+    width = (hi - lo) / buckets
+    centres = lo + (cells % buckets + 0.5) * width
+    return pd.DataFrame({
+        "Date": pd.to_datetime(np.round(centres).astype("int64"), unit="D"),
+        "Type": np.asarray(labels)[cells // buckets],
+        "Count": counts[cells],
+    })
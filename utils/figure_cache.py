@@ -0,0 +1,137 @@
+# utils/figure_cache.py
+import functools
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import pandas as pd
+import plotly.io as pio
+from loguru import logger
+
+from utils.insight_store import get_insight_store
+from utils.telemetry import span
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def _fingerprint(value, digest):
+    """Feed a stable representation of a chart input into `digest`."""
+    if isinstance(value, pd.DataFrame):
+        digest.update(json.dumps([str(c) for c in value.columns]).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, pd.Series):
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    else:
+        digest.update(json.dumps(value, sort_keys=True, default=str).encode())
+    digest.update(b"\0")
+
+
+def input_key(name, args, kwargs):
+    digest = hashlib.blake2b(name.encode(), digest_size=16)
+    for value in args:
+        _fingerprint(value, digest)
+    for key in sorted(kwargs):
+        digest.update(key.encode())
+        _fingerprint(kwargs[key], digest)
+    return digest.hexdigest()
+
+
+class FigureCache:
+    """
+    Built Plotly figures shared by every session, keyed by chart function + input hash
+    and bounded by the size of each figure's serialized JSON. Entries are dropped when
+    the insight store version changes. Cached figures are shared objects: callers must
+    not mutate them (st.plotly_chart only reads them).
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()   # key -> (figure, bytes)
+        self._bytes = 0
+        self._version = None
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_or_build(self, name, build, args, kwargs, cache_key=None):
+        return self.lookup(name, build, args, kwargs, cache_key)[0]
+
+    def lookup(self, name, build, args, kwargs, cache_key=None):
+        """(figure, cache hit?, serialized size in bytes); `cache_key` stands in for hashing the inputs."""
+        key = input_key(name, args, kwargs) if cache_key is None else input_key(name, (cache_key,), {})
+        version = get_insight_store().version
+        with self._lock:
+            if version != self._version:
+                self._cache.clear()
+                self._bytes = 0
+                self._version = version
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self._hits += 1
+                return cached[0], True, cached[1]
+            self._misses += 1
+
+        figure = build(*args, **kwargs)
+        size = len(pio.to_json(figure, validate=False))
+        with self._lock:
+            if key not in self._cache and size <= self.max_bytes:
+                self._cache[key] = (figure, size)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, (_, evicted) = self._cache.popitem(last=False)
+                    self._bytes -= evicted
+                    self._evictions += 1
+        return figure, False, size
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._bytes = 0
+
+    def stats(self):
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+            "entries": len(self._cache),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_figure_cache():
+    """Shared FigureCache for this server process."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                max_mb = int(os.getenv("FIGURE_CACHE_MB", DEFAULT_MAX_BYTES // (1024 * 1024)))
+                _cache = FigureCache(max_bytes=max_mb * 1024 * 1024)
+                logger.info(f"Figure cache ready (budget {max_mb} MB)")
+    return _cache
+
+
+def cached_figure(fn):
+    """
+    Decorator for chart builders: identical inputs return the already-built figure.
+    Callers with large inputs whose version is already known (e.g. a derived table's
+    mtime) can pass `cache_key=` instead of having the inputs hashed on every call.
+    """
+    name = f"{fn.__module__}.{fn.__qualname__}"
+
+    @functools.wraps(fn)
+    def wrapper(*args, cache_key=None, **kwargs):
+        with span(fn.__name__, "chart") as s:
+            figure, hit, s.bytes = get_figure_cache().lookup(name, fn, args, kwargs, cache_key)
+            s.cache = "hit" if hit else "miss"
+        return figure
+
+    wrapper.uncached = fn
+    return wrapper
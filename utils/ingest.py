@@ -0,0 +1,200 @@
+# utils/ingest.py
+"""
+Streaming ingestion of Synthea CSV exports into the columnar clinical store.
+
+    python -m utils.ingest --source data/raw --store data/store
+
+CSV files are read in fixed-size chunks and each chunk is routed to a patient-hashed
+bucket, so peak memory is one chunk while reading and one bucket while compacting.
+Runs are incremental: files already recorded in the manifest (same size and mtime)
+are skipped, and only buckets that received new rows are re-sorted and re-indexed.
+A file named after its table with a suffix (e.g. encounters_2024-06-01.csv) is
+ingested as an extra batch of that table.
+"""
+import argparse
+import glob
+import json
+import os
+import time
+import uuid
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from loguru import logger
+
+from utils.clinical_store import (
+    DEFAULT_STORE, MANIFEST, TABLES, atomic_write, bucket_of, bucket_path, index_path, read_manifest, reference_path,
+)
+
+DEFAULT_CHUNK_ROWS = 250_000
+DEFAULT_BUCKETS = 64
+
+
+def table_for(path):
+    """Map a CSV file name to its table (longest matching table name wins)."""
+    stem = os.path.splitext(os.path.basename(path))[0].lower()
+    matches = [t for t in TABLES if stem == t or stem.startswith(t + "_") or stem.startswith(t + "-")]
+    return max(matches, key=len) if matches else None
+
+
+def _schema(table, columns):
+    spec = TABLES[table]
+    fields = []
+    for col in columns:
+        if col in spec["dates"]:
+            fields.append(pa.field(col, pa.timestamp("ms")))
+        elif col in spec["numeric"]:
+            fields.append(pa.field(col, pa.float64()))
+        else:
+            fields.append(pa.field(col, pa.string()))
+    return pa.schema(fields)
+
+
+def _typed(table, chunk):
+    spec = TABLES[table]
+    for col in spec["dates"]:
+        if col in chunk:
+            parsed = pd.to_datetime(chunk[col], errors="coerce", utc=True, format="ISO8601")
+            chunk[col] = parsed.dt.tz_localize(None).astype("datetime64[ms]")
+    for col in spec["numeric"]:
+        if col in chunk:
+            chunk[col] = pd.to_numeric(chunk[col], errors="coerce").astype("float64")
+    return chunk
+
+
+def _stage_file(path, table, store, n_buckets, chunk_rows):
+    """Stream one CSV into per-bucket staging files. Returns (rows, touched buckets)."""
+    key = TABLES[table]["key"]
+    staging = os.path.join(store, table, "staging")
+    os.makedirs(staging, exist_ok=True)
+    run = uuid.uuid4().hex[:8]
+    writers = {}
+    schema = None
+    rows = 0
+    try:
+        for chunk in pd.read_csv(path, dtype=str, chunksize=chunk_rows):
+            chunk = _typed(table, chunk)
+            if schema is None:
+                schema = _schema(table, chunk.columns)
+            if key is None:
+                buckets = np.zeros(len(chunk), dtype="int64")
+            else:
+                buckets = bucket_of(chunk[key], n_buckets)
+            for bucket, part in chunk.groupby(buckets, sort=False):
+                writer = writers.get(bucket)
+                if writer is None:
+                    sink = pa.OSFile(os.path.join(staging, f"bucket-{bucket:04d}-{run}.arrow"), "wb")
+                    writer = writers[bucket] = (sink, pa.ipc.new_file(sink, schema))
+                writer[1].write_table(pa.Table.from_pandas(part, schema=schema, preserve_index=False))
+            rows += len(chunk)
+    finally:
+        for sink, writer in writers.values():
+            writer.close()
+            sink.close()
+    return rows, set(writers)
+
+
+def _compact_bucket(store, table, bucket):
+    """Merge staged rows into the bucket file, sort by patient and rebuild its index."""
+    spec = TABLES[table]
+    staged = sorted(glob.glob(os.path.join(store, table, "staging", f"bucket-{bucket:04d}-*.arrow")))
+    target = bucket_path(store, table, bucket) if spec["key"] else reference_path(store, table)
+    parts = [pa.ipc.open_file(pa.memory_map(p, "r")).read_all() for p in staged]
+    if os.path.exists(target):
+        parts.insert(0, pa.ipc.open_file(pa.memory_map(target, "r")).read_all())
+    data = pa.concat_tables(parts, promote_options="default")
+
+    if spec["key"]:
+        sort_keys = [(spec["key"], "ascending")] + [(c, "ascending") for c in spec["sort"] if c in data.column_names]
+        data = data.sort_by(sort_keys).combine_chunks()
+        ids = data.column(spec["key"]).to_numpy(zero_copy_only=False)
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]) if len(ids) else np.array([], dtype="int64")
+        lengths = np.diff(np.r_[starts, len(ids)])
+        index = pa.table({"patient": pa.array(ids[starts], pa.string()),
+                          "offset": pa.array(starts, pa.int64()),
+                          "length": pa.array(lengths, pa.int64())})
+        atomic_write(target, data)
+        atomic_write(index_path(store, table, bucket), index)
+    else:
+        atomic_write(target, data.combine_chunks())
+
+    for p in staged:
+        os.remove(p)
+
+
+def ingest(source, store=DEFAULT_STORE, n_buckets=DEFAULT_BUCKETS, chunk_rows=DEFAULT_CHUNK_ROWS, rebuild=False):
+    """Ingest every new CSV under `source` into `store`; returns per-table row counts for this run."""
+    files = sorted(glob.glob(os.path.join(source, "**", "*.csv"), recursive=True))
+    return ingest_files(files, store, n_buckets, chunk_rows, rebuild)
+
+
+def ingest_files(files, store=DEFAULT_STORE, n_buckets=DEFAULT_BUCKETS, chunk_rows=DEFAULT_CHUNK_ROWS, rebuild=False):
+    """Ingest the given CSV files (skipping ones already in the manifest); returns per-table row counts."""
+    manifest = {"generation": 0, "buckets": n_buckets, "tables": [], "sources": {}} if rebuild else read_manifest(store)
+    if rebuild and os.path.isdir(store):
+        for table in TABLES:
+            for p in glob.glob(os.path.join(store, table, "*.arrow")):
+                os.remove(p)
+    n_buckets = manifest.get("buckets") or n_buckets
+    manifest["buckets"] = n_buckets
+    os.makedirs(store, exist_ok=True)
+
+    ingested, touched = {}, {}
+    for path in files:
+        table = table_for(path)
+        if table is None:
+            logger.debug(f"Skipping {path}: not a known table")
+            continue
+        st = os.stat(path)
+        seen = manifest["sources"].get(os.path.abspath(path))
+        if seen and seen["size"] == st.st_size and seen["mtime_ns"] == st.st_mtime_ns:
+            continue
+        if seen:
+            logger.warning(f"{path} changed since it was ingested; re-run with --rebuild to replace it")
+            continue
+
+        started = time.perf_counter()
+        rows, buckets = _stage_file(path, table, store, n_buckets, chunk_rows)
+        touched.setdefault(table, set()).update(buckets)
+        ingested[table] = ingested.get(table, 0) + rows
+        manifest["sources"][os.path.abspath(path)] = {
+            "table": table, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "rows": rows,
+        }
+        logger.info(f"Staged {rows:,} {table} rows from {path} in {time.perf_counter() - started:.1f}s")
+
+    for table, buckets in touched.items():
+        started = time.perf_counter()
+        for bucket in sorted(buckets):
+            _compact_bucket(store, table, bucket)
+        logger.info(f"Compacted {len(buckets)} {table} bucket(s) in {time.perf_counter() - started:.1f}s")
+
+    if touched:
+        manifest["tables"] = sorted(set(manifest.get("tables", [])) | set(touched))
+        manifest["generation"] = manifest.get("generation", 0) + 1
+        tmp = os.path.join(store, MANIFEST + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, os.path.join(store, MANIFEST))
+    return ingested
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest Synthea CSV exports into the clinical store.")
+    parser.add_argument("--source", default="data/raw", help="Directory containing the CSV exports")
+    parser.add_argument("--store", default=DEFAULT_STORE, help="Output store directory")
+    parser.add_argument("--buckets", type=int, default=DEFAULT_BUCKETS, help="Patient buckets (fixed at first run)")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="CSV rows read per chunk")
+    parser.add_argument("--rebuild", action="store_true", help="Discard the store and ingest everything again")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    counts = ingest(args.source, args.store, args.buckets, args.chunk_rows, args.rebuild)
+    if not counts:
+        logger.info("Nothing new to ingest")
+    for table, rows in sorted(counts.items()):
+        logger.info(f"{table}: {rows:,} rows")
+    logger.info(f"Ingestion finished in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# utils/insight_store.py
+import hashlib
+import json
+import os
+import threading
+import time
+from loguru import logger
+
+from utils.snapshots import get_snapshot
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError("Insight views are read-only; edit data/ai_insights.json instead.")
+
+
+class FrozenDict(dict):
+    """dict that rejects mutation, so one parsed copy can be shared by every session."""
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+    __ior__ = _read_only
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+
+class FrozenList(list):
+    """list that rejects mutation (see FrozenDict)."""
+    __setitem__ = __delitem__ = _read_only
+    append = extend = insert = pop = remove = reverse = sort = clear = _read_only
+    __iadd__ = __imul__ = _read_only
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+
+def freeze(obj):
+    """Recursively convert parsed JSON into read-only dict/list subclasses."""
+    if isinstance(obj, dict):
+        return FrozenDict((k, freeze(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return FrozenList(freeze(v) for v in obj)
+    return obj
+
+
+def _merge(base, overlay):
+    """Deep-merge overlay into base (overlay wins; nested dicts merge key by key)."""
+    merged = dict(base)
+    for key, value in overlay.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class InsightStore:
+    """
+    Process-wide cache of the insights JSON.
+    The file is parsed once and served as a frozen snapshot; it is re-parsed only when
+    its mtime/size changes *and* its content hash differs. Stat checks are throttled
+    to one per `check_interval` seconds so a rerun with ~20 lookups costs ~20 dict reads.
+
+    Batch engines publish computed values into a separate overlay file (never into the
+    curated JSON); the served snapshot is the curated file with the overlay merged on top.
+    A store that follows a shared snapshot (utils.snapshots) serves that snapshot's
+    already-merged insights.json instead, so every server process sees the same tree.
+    """
+
+    def __init__(self, path, overlay_path=None, check_interval=1.0):
+        self.path = path
+        self.overlay_path = overlay_path
+        self.source = None          # snapshot insights.json being followed, if any
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot = FrozenDict()
+        self._signature = None      # (mtime_ns, size) of the files behind the snapshot
+        self._digest = None         # sha256 of the files behind the snapshot
+        self._last_check = 0.0
+        self._hits = 0
+        self._misses = 0
+        self._reloads = 0
+
+    def _files(self):
+        return (self.source, None) if self.source else (self.path, self.overlay_path)
+
+    def _stat(self):
+        signature = []
+        for path in self._files():
+            try:
+                st = os.stat(path) if path else None
+            except OSError:
+                st = None
+            signature.append((st.st_mtime_ns, st.st_size) if st else None)
+        return tuple(signature)
+
+    def _refresh(self):
+        # Called with the lock held.
+        signature = self._stat()
+        if signature[0] is not None and signature == self._signature:
+            return False
+        path, overlay_path = self._files()
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+            overlay_raw = b""
+            if signature[1] is not None:
+                with open(overlay_path, "rb") as f:
+                    overlay_raw = f.read()
+        except Exception as e:
+            logger.error(f"Error loading insights: {e}")
+            return False
+
+        digest = hashlib.sha256(raw + b"\0" + overlay_raw).hexdigest()
+        if digest == self._digest:
+            # Touched but unchanged (e.g. a checkout); keep the existing snapshot.
+            self._signature = signature
+            return False
+        try:
+            data = json.loads(raw)
+            if overlay_raw:
+                data = _merge(data, json.loads(overlay_raw))
+            snapshot = freeze(data)
+        except Exception as e:
+            logger.error(f"Error loading insights: {e}")
+            return False
+
+        # Swap in one assignment so readers never see a half-built snapshot.
+        self._snapshot = snapshot
+        self._signature = signature
+        self._digest = digest
+        if self._misses:
+            self._reloads += 1
+            logger.info(f"Insight store reloaded from {path} ({digest[:12]})")
+        return True
+
+    def snapshot(self):
+        """Return the current read-only insights tree, reloading it if the file changed."""
+        now = time.monotonic()
+        if self._digest is None or now - self._last_check >= self.check_interval:
+            with self._lock:
+                if self._digest is None or now - self._last_check >= self.check_interval:
+                    self._last_check = now
+                    if self._refresh():
+                        self._misses += 1
+                        return self._snapshot
+        self._hits += 1
+        return self._snapshot
+
+    def follow(self, source):
+        """Serve `source` (a snapshot's merged insights.json) instead of the curated file + overlay."""
+        with self._lock:
+            if source != self.source:
+                self.source = source
+                self._signature = None
+                self._last_check = 0.0
+
+    def publish(self, section, values):
+        """
+        Merge computed `values` into `section` of the overlay file and reload. The write is
+        atomic (temp file + rename), so other server processes pick it up on their next check
+        (or, when they follow a snapshot, with the next published snapshot).
+        """
+        if not self.overlay_path:
+            raise ValueError("InsightStore has no overlay_path to publish into")
+        with self._lock:
+            try:
+                with open(self.overlay_path, "r", encoding="utf-8") as f:
+                    overlay = json.load(f)
+            except FileNotFoundError:
+                overlay = {}
+            overlay[section] = _merge(overlay.get(section, {}), values)
+            os.makedirs(os.path.dirname(self.overlay_path) or ".", exist_ok=True)
+            tmp = f"{self.overlay_path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(overlay, f, indent=2, default=str)
+            os.replace(tmp, self.overlay_path)
+            self._last_check = 0.0
+        self.snapshot()
+
+    def get(self, section, key, default=None):
+        return self.snapshot().get(section, {}).get(key, default)
+
+    @property
+    def version(self):
+        """Content hash of the served snapshot; changes exactly when the data does."""
+        self.snapshot()
+        return self._digest
+
+    def stats(self):
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "reloads": self._reloads,
+            "version": self._digest,
+            "path": self.path,
+            "overlay_path": self.overlay_path,
+            "snapshot_source": self.source,
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_insight_store(path="data/ai_insights.json", overlay_path="data/ai_insights.computed.json"):
+    """
+    Shared InsightStore for this server process (Streamlit sessions share module state).
+    With SNAPSHOT_DIR set it follows the current snapshot's insights.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = InsightStore(path, overlay_path)
+    snapshot = get_snapshot()
+    if snapshot is not None and snapshot.insights_path != _store.source:
+        _store.follow(snapshot.insights_path)
+    return _store
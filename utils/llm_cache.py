@@ -0,0 +1,144 @@
+# utils/llm_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from loguru import logger
+
+DEFAULT_PATH = "data/llm_cache.sqlite"
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_STALE = 7 * 24 * 3600
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+FRESH, STALE = "fresh", "stale"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    prompt TEXT NOT NULL,
+    deployment TEXT,
+    api_version TEXT,
+    data_version TEXT,
+    response TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    bytes INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+
+def cache_key(prompt, deployment, api_version):
+    return hashlib.sha256("\0".join([prompt, deployment or "", api_version or ""]).encode()).hexdigest()
+
+
+class LLMCache:
+    """
+    SQLite-backed LLM response cache shared by every session and server process.
+
+    Entries are keyed by (normalized prompt, deployment, API version) and remember the
+    insight data version they were generated from. A lookup is FRESH while the entry is
+    younger than `ttl` and the data version still matches; otherwise it is STALE (served
+    immediately while the caller refreshes it) until `max_stale` seconds past its TTL.
+    The file is kept under `max_bytes` of response text by evicting least-recently-used rows.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL, max_stale=DEFAULT_MAX_STALE, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=5.0, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, prompt, deployment, api_version, data_version):
+        """(response, FRESH | STALE) or (None, None) on a miss."""
+        key = cache_key(prompt, deployment, api_version)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response, data_version, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[2] > self.ttl + self.max_stale:
+                self._misses += 1
+                return None, None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            response, version, created = row
+            if version == data_version and now - created <= self.ttl:
+                self._hits += 1
+                return response, FRESH
+            self._stale_hits += 1
+            return response, STALE
+
+    def put(self, prompt, deployment, api_version, data_version, response):
+        key = cache_key(prompt, deployment, api_version)
+        now = time.time()
+        size = len(response.encode())
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, prompt, deployment, api_version, data_version, response, now, now, size))
+            self._evict()
+
+    def _evict(self):
+        # Called with the lock held.
+        total = self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        for key, size in self._db.execute("SELECT key, bytes FROM responses ORDER BY accessed").fetchall():
+            if total - freed <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            freed += size
+            self._evictions += 1
+
+    def purge_expired(self):
+        """Drop entries past TTL + max_stale; returns the number removed."""
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM responses WHERE created < ?",
+                                      (time.time() - self.ttl - self.max_stale,))
+            return cursor.rowcount
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM responses").fetchone()
+        return {
+            "hits": self._hits,
+            "stale_hits": self._stale_hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "path": self.path,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """Shared LLMCache for this server process (LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MAX_STALE, LLM_CACHE_MB)."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMCache(
+                    os.getenv("LLM_CACHE_PATH", DEFAULT_PATH),
+                    ttl=float(os.getenv("LLM_CACHE_TTL", DEFAULT_TTL)),
+                    max_stale=float(os.getenv("LLM_CACHE_MAX_STALE", DEFAULT_MAX_STALE)),
+                    max_bytes=int(os.getenv("LLM_CACHE_MB", DEFAULT_MAX_BYTES // (1024 * 1024))) * 1024 * 1024,
+                )
+                _cache.purge_expired()
+                logger.info(f"LLM response cache at {_cache.path} ({_cache.stats()['entries']} entries)")
+    return _cache
@@ -0,0 +1,102 @@
+# utils/logging_setup.py
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from loguru import logger
+
+LOG_PATH = "logs/app.log"
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+class RateLimiter:
+    """
+    loguru filter: a token bucket per call site (module + line). Records beyond `rate`
+    per second (after a `burst`) are dropped; the next record that gets through carries
+    the number dropped in between as `suppressed`. Warnings and errors always pass.
+    """
+
+    def __init__(self, rate=5.0, burst=20):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}   # (module, line) -> (tokens, last refill, dropped)
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        if record["level"].no >= 30:
+            return True
+        site = (record["name"], record["line"])
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, dropped = self._buckets.get(site, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[site] = (tokens, now, dropped + 1)
+                return False
+            self._buckets[site] = (tokens - 1, now, 0)
+        if dropped:
+            record["extra"]["suppressed"] = dropped
+        return True
+
+
+def _json_format(record):
+    """One JSON object per line; bound extras (session_id, render_id, ...) become top-level keys."""
+    payload = {
+        "ts": record["time"].isoformat(),
+        "level": record["level"].name,
+        "logger": record["name"],
+        "function": record["function"],
+        "line": record["line"],
+        "message": record["message"],
+    }
+    payload.update({k: v for k, v in record["extra"].items() if k != "_json"})
+    if record["exception"] is not None:
+        payload["exception"] = "".join(traceback.format_exception(*record["exception"]))
+    record["extra"]["_json"] = json.dumps(payload, default=str)
+    return "{extra[_json]}\n"
+
+
+def configure_logging(path=None):
+    """
+    Install the application log sink once per process. Streamlit re-executes
+    dashboard.py on every rerun, so this must be idempotent: repeated calls are no-ops.
+    Records are written by loguru's background queue (enqueue=True), so the calling
+    script thread only formats and enqueues.
+    """
+    global _configured
+    if _configured:
+        return
+    with _configure_lock:
+        if _configured:
+            return
+        path = path or os.getenv("LOG_PATH", LOG_PATH)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        logger.add(
+            path,
+            rotation="1 MB",
+            retention=int(os.getenv("LOG_RETENTION_FILES", 10)),
+            level=os.getenv("LOG_LEVEL", "DEBUG"),
+            format=_json_format,
+            filter=RateLimiter(float(os.getenv("LOG_RATE_PER_SITE", 5)), int(os.getenv("LOG_BURST_PER_SITE", 20))),
+            enqueue=True,
+        )
+        _configured = True
+
+
+def render_context():
+    """
+    Context manager binding the Streamlit session ID and a fresh render ID to every log
+    record emitted during this rerun (from the script thread).
+    """
+    session_id = None
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        session_id = ctx.session_id if ctx else None
+    except ImportError:
+        pass
+    return logger.contextualize(session_id=session_id, render_id=uuid.uuid4().hex[:12])
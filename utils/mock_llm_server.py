@@ -0,0 +1,141 @@
+# utils/mock_llm_server.py
+"""
+Local OpenAI-compatible chat-completions server for exercising the derivation layer
+without credentials or network access.
+
+    python -m utils.mock_llm_server --port 8011 --delay 0.5
+    LLM_BASE_URL=http://127.0.0.1:8011/v1 streamlit run dashboard.py
+
+Serves POST /v1/chat/completions and the Azure-style
+/openai/deployments/<deployment>/chat/completions, both plain and `stream: true`
+(server-sent events). GET /stats returns how many completions were served, which is
+how request coalescing can be checked from outside. Prompts asking for a JSON object
+(utils.patient_narratives) get one with every narrative field filled in, and
+--fail-rate answers that share of requests with 429 + Retry-After to exercise retries.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from loguru import logger
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    server_version = "MockLLM/1.0"
+
+    def log_message(self, format, *args):
+        logger.debug("mock llm: " + format % args)
+
+    def _json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._json(200, {"completions": self.server.completions})
+        else:
+            self._json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        if not path.endswith("/chat/completions"):
+            self._json(404, {"error": {"message": "not found"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if random.random() < self.server.fail_rate:
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b'{"error": {"message": "rate limited (mock)", "type": "rate_limit_exceeded"}}')
+            return
+        with self.server.lock:
+            self.server.completions += 1
+        prompt = next((m.get("content", "") for m in reversed(request.get("messages", []))
+                       if m.get("role") == "user"), "")
+        words = (_json_reply() if "JSON object" in prompt else f"Mock insight for: {prompt}").split(" ")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = request.get("model") or "mock"
+
+        if not request.get("stream"):
+            time.sleep(self.server.delay)
+            self._json(200, {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": " ".join(words)}}],
+                "usage": {"prompt_tokens": len(prompt.split()), "completion_tokens": len(words),
+                          "total_tokens": len(prompt.split()) + len(words)},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        pause = self.server.delay / max(len(words), 1)
+        for i, word in enumerate(words):
+            time.sleep(pause)
+            chunk = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        done = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        self.wfile.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode())
+        self.wfile.flush()
+
+
+def _json_reply():
+    from utils.patient_narratives import NARRATIVE_FIELDS
+    reply = {field: f"Mock {field.replace('_', ' ')}." for field in NARRATIVE_FIELDS}
+    reply["ai_recommended_focus"] = ["Mock focus one.", "Mock focus two.", "Mock focus three."]
+    reply["co_pilot_prompts"] = {"Mock question?": "Mock answer."}
+    return json.dumps(reply)
+
+
+def make_server(host="127.0.0.1", port=8011, delay=0.5, fail_rate=0.0):
+    """ThreadingHTTPServer with the mock handler; port=0 picks a free port (see server.server_port)."""
+    server = ThreadingHTTPServer((host, port), MockLLMHandler)
+    server.daemon_threads = True
+    server.delay = delay
+    server.fail_rate = fail_rate
+    server.completions = 0
+    server.lock = threading.Lock()
+    return server
+
+
+def start_in_background(host="127.0.0.1", port=0, delay=0.5, fail_rate=0.0):
+    """Start a mock server on a daemon thread and return it (stop with server.shutdown())."""
+    server = make_server(host, port, delay, fail_rate)
+    threading.Thread(target=server.serve_forever, name="mock-llm", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local OpenAI-compatible mock LLM server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--delay", type=float, default=0.5, help="Seconds each completion takes")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    args = parser.parse_args(argv)
+    server = make_server(args.host, args.port, args.delay, args.fail_rate)
+    logger.info(f"Mock LLM server on http://{args.host}:{server.server_port}/v1 (delay {args.delay}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
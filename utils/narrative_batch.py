@@ -0,0 +1,292 @@
+# utils/narrative_batch.py
+"""
+Offline batch job that generates per-patient AI narratives for the doctor dashboard.
+
+    python -m utils.narrative_batch --store data/store --insights data/patient_insights
+    LLM_BASE_URL=http://127.0.0.1:8011/v1 python -m utils.narrative_batch --limit 1000
+
+Two stages run side by side:
+  facts      CPU-bound: batches of patients are read from the clinical store and reduced
+             to patient_facts() rows in a process pool (--workers, default all cores).
+  narrative  LLM-bound: --concurrency async workers turn each patient's facts into a
+             narrative_prompt() completion, within a --tokens-per-minute budget and with
+             exponential backoff on failures (--retries). Without a configured LLM the
+             template text is written instead.
+
+Each finished record is appended to the per-patient insight store (the one the doctor
+page reads) and its patient ID to a checkpoint file, so an interrupted run resumes
+where it stopped; patients that still fail after all retries are not checkpointed and
+are picked up by the next run. Progress is logged as patients/min.
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+import openai
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from loguru import logger
+
+from utils.clinical_store import DEFAULT_STORE, ClinicalStore
+from utils.derivation import make_client
+from utils.patient_insights import DEFAULT_ROOT, PatientInsightStore
+from utils.patient_narratives import narrative_prompt, parse_narrative, patient_facts, template_record
+
+CHECKPOINT = "narratives.checkpoint"
+MAX_TOKENS = 900
+REPORT_SECONDS = 10.0
+
+_ts, _text, _num = pa.timestamp("ms"), pa.string(), pa.float64()
+FACT_INPUTS = {
+    "patients": (["Id", "BIRTHDATE", "FIRST", "LAST", "GENDER"], [_text, _ts, _text, _text, _text]),
+    "conditions": (["PATIENT", "START", "STOP", "DESCRIPTION"], [_text, _ts, _ts, _text]),
+    "encounters": (["PATIENT", "START", "ENCOUNTERCLASS", "TOTAL_CLAIM_COST"], [_text, _ts, _text, _num]),
+    "medications": (["PATIENT", "STOP"], [_text, _ts]),
+    "payer_transitions": (["PATIENT", "PAYER"], [_text, _text]),
+}
+
+# Errors that no retry will fix: stop the run instead of burning through every patient.
+FATAL_ERRORS = (openai.AuthenticationError, openai.PermissionDeniedError, openai.NotFoundError)
+
+_worker_store = None
+
+
+def _conform(data, table):
+    columns, types = FACT_INPUTS[table]
+    rows = data.num_rows if data is not None else 0
+    return pa.table({
+        column: pc.cast(data.column(column), kind) if data is not None and column in data.column_names
+        else pa.nulls(rows, kind)
+        for column, kind in zip(columns, types)
+    }).to_pandas()
+
+
+def facts_for(store_root, patient_ids, as_of, payers):
+    """Process-pool task: patient_facts() rows (as dicts) for a batch of patient IDs."""
+    global _worker_store
+    if _worker_store is None or _worker_store.root != store_root:
+        _worker_store = ClinicalStore(store_root)
+    tables = {table: _conform(_worker_store.read_patients(table, patient_ids, FACT_INPUTS[table][0]), table)
+              for table in FACT_INPUTS}
+    return patient_facts(tables, payers, as_of).to_dict("records")
+
+
+class TokenBudget:
+    """
+    Async token bucket holding one minute of tokens. Calls reserve an estimate up front
+    and settle the difference once the response reports actual usage.
+    """
+
+    def __init__(self, tokens_per_minute):
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens):
+        if not self.capacity:
+            return
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= tokens
+
+    def settle(self, reserved, used):
+        if self.capacity:
+            self._tokens += min(reserved, self.capacity) - used
+
+
+class NarrativeBatch:
+    """One resumable run over every patient in the clinical store that is not yet checkpointed."""
+
+    def __init__(self, store_root=DEFAULT_STORE, insights_root=DEFAULT_ROOT, checkpoint=None, client=None,
+                 model=None, workers=None, concurrency=4, tokens_per_minute=60_000, retries=5, timeout=60.0,
+                 batch_patients=500):
+        self.store_root = store_root
+        self.insights = PatientInsightStore(insights_root)
+        self.checkpoint = checkpoint or os.path.join(insights_root, CHECKPOINT)
+        # Retries are ours (with backoff and the token budget), not the SDK's.
+        self.client = client.with_options(max_retries=0) if client is not None else None
+        self.model = model
+        self.workers = workers or os.cpu_count() or 1
+        self.concurrency = concurrency
+        self.budget = TokenBudget(tokens_per_minute)
+        self.retries = retries
+        self.timeout = timeout
+        self.batch_patients = batch_patients
+        self.generated_by = model if client is not None else "template"
+        self._done = self._failed = self._retried = self._tokens = 0
+        self._started = self._last_report = None
+        self._pending = 0
+
+    def completed_ids(self):
+        try:
+            with open(self.checkpoint, "r", encoding="utf-8") as f:
+                return {line.strip() for line in f if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    async def _complete(self, prompt):
+        reserved = len(prompt) // 4 + MAX_TOKENS
+        for attempt in range(self.retries + 1):
+            await self.budget.acquire(reserved)
+            used = None
+            try:
+                response = await asyncio.wait_for(self.client.chat.completions.create(
+                    model=self.model, messages=[{"role": "user", "content": prompt}],
+                    max_tokens=MAX_TOKENS, temperature=0.2,
+                ), self.timeout)
+                used = response.usage.total_tokens if response.usage else reserved
+                self.budget.settle(reserved, used)
+                self._tokens += used
+                return parse_narrative(response.choices[0].message.content or "")
+            except FATAL_ERRORS:
+                raise
+            except Exception as e:
+                if used is None:
+                    self.budget.settle(reserved, 0)   # nothing was spent upstream
+                if attempt == self.retries:
+                    raise
+                delay = min(60.0, 2.0 ** attempt) * (0.5 + random.random() / 2)
+                retry_after = getattr(getattr(e, "response", None), "headers", {}).get("retry-after")
+                if retry_after:
+                    try:
+                        delay = max(delay, float(retry_after))
+                    except ValueError:
+                        pass
+                self._retried += 1
+                logger.debug(f"Narrative call failed ({type(e).__name__}: {e}); retry {attempt + 1} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def _narrate(self, facts, checkpoint):
+        record = template_record(facts)
+        try:
+            if self.client is not None:
+                record.update(await self._complete(narrative_prompt(facts)))
+        except FATAL_ERRORS:
+            raise
+        except Exception as e:
+            self._failed += 1
+            logger.error(f"Narrative for {facts['patient_id']} failed after {self.retries} retries: {e}")
+            return
+        record["generated_by"] = self.generated_by
+        # Record first, then checkpoint: a crash in between regenerates one patient, never skips one.
+        self.insights.put(record, sync=False)
+        checkpoint.write(facts["patient_id"] + "\n")
+        checkpoint.flush()
+        self._done += 1
+        self._report()
+
+    def _report(self, final=False):
+        now = time.monotonic()
+        if not final and now - self._last_report < REPORT_SECONDS:
+            return
+        self._last_report = now
+        minutes = max(now - self._started, 1e-9) / 60
+        rate = self._done / minutes
+        remaining = self._pending - self._done - self._failed
+        eta = f", ETA {remaining / rate:.1f} min" if rate and remaining > 0 and not final else ""
+        logger.info(f"Narratives: {self._done:,}/{self._pending:,} done, {self._failed:,} failed, "
+                    f"{self._retried:,} retries, {rate:,.1f} patients/min, {self._tokens / minutes:,.0f} tokens/min{eta}")
+
+    async def _produce(self, pool, batches, queue, as_of, payers):
+        loop = asyncio.get_running_loop()
+        pending = set()
+        batches = iter(batches)
+        while True:
+            # Keep every worker busy plus one batch queued, without building all facts up front.
+            for batch in batches:
+                pending.add(loop.run_in_executor(pool, facts_for, self.store_root, batch, as_of, payers))
+                if len(pending) > self.workers:
+                    break
+            if not pending:
+                break
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in finished:
+                for facts in future.result():
+                    await queue.put(facts)
+        for _ in range(self.concurrency):
+            await queue.put(None)
+
+    async def _consume(self, queue, checkpoint):
+        while (facts := await queue.get()) is not None:
+            await self._narrate(facts, checkpoint)
+
+    async def _run(self, batches, as_of, payers):
+        queue = asyncio.Queue(maxsize=self.concurrency * 4)
+        with ProcessPoolExecutor(max_workers=self.workers) as pool, \
+                open(self.checkpoint, "a", encoding="utf-8") as checkpoint:
+            try:
+                await asyncio.gather(self._produce(pool, batches, queue, as_of, payers),
+                                     *(self._consume(queue, checkpoint) for _ in range(self.concurrency)))
+            finally:
+                os.fsync(checkpoint.fileno())
+
+    def run(self, limit=None, as_of=None):
+        """Generate narratives for every remaining patient (at most `limit`); returns run counts."""
+        store = ClinicalStore(self.store_root)
+        os.makedirs(os.path.dirname(self.checkpoint) or ".", exist_ok=True)
+        patients = store.read_table("patients", ["Id"])
+        ids = patients.column("Id").to_pylist() if patients is not None else []
+        done = self.completed_ids()
+        todo = [pid for pid in ids if pid not in done][:limit]
+        if as_of is None:
+            starts = store.read_table("encounters", ["START"])
+            latest = pc.max(starts.column("START")).as_py() if starts is not None and starts.num_rows else None
+            as_of = latest or pd.Timestamp.now()
+        payers = store.reference("payers")
+        payers = dict(zip(payers["Id"], payers["NAME"])) if not payers.empty else {}
+
+        self._pending = len(todo)
+        logger.info(f"Narrative batch: {len(todo):,} patients to generate ({len(done):,} already checkpointed), "
+                    f"{self.workers} fact worker(s), {self.concurrency} narrative worker(s), writer: {self.generated_by}")
+        self._started = self._last_report = time.monotonic()
+        batches = (todo[i:i + self.batch_patients] for i in range(0, len(todo), self.batch_patients))
+        try:
+            asyncio.run(self._run(batches, pd.Timestamp(as_of), payers))
+        finally:
+            self.insights.merge()
+            self._report(final=True)
+        minutes = (time.monotonic() - self._started) / 60
+        return {"generated": self._done, "failed": self._failed, "retries": self._retried, "tokens": self._tokens,
+                "patients_per_minute": round(self._done / minutes, 1) if minutes else None}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-generate per-patient AI narratives into the insight store.")
+    parser.add_argument("--store", default=os.getenv("CLINICAL_STORE_DIR", DEFAULT_STORE))
+    parser.add_argument("--insights", default=os.getenv("PATIENT_INSIGHTS_DIR", DEFAULT_ROOT))
+    parser.add_argument("--checkpoint", default=None, help=f"Progress file (default: <insights>/{CHECKPOINT})")
+    parser.add_argument("--restart", action="store_true", help="Discard the checkpoint and regenerate everyone")
+    parser.add_argument("--limit", type=int, default=None, help="Generate at most this many patients")
+    parser.add_argument("--workers", type=int, default=None, help="Fact-building processes (default: all cores)")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("LLM_CONCURRENCY", 4)))
+    parser.add_argument("--tokens-per-minute", type=int, default=int(os.getenv("LLM_TOKENS_PER_MINUTE", 60_000)),
+                        help="Token budget across all narrative workers (0 = unlimited)")
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=float(os.getenv("LLM_TIMEOUT", 60)))
+    parser.add_argument("--as-of", default=None, help="Reference date (default: latest encounter)")
+    args = parser.parse_args(argv)
+
+    client, model = make_client()
+    batch = NarrativeBatch(args.store, args.insights, args.checkpoint, client, model, args.workers,
+                           args.concurrency, args.tokens_per_minute, args.retries, args.timeout)
+    if args.restart and os.path.exists(batch.checkpoint):
+        os.remove(batch.checkpoint)
+    logger.info(f"Narrative batch finished: {batch.run(args.limit, args.as_of)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# utils/paged_table.py
+"""
+Server-side paging, sorting and filtering for large tables.
+
+A PagedTable holds one frame as a single-chunk Arrow table. A view (filter text, sort column,
+page) resolves to row indices with Arrow kernels (sort_indices, match_substring) and
+only that page is materialized with take(); the row order for each (filter, sort)
+pair is memoized, so paging through a result or re-rendering it is a slice. Tables
+are shared per source frame, and callers (utils.styles.show_dataframe) send the
+returned window to st.dataframe, so the rest of the table never leaves the server.
+"""
+import os
+import threading
+import weakref
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+PAGE_ROWS = int(os.getenv("TABLE_PAGE_ROWS", 200))
+MAX_TABLES = 64        # PagedTables kept per process (one per displayed source frame)
+MAX_VIEWS = 16         # memoized (filter, sort) orderings per table
+
+
+class PagedTable:
+    """One frame as Arrow with memoized filtered/sorted row orders."""
+
+    def __init__(self, data):
+        if isinstance(data, pa.Table):
+            self.table = data
+        else:
+            frame = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+            self.table = pa.Table.from_pandas(frame, preserve_index=False)
+        self.table = self.table.combine_chunks()
+        self._text = None
+        self._lock = threading.Lock()
+        self._views = OrderedDict()   # (query, sort_by, descending) -> row indices
+
+    def __len__(self):
+        return self.table.num_rows
+
+    @property
+    def columns(self):
+        return self.table.column_names
+
+    def _searchable(self):
+        """Lower-cased string form of every column that has one (built on the first filter)."""
+        if self._text is None:
+            text = []
+            for column in self.table.columns:
+                try:
+                    text.append(pc.utf8_lower(pc.cast(column, pa.string())))
+                except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                    continue
+            self._text = text
+        return self._text
+
+    def _rows(self, query, sort_by, descending):
+        key = (query, sort_by, descending)
+        with self._lock:
+            rows = self._views.get(key)
+            if rows is not None:
+                self._views.move_to_end(key)
+                return rows
+        if sort_by in self.columns:
+            rows = pc.sort_indices(self.table, sort_keys=[(sort_by, "descending" if descending else "ascending")]).to_numpy()
+        else:
+            rows = np.arange(len(self))
+        if query:
+            # Every whitespace-separated term must appear in some column.
+            keep = np.ones(len(self), dtype=bool)
+            for term in query.lower().split():
+                hit = np.zeros(len(self), dtype=bool)
+                for column in self._searchable():
+                    hit |= pc.fill_null(pc.match_substring(column, term), False).to_numpy(zero_copy_only=False)
+                keep &= hit
+            rows = rows[keep[rows]]
+        with self._lock:
+            self._views[key] = rows
+            while len(self._views) > MAX_VIEWS:
+                self._views.popitem(last=False)
+        return rows
+
+    def view(self, query="", sort_by=None, descending=False, page=0, page_size=PAGE_ROWS):
+        """(Arrow table holding one page of the filtered, sorted rows, total matching rows)."""
+        rows = self._rows(query.strip(), sort_by, descending)
+        return self.table.take(rows[page * page_size:(page + 1) * page_size]), len(rows)
+
+
+_tables = OrderedDict()   # id(source) -> (weak reference to source, PagedTable)
+_tables_lock = threading.Lock()
+
+
+def get_paged_table(data):
+    """
+    Shared PagedTable for a source frame. Cached panels (patient repository, insight
+    store) hand out the same frame object on every rerun, so the Arrow copy and its
+    memoized views are reused until the source is dropped.
+    """
+    key = id(data)
+    with _tables_lock:
+        cached = _tables.get(key)
+        if cached is not None and cached[0]() is data:
+            _tables.move_to_end(key)
+            return cached[1]
+    table = PagedTable(data)
+    try:
+        ref = weakref.ref(data)
+    except TypeError:
+        return table              # plain lists/dicts: nothing stable to key on
+    with _tables_lock:
+        _tables[key] = (ref, table)
+        while len(_tables) > MAX_TABLES:
+            _tables.popitem(last=False)
+    return table
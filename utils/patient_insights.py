@@ -0,0 +1,345 @@
+# utils/patient_insights.py
+"""
+Per-patient insight records (the doctor.hero_patients shape) stored outside the curated
+JSON, so reading one patient costs one index probe and one record-sized read.
+
+    python -m utils.patient_insights load data/synthetic/insights/*.jsonl
+    python -m utils.patient_insights load data/ai_insights.json      # hero_patients
+    python -m utils.patient_insights get <patient_id>
+    python -m utils.patient_insights compact
+
+Layout under PATIENT_INSIGHTS_DIR (default data/patient_insights):
+  shard-00000.jsonl ...  append-only record logs, one JSON object per line
+  index.npy              key-sorted uint64 rows (keys, shards, offsets, lengths), memory-mapped
+                         by readers; the keys row is contiguous, so a lookup is one binary search
+  journal.bin            (key, shard, length, offset) entries appended since the last index merge
+
+Writing a patient appends its record to the open shard and one entry to the journal; the
+journal is folded into index.npy (temp file + rename) once it passes MERGE_ENTRIES, so
+regenerating a patient never rewrites other records. The latest record for a patient
+wins; `compact` drops superseded ones. Keys are 64-bit blake2b digests of the patient
+ID and every record carries its ID, so a key collision reads as a miss, never as another
+patient's record. One writer process at a time; any number of readers.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+import numpy as np
+from loguru import logger
+
+from utils.insight_store import freeze
+
+DEFAULT_ROOT = "data/patient_insights"
+INDEX = "index.npy"
+JOURNAL = "journal.bin"
+ENTRY = np.dtype([("key", "<u8"), ("shard", "<u4"), ("length", "<u4"), ("offset", "<u8")])
+SHARD_BYTES = 64 * 1024 * 1024
+MERGE_ENTRIES = 50_000
+
+
+def patient_key(patient_id):
+    return int.from_bytes(hashlib.blake2b(str(patient_id).encode(), digest_size=8).digest(), "little")
+
+
+def shard_path(root, shard):
+    return os.path.join(root, f"shard-{shard:05d}.jsonl")
+
+
+def _columns(entries):
+    """Structured entries -> the (4, n) uint64 layout of index.npy."""
+    return np.stack([entries[name].astype("<u8") for name in ("key", "shard", "offset", "length")])
+
+
+def _rows(index):
+    """index.npy layout -> structured entries."""
+    entries = np.empty(index.shape[1], dtype=ENTRY)
+    for row, name in enumerate(("key", "shard", "offset", "length")):
+        entries[name] = index[row]
+    return entries
+
+
+def _latest(entries):
+    """Sort by key keeping the last-written entry per key (input is in write order)."""
+    order = np.argsort(entries["key"], kind="stable")
+    entries = entries[order]
+    last = np.ones(len(entries), dtype=bool)
+    last[:-1] = entries["key"][1:] != entries["key"][:-1]
+    return entries[last]
+
+
+class PatientInsightStore:
+    """
+    Reader and single-process writer over one insights directory. Readers re-check the
+    index and journal at most once per `check_interval` seconds, so records written by a
+    batch job in another process show up without a restart.
+    """
+
+    def __init__(self, root=DEFAULT_ROOT, check_interval=1.0):
+        self.root = root
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._index = np.empty((4, 0), dtype="<u8")
+        self._index_signature = None
+        self._journal = {}          # key -> (shard, offset, length), newer than the index
+        self._journal_offset = 0    # bytes of journal.bin already read
+        self._last_check = None
+        self._files = {}            # shard -> open read handle
+        self._hits = 0
+        self._misses = 0
+
+    # ----- read side -----
+
+    def _refresh(self):
+        # Called with the lock held.
+        try:
+            st = os.stat(os.path.join(self.root, INDEX))
+            signature = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            signature = None
+        try:
+            journal_size = os.path.getsize(os.path.join(self.root, JOURNAL))
+        except OSError:
+            journal_size = 0
+
+        if signature != self._index_signature or journal_size < self._journal_offset:
+            # A merge or compaction landed: remap the index and re-read the journal from the start.
+            self._index = (np.load(os.path.join(self.root, INDEX), mmap_mode="r")
+                           if signature else np.empty((4, 0), dtype="<u8"))
+            self._index_signature = signature
+            self._journal, self._journal_offset = {}, 0
+            for f in self._files.values():
+                f.close()
+            self._files = {}
+        if journal_size > self._journal_offset:
+            with open(os.path.join(self.root, JOURNAL), "rb") as f:
+                f.seek(self._journal_offset)
+                tail = f.read((journal_size - self._journal_offset) // ENTRY.itemsize * ENTRY.itemsize)
+            for key, shard, length, offset in np.frombuffer(tail, dtype=ENTRY).tolist():
+                self._journal[key] = (shard, offset, length)
+            self._journal_offset += len(tail)
+
+    def _check(self):
+        now = time.monotonic()
+        if self._last_check is None or now - self._last_check >= self.check_interval:
+            with self._lock:
+                self._last_check = now
+                self._refresh()
+
+    def _locate(self, key):
+        entry = self._journal.get(key)
+        if entry is not None:
+            return entry
+        keys = self._index[0]
+        i = int(np.searchsorted(keys, np.uint64(key)))
+        if i < len(keys) and keys[i] == key:
+            return int(self._index[1, i]), int(self._index[2, i]), int(self._index[3, i])
+        return None
+
+    def _read(self, shard, offset, length):
+        with self._lock:
+            f = self._files.get(shard)
+            if f is None:
+                f = self._files[shard] = open(shard_path(self.root, shard), "rb")
+            f.seek(offset)
+            return f.read(length)
+
+    def get(self, patient_id):
+        """The patient's latest record as a read-only dict, or None."""
+        self._check()
+        entry = self._locate(patient_key(patient_id))
+        if entry is not None:
+            try:
+                record = json.loads(self._read(*entry))
+            except (OSError, ValueError) as e:
+                logger.error(f"Unreadable insight record for {patient_id}: {e}")
+                record = None
+            if record is not None and record.get("patient_id") == patient_id:
+                self._hits += 1
+                return freeze(record)
+        self._misses += 1
+        return None
+
+    def __contains__(self, patient_id):
+        self._check()
+        return self._locate(patient_key(patient_id)) is not None
+
+    def __len__(self):
+        self._check()
+        indexed = self._index.shape[1]
+        if not self._journal:
+            return indexed
+        keys = np.fromiter(self._journal, dtype="<u8", count=len(self._journal))
+        return indexed + int((~np.isin(keys, self._index[0])).sum())
+
+    # ----- write side -----
+
+    def _open_shard(self):
+        shards = sorted(int(os.path.basename(p)[6:11]) for p in glob.glob(os.path.join(self.root, "shard-*.jsonl")))
+        shard = shards[-1] if shards else 0
+        if shards and os.path.getsize(shard_path(self.root, shard)) >= SHARD_BYTES:
+            shard += 1
+        return shard
+
+    def put_many(self, records, sync=True):
+        """
+        Append records (dicts with "patient_id"); returns how many were written. Shard
+        bytes are flushed before their index entries, so readers never see an entry whose
+        record is not written yet; `sync=False` skips the fsync (per-record writers that
+        sync once at the end).
+        """
+        os.makedirs(self.root, exist_ok=True)
+        shard = self._open_shard()
+        entries = []
+        out = open(shard_path(self.root, shard), "ab")
+        try:
+            for record in records:
+                if out.tell() >= SHARD_BYTES:
+                    out.close()
+                    shard += 1
+                    out = open(shard_path(self.root, shard), "ab")
+                line = json.dumps(record, default=str, separators=(",", ":")).encode() + b"\n"
+                entries.append((patient_key(record["patient_id"]), shard, len(line) - 1, out.tell()))
+                out.write(line)
+            out.flush()
+            if sync:
+                os.fsync(out.fileno())
+        finally:
+            out.close()
+        if not entries:
+            return 0
+        with open(os.path.join(self.root, JOURNAL), "ab") as f:
+            f.write(np.array(entries, dtype=ENTRY).tobytes())
+        if os.path.getsize(os.path.join(self.root, JOURNAL)) // ENTRY.itemsize >= MERGE_ENTRIES:
+            self.merge()
+        self._last_check = None
+        return len(entries)
+
+    def put(self, record, sync=True):
+        return self.put_many([record], sync)
+
+    def _entries(self):
+        """Index plus journal entries in write order."""
+        parts = []
+        index = os.path.join(self.root, INDEX)
+        if os.path.exists(index):
+            parts.append(_rows(np.load(index)))
+        journal = os.path.join(self.root, JOURNAL)
+        if os.path.exists(journal):
+            with open(journal, "rb") as f:
+                raw = f.read()
+            parts.append(np.frombuffer(raw[:len(raw) // ENTRY.itemsize * ENTRY.itemsize], dtype=ENTRY))
+        return np.concatenate(parts) if parts else np.empty(0, dtype=ENTRY)
+
+    def _publish_index(self, entries):
+        tmp = os.path.join(self.root, f"{INDEX}.{os.getpid()}.tmp.npy")
+        np.save(tmp, _columns(entries))
+        os.replace(tmp, os.path.join(self.root, INDEX))
+        # Readers that saw the old journal notice it shrink and reload against the new index.
+        open(os.path.join(self.root, JOURNAL), "wb").close()
+        self._last_check = None
+
+    def merge(self):
+        """Fold the journal into index.npy."""
+        entries = _latest(self._entries())
+        self._publish_index(entries)
+        logger.info(f"Patient insight index merged: {len(entries):,} patients")
+
+    def compact(self):
+        """Rewrite live records into fresh shards and drop superseded ones."""
+        entries = _latest(self._entries())
+        old_shards = glob.glob(os.path.join(self.root, "shard-*.jsonl"))
+        shard = self._open_shard() + 1
+        live = np.empty(len(entries), dtype=ENTRY)
+        out = open(shard_path(self.root, shard), "wb")
+        sources = {}
+        try:
+            for i, (key, src, length, offset) in enumerate(entries.tolist()):
+                if out.tell() >= SHARD_BYTES:
+                    out.close()
+                    shard += 1
+                    out = open(shard_path(self.root, shard), "wb")
+                if src not in sources:
+                    sources[src] = open(shard_path(self.root, src), "rb")
+                f = sources[src]
+                f.seek(offset)
+                live[i] = (key, shard, length, out.tell())
+                out.write(f.read(length) + b"\n")
+            out.flush()
+            os.fsync(out.fileno())
+        finally:
+            out.close()
+            for f in sources.values():
+                f.close()
+        self._publish_index(live)
+        for path in old_shards:
+            try:
+                os.remove(path)
+            except OSError as e:
+                # Still open in a reader (e.g. on Windows); left for the next compaction.
+                logger.warning(f"Could not remove compacted shard {path}: {e}")
+        logger.info(f"Patient insights compacted: {len(live):,} live records")
+
+    def stats(self):
+        self._check()
+        return {"patients": len(self), "index_entries": self._index.shape[1], "journal_entries": len(self._journal),
+                "hits": self._hits, "misses": self._misses, "root": self.root}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_patient_insight_store(root=None):
+    """Shared PatientInsightStore for this server process (PATIENT_INSIGHTS_DIR)."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = PatientInsightStore(root or os.getenv("PATIENT_INSIGHTS_DIR", DEFAULT_ROOT))
+    return _store
+
+
+def read_records(path):
+    """Records from a JSON-lines file, or the hero_patients of an ai_insights.json-shaped file."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            heroes = json.load(f).get("doctor", {}).get("hero_patients", {})
+            for pid, record in heroes.items():
+                yield dict(record, patient_id=pid)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the per-patient insight store.")
+    parser.add_argument("--root", default=os.getenv("PATIENT_INSIGHTS_DIR", DEFAULT_ROOT))
+    commands = parser.add_subparsers(dest="command", required=True)
+    load = commands.add_parser("load", help="Append records from JSON-lines files or ai_insights.json")
+    load.add_argument("paths", nargs="+")
+    get = commands.add_parser("get", help="Print one patient's record")
+    get.add_argument("patient_id")
+    commands.add_parser("compact", help="Drop superseded records")
+    args = parser.parse_args(argv)
+
+    store = PatientInsightStore(args.root)
+    if args.command == "load":
+        for path in args.paths:
+            started = time.perf_counter()
+            count = store.put_many(read_records(path))
+            logger.info(f"Loaded {count:,} records from {path} in {time.perf_counter() - started:.1f}s")
+        store.merge()
+    elif args.command == "get":
+        record = store.get(args.patient_id)
+        print(json.dumps(record, indent=2) if record is not None else "Not found")
+    else:
+        store.compact()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# utils/patient_narratives.py
+"""
+Per-patient narrative records in the doctor.hero_patients shape.
+
+patient_facts() reduces Synthea-shaped tables to one row of facts per patient;
+template_record() turns a row into a complete record with rule-based text, and
+narrative_prompt() / parse_narrative() let an LLM rewrite the narrative fields from the
+same facts (utils.narrative_batch). The synthetic population generator writes template
+records directly.
+"""
+import json
+import numpy as np
+import pandas as pd
+
+from utils.risk_engine import score_population
+
+# Archetypes used by the curated hero patients.
+CHRONIC_ACCUMULATOR = "Chronic Risk Accumulator"
+INSURANCE_SHOCK = "Insurance Shock Patient"
+FRAGMENTED_CARE = "Fragmented Care Victim"
+PREVENTIVE_FAILURE = "Preventive Failure Case"
+
+# Fields an LLM may rewrite; everything else in a record comes from the facts.
+NARRATIVE_FIELDS = ["ai_patient_state", "ai_temporal_reasoning", "ai_recommended_focus", "ai_conclusion",
+                    "predictions", "care_gaps", "suggested_action", "cost_coverage_insight", "co_pilot_prompts"]
+
+
+def _first_by_patient(frame, ids, column, default):
+    rows = frame.drop_duplicates("PATIENT")
+    return pd.Series(ids).map(dict(zip(rows["PATIENT"], rows[column]))).fillna(default).to_numpy()
+
+
+def patient_facts(tables, payers, as_of=None):
+    """
+    One row per patient in tables["patients"]: demographics, risk features, leading active
+    diagnoses, coverage history and archetype. `tables` holds DataFrames for patients,
+    conditions, encounters, medications and payer_transitions; `payers` maps payer ID to name.
+    """
+    patients = tables["patients"]
+    scores, _ = score_population(patients[["Id", "BIRTHDATE"]], tables["conditions"], tables["encounters"],
+                                 tables["medications"], as_of)
+    ids = patients["Id"].to_numpy()
+    conditions = tables["conditions"]
+    active = conditions[conditions["STOP"].isna()].sort_values("START", kind="stable")
+    primary = _first_by_patient(active, ids, "DESCRIPTION", "no chronic diagnosis")
+    secondary = _first_by_patient(active.iloc[::-1], ids, "DESCRIPTION", "")
+    secondary = np.where((secondary == primary) | (secondary == ""), "no other active diagnosis", secondary)
+    onset = pd.to_datetime(pd.Series(_first_by_patient(active, ids, "START", pd.NaT)))
+    transitions = tables["payer_transitions"]
+    coverage = transitions.groupby("PATIENT").size().reindex(ids, fill_value=1).to_numpy()
+    current_payer = transitions.drop_duplicates("PATIENT", keep="last").set_index("PATIENT")["PAYER"]
+
+    chronic = scores["chronic_conditions"].to_numpy()
+    acute_visits = scores["acute_visits"].to_numpy() + scores["inpatient_stays"].to_numpy()
+    return pd.DataFrame({
+        "patient_id": ids,
+        "name": (patients["FIRST"].fillna("") + " " + patients["LAST"].fillna("")).str.strip().to_numpy(),
+        "age": scores["age"].to_numpy().astype(int),
+        "gender": np.where(patients["GENDER"].to_numpy() == "F", "Female", "Male"),
+        "archetype": np.select([chronic >= 3, coverage >= 3, acute_visits >= 3],
+                               [CHRONIC_ACCUMULATOR, INSURANCE_SHOCK, FRAGMENTED_CARE], default=PREVENTIVE_FAILURE),
+        "risk_score": scores["risk_score"].to_numpy(),
+        "hospitalization_risk": scores["hospitalization_risk"].to_numpy(),
+        "chronic_conditions": chronic,
+        "acute_visits": acute_visits,
+        "active_medications": scores["active_medications"].to_numpy(),
+        "coverage_periods": coverage,
+        "payer": current_payer.reindex(ids).map(payers).fillna("no recorded payer").to_numpy(),
+        "primary_condition": primary,
+        "secondary_condition": secondary,
+        "onset_year": onset.dt.strftime("%Y").fillna("an unknown year").to_numpy(),
+    })
+
+
+def template_record(facts):
+    """Complete insight record for one row of patient_facts() (a dict or namedtuple-like mapping)."""
+    f = facts
+    sex = f["gender"][0]
+    primary = f["primary_condition"].lower()
+    high_risk = f["risk_score"] >= 0.7
+    focus = [
+        (f"Review control of {primary} and reconcile" if f["chronic_conditions"] else "Reconcile")
+        + f" the {f['active_medications']} active medication(s).",
+        "Schedule a wellness visit to close preventive screening gaps." if f["archetype"] == PREVENTIVE_FAILURE
+        else f"Coordinate follow-up after acute visits ({f['acute_visits']} in the last 3 years).",
+        f"Confirm coverage continuity with {f['payer']} before the next refill cycle.",
+    ]
+    return {
+        "patient_id": f["patient_id"],
+        "name": f["name"],
+        "archetype": f["archetype"],
+        "risk_score": float(f["risk_score"]),
+        "age": int(f["age"]),
+        "gender": f["gender"],
+        "ai_patient_state": (
+            f"{f['name']} ({f['age']}{sex}) "
+            + (f"carries {f['chronic_conditions']} active chronic condition(s), led by {primary} since "
+               f"{f['onset_year']}, alongside {f['secondary_condition'].lower()}. " if f["chronic_conditions"]
+               else "has no active chronic conditions on record. ")
+            + f"{f['acute_visits']} acute or inpatient encounter(s) in the last three years."
+        ),
+        "ai_temporal_reasoning": (
+            (f"Risk has accumulated since {f['onset_year']}; " if f["chronic_conditions"] else "No long-term risk trend; ")
+            + f"{f['coverage_periods']} coverage period(s) on record"
+            + (" with payer changes that coincide with gaps in medication continuity." if f["coverage_periods"] > 1 else ".")
+        ),
+        "ai_recommended_focus": focus,
+        "ai_conclusion": f"Profile consistent with the {f['archetype']} archetype; "
+                         f"{'prioritize proactive outreach' if high_risk else 'maintain routine monitoring'}.",
+        "predictions": f"Estimated hospitalization risk in the next 12 months: ~{f['hospitalization_risk']:.2f}.",
+        "care_gaps": "AI Gap Alert: " + ("No recent wellness check." if f["archetype"] == PREVENTIVE_FAILURE
+                                         else "Follow-up after acute care not documented."),
+        "suggested_action": focus[0],
+        "cost_coverage_insight": f"Currently covered by {f['payer']}; "
+                                 f"{f['active_medications']} active medication(s) to keep continuous.",
+        "co_pilot_prompts": {
+            "Summarize this patient in one paragraph":
+                f"{f['name']}, {f['age']}{sex}, {f['archetype'].lower()} with {primary}.",
+            "What should I focus on in the next visit?": focus[0],
+            "Why is this patient high risk?" if high_risk else "What keeps this patient's risk low?":
+                f"Risk score {f['risk_score']:.2f} from {f['chronic_conditions']} chronic condition(s) "
+                f"and {f['acute_visits']} acute visit(s).",
+        },
+    }
+
+
+def narrative_prompt(facts):
+    """LLM prompt for one patient's narrative fields. Names and IDs are not sent."""
+    context = {
+        "age": int(facts["age"]), "gender": facts["gender"], "archetype": facts["archetype"],
+        "risk_score": round(float(facts["risk_score"]), 2),
+        "hospitalization_risk_12m": round(float(facts["hospitalization_risk"]), 2),
+        "active_chronic_conditions": int(facts["chronic_conditions"]),
+        "leading_diagnoses": [facts["primary_condition"], facts["secondary_condition"]],
+        "chronic_since": facts["onset_year"],
+        "acute_or_inpatient_visits_3y": int(facts["acute_visits"]),
+        "active_medications": int(facts["active_medications"]),
+        "coverage_periods": int(facts["coverage_periods"]), "current_payer": facts["payer"],
+    }
+    return (
+        "You are a clinical documentation assistant. From the de-identified patient facts below, write "
+        "concise, clinically careful text for a physician dashboard. Reply with one JSON object only, with keys: "
+        "ai_patient_state (2-3 sentences), ai_temporal_reasoning (1-2 sentences on how risk developed over time), "
+        "ai_recommended_focus (list of 3 short strings), ai_conclusion (1 sentence), predictions (1 sentence), "
+        "care_gaps (1 sentence starting 'AI Gap Alert:'), suggested_action (1 sentence), cost_coverage_insight "
+        "(1 sentence), co_pilot_prompts (object mapping 3 questions a physician might ask to 1-2 sentence answers).\n"
+        f"Facts: {json.dumps(context)}"
+    )
+
+
+def parse_narrative(text):
+    """Narrative fields from an LLM reply; raises ValueError when the reply is unusable."""
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        raise ValueError("no JSON object in response")
+    data = json.loads(text[start:end + 1])
+    missing = [field for field in NARRATIVE_FIELDS if field not in data]
+    if missing:
+        raise ValueError(f"response missing {', '.join(missing)}")
+    if not isinstance(data["ai_recommended_focus"], list) or not isinstance(data["co_pilot_prompts"], dict):
+        raise ValueError("ai_recommended_focus must be a list and co_pilot_prompts an object")
+    return {field: data[field] for field in NARRATIVE_FIELDS}
@@ -0,0 +1,186 @@
+# utils/patient_repository.py
+import os
+import sys
+import threading
+from collections import OrderedDict
+import pandas as pd
+from loguru import logger
+
+from utils.care_gaps import STATE_TABLE as CARE_GAPS, get_care_gap_table
+from utils.clinical_store import get_clinical_store
+from utils.continuity import COVERAGE_TABLE, MEDICATION_TABLE, get_continuity
+
+# Raw store tables behind the doctor panels; fetched together in one read per patient.
+SOURCE_TABLES = ["conditions", "observations", "encounters", "payer_transitions", "medications"]
+PANELS = ["conditions", "observations", "encounters", "care_gaps", "insurance", "medications"]
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def _conditions(rows):
+    return pd.DataFrame({
+        "Condition": rows["DESCRIPTION"],
+        "Status": rows["STOP"].isna().map({True: "Active", False: "Resolved"}),
+        "Onset": rows["START"].dt.date,
+    })
+
+
+def _observations(rows):
+    rows = rows.sort_values("DATE", ascending=False)
+    return pd.DataFrame({
+        "Date": rows["DATE"].dt.date,
+        "Observation": rows["DESCRIPTION"],
+        "Value": (rows["VALUE"].fillna("") + " " + rows["UNITS"].fillna("")).str.strip(),
+    })
+
+
+def _encounters(rows):
+    return pd.DataFrame({
+        "Date": rows["START"].dt.strftime("%Y-%m-%d"),
+        "Type": rows["ENCOUNTERCLASS"].str.capitalize(),
+        "Description": rows["DESCRIPTION"],
+    })
+
+
+def _insurance(rows, payer_names):
+    return pd.DataFrame({
+        "Payer": rows["PAYER"].map(lambda p: payer_names.get(p, p)),
+        "Years": rows["START_YEAR"].astype("Int64").astype(str) + "–" + rows["END_YEAR"].astype("Int64").astype(str),
+        "Status": (rows["END_YEAR"] >= pd.Timestamp.now().year).map({True: "Active", False: "Inactive"}),
+    })
+
+
+def _medications(rows, continuity=None):
+    """Raw prescriptions; with a continuity run, its scored rows replace those it covers."""
+    panel = pd.DataFrame({
+        "Medication": rows["DESCRIPTION"],
+        "Start": rows["START"].dt.date,
+        "Continuity": rows["STOP"].isna().map({True: "Ongoing", False: "Stopped"}),
+    })
+    if continuity is None or continuity.empty:
+        return panel
+    # Prescriptions that ended before the continuity lookback window keep their raw row.
+    older = panel[~panel["Medication"].isin(continuity["Medication"])].drop_duplicates("Medication")
+    older = older.rename(columns={"Start": "Measured from"}).assign(Continuity="Stopped")
+    return pd.concat([continuity, older], ignore_index=True)
+
+
+def _last_visit_summary(rows):
+    last = rows.sort_values("START").iloc[-1]
+    summary = f"Last visit: {last['START']:%Y-%m-%d} – {last['DESCRIPTION']} ({str(last['ENCOUNTERCLASS']).lower()})"
+    reason = last.get("REASONDESCRIPTION")
+    if isinstance(reason, str) and reason:
+        summary += f"; reason: {reason}"
+    return summary + "."
+
+
+def _footprint(panels):
+    size = sys.getsizeof(panels.get("summary") or "") + sys.getsizeof(panels.get("coverage_summary") or "")
+    for name in PANELS:
+        size += int(panels[name].memory_usage(index=True, deep=True).sum())
+    return size
+
+
+class PatientRepository:
+    """
+    All doctor-view panels for one patient from a single batched store read, kept in an
+    LRU shared by every session and bounded by the DataFrames' memory footprint (bytes).
+    Cached panels are shared objects: callers must not mutate them.
+    """
+
+    def __init__(self, store=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.store = store or get_clinical_store()
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()   # patient_id -> (panels, bytes)
+        self._bytes = 0
+        self._generation = None
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _load(self, patient_id):
+        raw = self.store.read_patient(patient_id, SOURCE_TABLES)
+        frames = {t: (rows.to_pandas() if rows is not None else pd.DataFrame()) for t, rows in raw.items()}
+        panels = {name: pd.DataFrame() for name in PANELS}
+        panels["summary"] = None
+        panels["coverage_summary"] = None
+        continuity = get_continuity(self.store)
+        if not frames["conditions"].empty:
+            panels["conditions"] = _conditions(frames["conditions"])
+        if not frames["observations"].empty:
+            panels["observations"] = _observations(frames["observations"])
+        if not frames["encounters"].empty:
+            panels["encounters"] = _encounters(frames["encounters"])
+            panels["summary"] = _last_visit_summary(frames["encounters"])
+        if not frames["payer_transitions"].empty:
+            payers = self.store.reference("payers")
+            names = dict(zip(payers["Id"], payers["NAME"])) if not payers.empty else {}
+            panels["insurance"] = _insurance(frames["payer_transitions"], names)
+        if continuity is not None:
+            panels["coverage_summary"] = continuity.coverage_summary(patient_id)
+        if not frames["medications"].empty:
+            panels["medications"] = _medications(
+                frames["medications"], continuity.medication_panel(patient_id) if continuity is not None else None)
+        gaps = get_care_gap_table(self.store)
+        if gaps is not None:
+            panels["care_gaps"] = gaps.for_patient(patient_id)
+        return panels
+
+    def get_panels(self, patient_id):
+        """
+        Dict of panel DataFrames (empty when the store has no rows) plus "summary" and
+        "coverage_summary" (str or None).
+        """
+        generation = (self.store.generation, self.store.derived_version(CARE_GAPS),
+                      self.store.derived_version(MEDICATION_TABLE), self.store.derived_version(COVERAGE_TABLE))
+        with self._lock:
+            if generation != self._generation:
+                # New ingestion, care-gap or continuity run landed; every cached panel may be stale.
+                self._cache.clear()
+                self._bytes = 0
+                self._generation = generation
+            cached = self._cache.get(patient_id)
+            if cached is not None:
+                self._cache.move_to_end(patient_id)
+                self._hits += 1
+                return cached[0]
+            self._misses += 1
+
+        panels = self._load(patient_id)
+        size = _footprint(panels)
+        with self._lock:
+            if patient_id not in self._cache and size <= self.max_bytes:
+                self._cache[patient_id] = (panels, size)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, (_, evicted) = self._cache.popitem(last=False)
+                    self._bytes -= evicted
+                    self._evictions += 1
+        return panels
+
+    def stats(self):
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+            "entries": len(self._cache),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+_repository = None
+_repository_lock = threading.Lock()
+
+
+def get_patient_repository():
+    """Shared PatientRepository for this server process."""
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                max_mb = int(os.getenv("PATIENT_CACHE_MB", DEFAULT_MAX_BYTES // (1024 * 1024)))
+                _repository = PatientRepository(max_bytes=max_mb * 1024 * 1024)
+                logger.info(f"Patient repository ready (LRU budget {_repository.max_bytes // (1024 * 1024)} MB)")
+    return _repository
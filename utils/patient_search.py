@@ -0,0 +1,257 @@
+# utils/patient_search.py
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from loguru import logger
+
+from utils.clinical_store import get_clinical_store
+from utils.insight_store import get_insight_store
+from utils.risk_engine import band_of
+from utils.snapshots import get_snapshot
+
+PAGE_SIZE = 25
+
+DIRECTORY_COLUMNS = ["patient_id", "name", "age", "gender", "archetype", "risk_score", "risk_band"]
+
+
+def risk_band(scores):
+    """Risk band per score using the engine's cut points; missing scores are "unscored"."""
+    scores = pd.Series(scores, dtype="float64")
+    bands = pd.Series("unscored", index=scores.index, dtype="object")
+    scored = scores.notna()
+    bands[scored] = band_of(scores[scored].to_numpy())
+    return bands
+
+
+def build_patient_directory(store=None, insights=None):
+    """One row per searchable patient: ingested patients plus the curated hero patients."""
+    store = store or get_clinical_store()
+    insights = insights if insights is not None else get_insight_store().snapshot()
+    frames = []
+
+    parts = [t.to_pandas() for t in store.scan("patients", None)]
+    if parts:
+        patients = pd.concat(parts, ignore_index=True)
+        today = pd.Timestamp.now()
+        age = (today - patients["BIRTHDATE"]).dt.days // 365 if "BIRTHDATE" in patients else np.nan
+        name = (patients.get("FIRST", pd.Series("", index=patients.index)).fillna("") + " " +
+                patients.get("LAST", pd.Series("", index=patients.index)).fillna("")).str.strip()
+        ingested = pd.DataFrame({
+            "patient_id": patients["Id"],
+            "name": name,
+            "age": age,
+            "gender": patients.get("GENDER"),
+            "archetype": "Unprofiled",
+        })
+        scores = store.read_derived("risk_scores")
+        if scores is not None:
+            scores = scores.select(["patient_id", "risk_score"]).to_pandas()
+            ingested = ingested.merge(scores, on="patient_id", how="left")
+        else:
+            ingested["risk_score"] = np.nan
+        frames.append(ingested)
+
+    heroes = insights.get("doctor", {}).get("hero_patients", {})
+    if heroes:
+        frames.append(pd.DataFrame([
+            {"patient_id": pid, "name": p.get("name"), "age": p.get("age"), "gender": p.get("gender"),
+             "archetype": p.get("archetype"), "risk_score": p.get("risk_score")}
+            for pid, p in heroes.items()
+        ]))
+
+    if not frames:
+        return pd.DataFrame(columns=DIRECTORY_COLUMNS)
+    # Curated hero records win over the raw demographics for the same patient.
+    directory = pd.concat(frames, ignore_index=True).drop_duplicates("patient_id", keep="last")
+    directory["risk_score"] = directory["risk_score"].astype("float64")
+    directory["risk_band"] = risk_band(directory["risk_score"]).to_numpy()
+    return directory[DIRECTORY_COLUMNS].reset_index(drop=True)
+
+
+def _utf8(values):
+    """Fixed-width bytes array (numpy "S") of UTF-8 encoded strings; searchable even when memory-mapped."""
+    encoded = [str(v).encode("utf-8") for v in values]
+    return np.array(encoded, dtype=f"S{max(map(len, encoded), default=0) or 1}")
+
+
+def _postings(keys, rows):
+    """CSR postings: sorted unique keys, offsets into rows, and rows (ascending per key)."""
+    if not len(keys):
+        return _utf8([]), np.zeros(1, dtype="int64"), np.array([], dtype="int32")
+    frame = pd.DataFrame({"key": keys, "row": rows}).drop_duplicates().sort_values(["key", "row"])
+    unique, starts = np.unique(frame["key"].to_numpy(), return_index=True)
+    offsets = np.append(starts, len(frame)).astype("int64")
+    return _utf8(unique), offsets, frame["row"].to_numpy().astype("int32")
+
+
+def search_arrays(directory):
+    """
+    Risk-ordered directory as an Arrow table plus every search structure as a flat numpy
+    array, so the index can be built in-process or memory-mapped from a shared snapshot.
+    """
+    directory = directory.sort_values("risk_score", ascending=False, na_position="last",
+                                      kind="stable").reset_index(drop=True)
+    rows = np.arange(len(directory), dtype="int32")
+
+    ids = _utf8(directory["patient_id"].astype(str).str.lower())
+    id_order = np.argsort(ids, kind="stable").astype("int32")
+
+    names = directory["name"].fillna("").astype(str).str.lower()
+    words = names.str.split().explode().dropna()
+    word_rows = words.index.to_numpy().astype("int32")
+    words = _utf8(words)
+    word_order = np.argsort(words, kind="stable")
+
+    grams, gram_rows = [], []
+    for start in range(int(names.str.len().max() or 0) - 2):
+        gram = names.str.slice(start, start + 3)
+        keep = gram.str.len() == 3
+        grams.append(gram[keep].to_numpy())
+        gram_rows.append(rows[keep.to_numpy()])
+    trigram_keys, trigram_offsets, trigram_rows = _postings(
+        np.concatenate(grams) if grams else [], np.concatenate(gram_rows) if gram_rows else [])
+
+    arrays = {
+        "ids_sorted": ids[id_order], "id_order": id_order,
+        "words_sorted": words[word_order], "word_rows": word_rows[word_order],
+        "trigram_keys": trigram_keys, "trigram_offsets": trigram_offsets, "trigram_rows": trigram_rows,
+        "names": _utf8(names),
+    }
+    for column in ("archetype", "risk_band"):
+        codes, values = pd.factorize(directory[column].fillna("").astype(str).str.lower())
+        arrays[f"{column}_codes"] = codes.astype("int32")
+        arrays[f"{column}_values"] = _utf8(values)
+    table = pa.Table.from_pandas(directory[DIRECTORY_COLUMNS], preserve_index=False)
+    return table, arrays
+
+
+class PatientSearchIndex:
+    """
+    Search over the patient directory. Rows are stored in descending risk order, so any
+    candidate set is already ranked: the top-K page is just its first K positions.
+
+    - patient ID: prefix match by binary search over the sorted IDs
+    - name: trigram postings (queries >= 3 chars) and word-prefix search (shorter queries)
+    - archetype / risk band: substring match over the few distinct values
+
+    Everything lives in flat arrays (see search_arrays), so the same index either is built
+    in this process or is memory-mapped from a snapshot shared by every server process;
+    only the page of results being shown is ever converted to a DataFrame.
+    """
+
+    def __init__(self, directory):
+        self._load(*search_arrays(directory))
+
+    @classmethod
+    def from_arrays(cls, table, arrays):
+        index = cls.__new__(cls)
+        index._load(table, arrays)
+        return index
+
+    def _load(self, table, arrays):
+        self.table = table
+        self.arrays = arrays
+        self._categories = [(arrays[f"{c}_codes"], arrays[f"{c}_values"]) for c in ("archetype", "risk_band")]
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def _prefix(self, sorted_keys, term):
+        lo = np.searchsorted(sorted_keys, term, side="left")
+        hi = np.searchsorted(sorted_keys, term + b"\xff", side="left")
+        return lo, hi
+
+    def _posting(self, gram):
+        keys = self.arrays["trigram_keys"]
+        i = np.searchsorted(keys, gram)
+        if i >= len(keys) or keys[i] != gram:
+            return None
+        offsets = self.arrays["trigram_offsets"]
+        return self.arrays["trigram_rows"][offsets[i]:offsets[i + 1]]
+
+    def _match_term(self, term):
+        a = self.arrays
+        encoded = term.encode("utf-8")
+        lo, hi = self._prefix(a["ids_sorted"], encoded)
+        hits = [a["id_order"][lo:hi]]
+
+        if len(term) >= 3:
+            candidates = None
+            for i in range(len(term) - 2):
+                posting = self._posting(term[i:i + 3].encode("utf-8"))
+                if posting is None:
+                    candidates = np.array([], dtype="int32")
+                    break
+                candidates = posting if candidates is None else np.intersect1d(candidates, posting, assume_unique=True)
+            if candidates is not None and len(candidates) and len(term) > 3:
+                # Trigrams can all match without the term being contiguous; verify the survivors.
+                candidates = candidates[[encoded in a["names"][r] for r in candidates]]
+            hits.append(candidates)
+        else:
+            lo, hi = self._prefix(a["words_sorted"], encoded)
+            hits.append(a["word_rows"][lo:hi])
+
+        for codes, values in self._categories:
+            matching = [i for i, v in enumerate(values) if encoded in v]
+            if matching:
+                hits.append(np.flatnonzero(np.isin(codes, matching)))
+        return np.unique(np.concatenate([h for h in hits if h is not None and len(h)] or [np.array([], dtype="int32")]))
+
+    def search(self, query="", page=0, page_size=PAGE_SIZE):
+        """
+        Return (page DataFrame, total matches) for a whitespace-separated query; every term
+        must match some field. Results are ordered by risk_score, highest first.
+        """
+        terms = query.lower().split()
+        if not terms:
+            total = len(self)
+            return self.table.slice(page * page_size, page_size).to_pandas(), total
+        rows = None
+        for term in terms:
+            matched = self._match_term(term)
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+            if not len(rows):
+                break
+        return self.table.take(rows[page * page_size:(page + 1) * page_size]).to_pandas(), len(rows)
+
+    def get(self, patient_id):
+        """Directory row for one patient as a dict, or None."""
+        ids = self.arrays["ids_sorted"]
+        encoded = str(patient_id).lower().encode("utf-8")
+        i = np.searchsorted(ids, encoded)
+        if i >= len(ids) or ids[i] != encoded:
+            return None
+        return self.table.slice(int(self.arrays["id_order"][i]), 1).to_pylist()[0]
+
+
+_index = None
+_index_key = None
+_index_lock = threading.Lock()
+
+
+def get_patient_search():
+    """
+    Shared search index: memory-mapped from the current snapshot when SNAPSHOT_DIR is set,
+    otherwise built in this process and rebuilt when a new ingestion generation or insight
+    version lands.
+    """
+    global _index, _index_key
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        key = ("snapshot", snapshot.generation)
+    else:
+        store = get_clinical_store()
+        key = (store.generation, store.derived_version("risk_scores"), get_insight_store().version)
+    if _index is None or key != _index_key:
+        with _index_lock:
+            if _index is None or key != _index_key:
+                if snapshot is not None:
+                    _index = PatientSearchIndex.from_arrays(snapshot.table("directory"), snapshot.arrays("search"))
+                    logger.info(f"Patient search index mapped from snapshot {snapshot.generation} "
+                                f"({len(_index):,} patients)")
+                else:
+                    _index = PatientSearchIndex(build_patient_directory())
+                    logger.info(f"Patient search index built over {len(_index):,} patients")
+                _index_key = key
+    return _index
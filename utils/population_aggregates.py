@@ -0,0 +1,298 @@
+# utils/population_aggregates.py
+"""
+Incrementally maintained admin aggregates.
+
+    python -m utils.population_aggregates rebuild
+    python -m utils.population_aggregates apply data/raw/encounters_2024-06-01.csv
+
+The executive-overview numbers are kept as mergeable partials: each patient's
+contribution (risk band, hospitalization band, cost per treemap category, avoidable
+cost, care-flow transition counts) is stored per patient, and the population partials
+are plain sums over those rows plus a fixed-bin risk-score histogram. When a batch
+lands, only the patients in it are re-read and re-scored; their old contribution is
+subtracted from the partials and the new one added, then the result is published to
+the insight store that get_insight("admin_data", ...) reads.
+
+Contributions are persisted with the clinical store's patient bucketing
+(derived/population_contributions/bucket-NNNN.arrow), so a batch reads and rewrites
+only the buckets its patients hash to. The `risk_scores` table belongs to
+utils.risk_engine and is never written here.
+
+The scoring reference date (`as_of`) is frozen at the last rebuild so that untouched
+patients' contributions stay valid; run `rebuild` periodically to roll it forward.
+"""
+import argparse
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from loguru import logger
+
+from utils.care_flow import STAGES, sequence_transitions, stage_codes
+from utils.clinical_store import DEFAULT_STORE, TABLES, ClinicalStore, atomic_write, bucket_of, bucket_path
+from utils.ingest import ingest_files, table_for
+from utils.insight_store import get_insight_store
+from utils.risk_engine import BANDS, StageTimer, band_of, patient_codes, score_population
+
+# Treemap category -> (store table, cost column).
+COST_SOURCES = {
+    "Medications": ("medications", "TOTALCOST"),
+    "Procedures": ("procedures", "BASE_COST"),
+    "Encounters": ("encounters", "TOTAL_CLAIM_COST"),
+    "Immunizations": ("immunizations", "BASE_COST"),
+}
+INPUT_COLUMNS = {
+    "patients": (["Id", "BIRTHDATE"], [pa.string(), pa.timestamp("ms")]),
+    "conditions": (["PATIENT", "STOP", "DESCRIPTION"], [pa.string(), pa.timestamp("ms"), pa.string()]),
+    "encounters": (["PATIENT", "START", "ENCOUNTERCLASS", "TOTAL_CLAIM_COST"],
+                   [pa.string(), pa.timestamp("ms"), pa.string(), pa.float64()]),
+    "medications": (["PATIENT", "STOP", "TOTALCOST"], [pa.string(), pa.timestamp("ms"), pa.float64()]),
+    "procedures": (["PATIENT", "BASE_COST"], [pa.string(), pa.float64()]),
+    "immunizations": (["PATIENT", "BASE_COST"], [pa.string(), pa.float64()]),
+}
+HISTOGRAM_BINS = 100
+FLOW_COLUMNS = [f"flow_{i}_{j}" for i in range(len(STAGES)) for j in range(len(STAGES))]
+STATE_TABLE = "population_contributions"
+PARTIALS_FILE = "population_partials.json"
+
+
+def _conform(data, table):
+    columns, types = INPUT_COLUMNS[table]
+    arrays = {}
+    for column, kind in zip(columns, types):
+        if data is not None and column in data.column_names:
+            arrays[column] = pc.cast(data.column(column), kind)
+        else:
+            arrays[column] = pa.nulls(data.num_rows if data is not None else 0, kind)
+    return pa.table(arrays)
+
+
+def load_inputs(store, patient_ids=None):
+    """Input tables for the whole population, or only for `patient_ids`."""
+    inputs = {}
+    for table, (columns, _) in INPUT_COLUMNS.items():
+        if patient_ids is None:
+            data = store.read_table(table, columns)
+        else:
+            data = store.read_patients(table, patient_ids, columns)
+        inputs[table] = _conform(data, table)
+    return inputs
+
+
+def patient_contributions(inputs, as_of):
+    """One row per patient with everything the admin aggregates are summed from."""
+    scores, _ = score_population(inputs["patients"], inputs["conditions"], inputs["encounters"],
+                                 inputs["medications"], as_of)
+    patient_ids = inputs["patients"].column("Id").combine_chunks()
+    n = len(patient_ids)
+    out = pd.DataFrame({
+        "patient_id": scores["patient_id"],
+        "risk_score": scores["risk_score"],
+        "risk_band": scores["risk_band"],
+        "hospitalization_band": band_of(scores["hospitalization_risk"].to_numpy()),
+        "acute_cost": scores["acute_cost"],
+        "avoidable_cost": np.where(scores["chronic_conditions"] > 0, scores["acute_cost"], 0.0),
+    })
+    for label, (table, column) in COST_SOURCES.items():
+        data = inputs[table]
+        codes = patient_codes(patient_ids, data.column("PATIENT"))
+        cost = pc.fill_null(data.column(column), 0.0).to_numpy()
+        keep = codes >= 0
+        out[f"cost_{label}"] = np.bincount(codes[keep], weights=cost[keep], minlength=n)
+
+    encounters = inputs["encounters"]
+    codes = patient_codes(patient_ids, encounters.column("PATIENT"))
+    keep = codes >= 0
+    start = encounters.column("START").to_numpy().astype("datetime64[D]")[keep]
+    stages = stage_codes(encounters.column("ENCOUNTERCLASS"))[keep]
+    patient, _, source, target = sequence_transitions(codes[keep], start, stages)
+    k = len(STAGES)
+    flows = np.bincount(patient * k * k + source.astype("int64") * k + target, minlength=n * k * k).reshape(n, k * k)
+    out[FLOW_COLUMNS] = flows.astype("int32")
+    return out
+
+
+def summarize(contributions):
+    """Partials (counts, sums, histogram) for a set of contribution rows; partials add and subtract."""
+    histogram, _ = np.histogram(contributions["risk_score"], bins=HISTOGRAM_BINS, range=(0.0, 1.0))
+    return {
+        "patients": int(len(contributions)),
+        "risk_bands": {b: int((contributions["risk_band"] == b).sum()) for b, _ in BANDS},
+        "hospitalization_bands": {b: int((contributions["hospitalization_band"] == b).sum()) for b, _ in BANDS},
+        "costs": {label: float(contributions[f"cost_{label}"].sum()) for label in COST_SOURCES},
+        "risk_band_encounter_costs": {b: float(contributions.loc[contributions["risk_band"] == b, "cost_Encounters"].sum())
+                                      for b, _ in BANDS},
+        "acute_cost": float(contributions["acute_cost"].sum()),
+        "avoidable_cost": float(contributions["avoidable_cost"].sum()),
+        "flows": [int(v) for v in contributions[FLOW_COLUMNS].sum().to_numpy()],
+        "risk_histogram": [int(v) for v in histogram],
+    }
+
+
+def combine(a, b, sign=1):
+    """a + sign * b for two partials produced by summarize()."""
+    if isinstance(a, dict):
+        return {k: combine(a[k], b.get(k, 0), sign) for k in a}
+    if isinstance(a, list):
+        return [x + sign * y for x, y in zip(a, b)]
+    return a + sign * b
+
+
+def admin_aggregates(partials):
+    """Translate partials into the admin_data keys the dashboard reads."""
+    n = max(partials["patients"], 1)
+    pct = lambda counts: {b: int(round(100 * counts[b] / n)) for b, _ in reversed(BANDS)}
+    risk = pct(partials["risk_bands"])
+    encounter_spend = partials["costs"]["Encounters"]
+    avoidable = round(partials["avoidable_cost"] / encounter_spend, 2) if encounter_spend else 0.0
+    high_risk_cost_share = (int(round(100 * partials["risk_band_encounter_costs"]["high"] / encounter_spend))
+                            if encounter_spend else 0)
+    k = len(STAGES)
+    links = [(i, j, v) for (i, j), v in zip(((i, j) for i in range(k) for j in range(k)), partials["flows"]) if v]
+    return {
+        "total_patients": partials["patients"],
+        "high_risk_cohort": risk["high"],
+        "risk_distribution": risk,
+        "hospitalization_risk_distribution": pct(partials["hospitalization_bands"]),
+        "avoidable_cost_index": avoidable,
+        "key_metrics": {
+            "patients_analyzed": partials["patients"],
+            "high_risk_percentage": risk["high"],
+            "high_risk_cost_share": high_risk_cost_share,
+            "avoidable_cost_index": avoidable,
+        },
+        "cost_treemap_data": {
+            "labels": list(partials["costs"]),
+            "values": [round(v, 2) for v in partials["costs"].values()],
+        },
+        "care_flow": {
+            "nodes": STAGES,
+            "source": [i for i, _, _ in links],
+            "target": [j for _, j, _ in links],
+            "value": [v for _, _, v in links],
+        },
+    }
+
+
+class PopulationAggregates:
+    """Per-patient contributions plus their running partials, persisted next to the clinical store."""
+
+    def __init__(self, store_root=DEFAULT_STORE):
+        self.store = ClinicalStore(store_root)
+        self.partials_path = os.path.join(store_root, "derived", PARTIALS_FILE)
+
+    def _bucket_path(self, bucket):
+        return bucket_path(os.path.join(self.store.root, "derived"), STATE_TABLE, bucket)
+
+    def _read_buckets(self, buckets):
+        parts = []
+        for bucket in buckets:
+            path = self._bucket_path(bucket)
+            if os.path.exists(path):
+                with pa.memory_map(path, "r") as source:
+                    parts.append(pa.ipc.open_file(source).read_all().to_pandas())
+        return pd.concat(parts, ignore_index=True) if parts else None
+
+    def _write_buckets(self, contributions, buckets):
+        """Rewrite the given buckets' contribution files (empty buckets get an empty file)."""
+        bucket = bucket_of(contributions["patient_id"], self.store.n_buckets)
+        for b in buckets:
+            rows = contributions[bucket == b]
+            atomic_write(self._bucket_path(b), pa.Table.from_pandas(rows, preserve_index=False))
+
+    def _save_partials(self, partials, as_of):
+        tmp = self.partials_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"as_of": str(as_of), "generation": self.store.generation,
+                       "buckets": self.store.n_buckets, "partials": partials}, f)
+        os.replace(tmp, self.partials_path)
+
+    def load_partials(self):
+        with open(self.partials_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def rebuild(self, as_of=None):
+        """Full recomputation; also resets the frozen scoring date."""
+        timer = StageTimer()
+        with timer.stage("load"):
+            inputs = load_inputs(self.store)
+        if as_of is None:
+            latest = pc.max(inputs["encounters"].column("START")).as_py() if inputs["encounters"].num_rows else None
+            as_of = latest or pd.Timestamp.now()
+        with timer.stage("contributions"):
+            contributions = patient_contributions(inputs, pd.Timestamp(as_of))
+        with timer.stage("summarize"):
+            partials = summarize(contributions)
+        with timer.stage("persist"):
+            self._write_buckets(contributions, range(self.store.n_buckets))
+            self._save_partials(partials, as_of)
+        logger.info(f"Rebuilt aggregates for {len(contributions):,} patients; stage timings (s): {timer.stages}")
+        return partials
+
+    def apply_batch(self, paths):
+        """Ingest new batch files and fold only the affected patients' change into the partials."""
+        timer = StageTimer()
+        with timer.stage("affected"):
+            affected = set()
+            for path in paths:
+                table = table_for(path)
+                key = TABLES[table]["key"] if table else None
+                if key:
+                    for chunk in pd.read_csv(path, usecols=[key], dtype=str, chunksize=500_000):
+                        affected.update(chunk[key].dropna().unique())
+        state = self.load_partials() if os.path.exists(self.partials_path) else None
+        with timer.stage("ingest"):
+            ingest_files(paths, self.store.root)
+        if state is None or state.get("buckets") != self.store.n_buckets:
+            logger.info("No incremental state for this store layout; rebuilding aggregates")
+            return self.rebuild()
+        if not affected:
+            return state["partials"]
+
+        as_of = pd.Timestamp(state["as_of"])
+        affected = sorted(affected)
+        buckets = sorted(set(bucket_of(affected, self.store.n_buckets).tolist()))
+        with timer.stage("rescore"):
+            inputs = load_inputs(self.store, affected)
+            fresh = patient_contributions(inputs, as_of)
+        with timer.stage("merge"):
+            previous = self._read_buckets(buckets)
+            if previous is None:
+                previous = fresh.iloc[:0]
+            stale = previous["patient_id"].isin(affected)
+            partials = combine(combine(state["partials"], summarize(previous[stale]), -1), summarize(fresh))
+            contributions = pd.concat([previous[~stale], fresh], ignore_index=True)
+        with timer.stage("persist"):
+            self._write_buckets(contributions, buckets)
+            self._save_partials(partials, as_of)
+        logger.info(f"Folded {len(fresh):,} affected patients ({len(buckets)} of {self.store.n_buckets} buckets) "
+                    f"into aggregates; stage timings (s): {timer.stages}")
+        return partials
+
+    def publish(self, partials=None):
+        partials = partials or self.load_partials()["partials"]
+        get_insight_store().publish("admin_data", admin_aggregates(partials))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain and publish population aggregates for the admin view.")
+    parser.add_argument("--store", default=DEFAULT_STORE, help="Clinical store directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild = commands.add_parser("rebuild", help="Recompute every patient's contribution")
+    rebuild.add_argument("--as-of", default=None, help="Scoring reference date (default: latest encounter)")
+    apply = commands.add_parser("apply", help="Ingest batch CSVs and update only the affected patients")
+    apply.add_argument("paths", nargs="+", help="Batch CSV files (e.g. encounters_2024-06-01.csv)")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    aggregates = PopulationAggregates(args.store)
+    partials = aggregates.rebuild(args.as_of) if args.command == "rebuild" else aggregates.apply_batch(args.paths)
+    aggregates.publish(partials)
+    logger.info(f"Published admin aggregates in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
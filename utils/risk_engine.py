@@ -0,0 +1,253 @@
+# utils/risk_engine.py
+"""
+Population risk scoring over the clinical store.
+
+    python -m utils.risk_engine --store data/store
+
+Every patient is scored in one vectorized pass: rows are mapped to integer patient
+codes with Arrow's hash kernels and per-patient features are summed with np.bincount
+over the condition, encounter and medication tables (no per-patient Python loops).
+The per-patient scores are written to the store as the `risk_scores` derived table,
+and the admin aggregates (`risk_distribution`,
+`key_metrics`, `hospitalization_risk_distribution`, `avoidable_cost_index`,
+`total_patients`) are published into the insight store overlay.
+"""
+import argparse
+import time
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from loguru import logger
+
+from utils.clinical_store import DEFAULT_STORE, ClinicalStore
+from utils.insight_store import get_insight_store
+
+# Condition descriptions counted as chronic (matched case-insensitively).
+CHRONIC_PATTERN = (
+    r"hypertension|diabet|heart failure|coronary|atrial fibrillation|chronic|copd|emphysema|asthma|"
+    r"kidney disease|obesity|hyperlipidemia|osteoporosis|osteoarthritis|stroke|dementia|alzheimer"
+)
+ACUTE_CLASSES = ["emergency", "urgentcare"]
+INPATIENT_CLASSES = ["inpatient"]
+LOOKBACK_DAYS = 3 * 365
+
+# Logistic model weights: intercept, then per-feature coefficients.
+RISK_WEIGHTS = {"intercept": -3.2, "age_decades": 0.25, "chronic": 0.45, "acute_visits": 0.35,
+                "inpatient_stays": 0.6, "active_meds": 0.08}
+HOSPITALIZATION_WEIGHTS = {"intercept": -3.6, "age_decades": 0.2, "chronic": 0.3, "acute_visits": 0.45,
+                           "inpatient_stays": 0.9, "active_meds": 0.05}
+
+# Band cut points shared with the patient risk gauge.
+BANDS = [("low", 0.0), ("medium", 0.4), ("high", 0.7)]
+
+
+class StageTimer:
+    """Collects wall time per named stage."""
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = round(time.perf_counter() - started, 4)
+
+
+def as_arrow(table):
+    """Accept pandas or Arrow input; all feature work below runs on Arrow compute kernels."""
+    return table if isinstance(table, pa.Table) else pa.Table.from_pandas(table, preserve_index=False)
+
+
+def patient_codes(patient_ids, column):
+    """Integer position of each row's patient in `patient_ids` (-1 when unknown), via a C++ hash lookup."""
+    return pc.fill_null(pc.index_in(column, value_set=patient_ids), -1).to_numpy()
+
+
+def matches(column, pattern):
+    """Case-insensitive regex match, evaluated once per distinct value rather than once per row."""
+    distinct = pc.unique(column)
+    hits = pc.filter(distinct, pc.fill_null(pc.match_substring_regex(distinct, pattern, ignore_case=True), False))
+    return pc.is_in(column, value_set=hits).to_numpy(zero_copy_only=False)
+
+
+def flag(mask):
+    return pc.fill_null(mask, False).to_numpy(zero_copy_only=False)
+
+
+def count_by_patient(codes, n, mask=None, weights=None):
+    keep = codes >= 0
+    if mask is not None:
+        keep &= mask
+    w = None if weights is None else np.nan_to_num(np.asarray(weights, dtype="float64")[keep])
+    return np.bincount(codes[keep], weights=w, minlength=n)
+
+
+def _logistic(features, weights):
+    z = np.full(len(next(iter(features.values()))), weights["intercept"])
+    for name, value in features.items():
+        z += weights[name] * value
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+def band_of(scores):
+    cuts = np.array([cut for _, cut in BANDS[1:]])
+    names = np.array([name for name, _ in BANDS])
+    return names[np.searchsorted(cuts, scores, side="right")]
+
+
+def _percentages(bands):
+    counts = pd.Series(bands).value_counts()
+    total = max(len(bands), 1)
+    return {name: int(round(100 * counts.get(name, 0) / total)) for name, _ in reversed(BANDS)}
+
+
+def score_population(patients, conditions, encounters, medications, as_of=None, timer=None):
+    """
+    Score every patient. Inputs are Arrow tables or DataFrames with Synthea columns
+    (patients: Id, BIRTHDATE; conditions: PATIENT, STOP, DESCRIPTION; encounters: PATIENT,
+    START, ENCOUNTERCLASS, TOTAL_CLAIM_COST; medications: PATIENT, STOP).
+    Returns (per-patient DataFrame, aggregates).
+    """
+    timer = timer or StageTimer()
+    with timer.stage("index"):
+        patients, conditions = as_arrow(patients), as_arrow(conditions)
+        encounters, medications = as_arrow(encounters), as_arrow(medications)
+        patient_ids = patients.column("Id").combine_chunks()
+        n = len(patient_ids)
+        if as_of is None:
+            latest = pc.max(encounters.column("START")).as_py() if encounters.num_rows else None
+            as_of = latest or pd.Timestamp.now()
+        as_of = pd.Timestamp(as_of)
+
+    with timer.stage("features"):
+        birth = patients.column("BIRTHDATE").to_numpy().astype("datetime64[D]")
+        age_years = (np.datetime64(as_of.date(), "D") - birth).astype("float64") / 365.25
+        age_years[np.isnat(birth)] = 40.0
+
+        c_codes = patient_codes(patient_ids, conditions.column("PATIENT"))
+        is_chronic = matches(conditions.column("DESCRIPTION"), CHRONIC_PATTERN)
+        active = flag(pc.is_null(conditions.column("STOP")))
+        chronic = count_by_patient(c_codes, n, is_chronic & active)
+
+        e_codes = patient_codes(patient_ids, encounters.column("PATIENT"))
+        cls = pc.utf8_lower(encounters.column("ENCOUNTERCLASS"))
+        lookback = pa.scalar(as_of - pd.Timedelta(days=LOOKBACK_DAYS), encounters.schema.field("START").type)
+        recent = flag(pc.greater_equal(encounters.column("START"), lookback))
+        is_acute = flag(pc.is_in(cls, value_set=pa.array(ACUTE_CLASSES)))
+        is_inpatient = flag(pc.is_in(cls, value_set=pa.array(INPATIENT_CLASSES)))
+        acute_visits = count_by_patient(e_codes, n, is_acute & recent)
+        inpatient_stays = count_by_patient(e_codes, n, is_inpatient & recent)
+        cost = pc.fill_null(pc.cast(encounters.column("TOTAL_CLAIM_COST"), pa.float64()), 0.0).to_numpy()
+        total_cost = count_by_patient(e_codes, n, weights=cost)
+        acute_cost = count_by_patient(e_codes, n, is_acute | is_inpatient, weights=cost)
+
+        m_codes = patient_codes(patient_ids, medications.column("PATIENT"))
+        active_meds = count_by_patient(m_codes, n, flag(pc.is_null(medications.column("STOP"))))
+
+        features = {
+            "age_decades": age_years / 10.0,
+            "chronic": np.minimum(chronic, 6),
+            "acute_visits": np.minimum(acute_visits, 6),
+            "inpatient_stays": np.minimum(inpatient_stays, 4),
+            "active_meds": np.minimum(active_meds, 10),
+        }
+
+    with timer.stage("score"):
+        risk = _logistic(features, RISK_WEIGHTS)
+        hospitalization = _logistic(features, HOSPITALIZATION_WEIGHTS)
+        scores = pd.DataFrame({
+            "patient_id": patient_ids.to_numpy(zero_copy_only=False),
+            "risk_score": risk.round(4),
+            "risk_band": band_of(risk),
+            "hospitalization_risk": hospitalization.round(4),
+            "age": age_years.round(1),
+            "chronic_conditions": chronic.astype("int32"),
+            "acute_visits": acute_visits.astype("int32"),
+            "inpatient_stays": inpatient_stays.astype("int32"),
+            "active_medications": active_meds.astype("int32"),
+            "total_cost": total_cost,
+            "acute_cost": acute_cost,
+        })
+
+    with timer.stage("aggregate"):
+        # Avoidable cost: acute-care (ED, urgent care, inpatient) spend on chronic patients,
+        # as a share of all encounter spend. > 0.5 means most cost is potentially preventable.
+        avoidable = acute_cost[chronic > 0].sum()
+        spend = total_cost.sum()
+        avoidable_cost_index = round(float(avoidable / spend), 2) if spend else 0.0
+        distribution = _percentages(scores["risk_band"])
+        high_risk_cost_share = int(round(100 * total_cost[scores["risk_band"].to_numpy() == "high"].sum() / spend)) if spend else 0
+        aggregates = {
+            "total_patients": int(n),
+            "high_risk_cohort": distribution["high"],
+            "risk_distribution": distribution,
+            "hospitalization_risk_distribution": _percentages(band_of(hospitalization)),
+            "avoidable_cost_index": avoidable_cost_index,
+            "key_metrics": {
+                "patients_analyzed": int(n),
+                "high_risk_percentage": distribution["high"],
+                "high_risk_cost_share": high_risk_cost_share,
+                "avoidable_cost_index": avoidable_cost_index,
+            },
+        }
+    return scores, aggregates
+
+
+def _load(store, table, columns, types):
+    """Selected columns of a store table as Arrow; missing tables/columns come back as empty/null."""
+    data = store.read_table(table, columns)
+    arrays = {}
+    for column, kind in zip(columns, types):
+        if data is not None and column in data.column_names:
+            arrays[column] = pc.cast(data.column(column), kind)
+        else:
+            arrays[column] = pa.nulls(data.num_rows if data is not None else 0, kind)
+    return pa.table(arrays)
+
+
+def run(store_root=DEFAULT_STORE, publish=True, as_of=None):
+    """Load inputs from the store, score, persist `risk_scores` and publish admin aggregates."""
+    store = ClinicalStore(store_root)
+    timer = StageTimer()
+    with timer.stage("load"):
+        ts, text, num = pa.timestamp("ms"), pa.string(), pa.float64()
+        patients = _load(store, "patients", ["Id", "BIRTHDATE"], [text, ts])
+        conditions = _load(store, "conditions", ["PATIENT", "STOP", "DESCRIPTION"], [text, ts, text])
+        encounters = _load(store, "encounters", ["PATIENT", "START", "ENCOUNTERCLASS", "TOTAL_CLAIM_COST"],
+                           [text, ts, text, num])
+        medications = _load(store, "medications", ["PATIENT", "STOP"], [text, ts])
+
+    scores, aggregates = score_population(patients, conditions, encounters, medications, as_of, timer)
+
+    with timer.stage("persist"):
+        store.write_derived("risk_scores", pa.Table.from_pandas(scores, preserve_index=False))
+    if publish:
+        with timer.stage("publish"):
+            insights = get_insight_store()
+            insights.publish("admin_data", aggregates)
+            insights.publish("engine_runs", {"risk_engine": {
+                "patients": aggregates["total_patients"],
+                "generation": store.generation,
+                "stages_seconds": timer.stages,
+            }})
+
+    logger.info(f"Scored {len(scores):,} patients; stage timings (s): {timer.stages}")
+    return scores, aggregates, timer.stages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score the patient population and publish admin aggregates.")
+    parser.add_argument("--store", default=DEFAULT_STORE, help="Clinical store directory")
+    parser.add_argument("--as-of", default=None, help="Reference date (default: latest encounter)")
+    parser.add_argument("--no-publish", action="store_true", help="Only write risk_scores; leave the insight store alone")
+    args = parser.parse_args(argv)
+    run(args.store, publish=not args.no_publish, as_of=args.as_of)
+
+
+if __name__ == "__main__":
+    main()
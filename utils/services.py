@@ -1,60 +1,58 @@
 # utils/services.py
-import json
-from loguru import logger
-from openai import AzureOpenAI
 from dotenv import load_dotenv
-import os
+
+from utils.derivation import get_derivation_service
+from utils.insight_store import get_insight_store
+from utils.telemetry import span
 
 # Load .env (with explicit path if needed; adjust if .env is elsewhere)
 load_dotenv()  # Or load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '../.env')) if in subdir
 
-# Log env vars for debugging
-logger.info(f"OPENAI_API_KEY loaded: {'Yes' if os.getenv('OPENAI_API_KEY') else 'No'}")
-logger.info(f"AZURE_OPENAI_ENDPOINT: {os.getenv('AZURE_OPENAI_ENDPOINT')}")
-logger.info(f"DEPLOYMENT: {os.getenv('DEPLOYMENT')}")
-logger.info(f"OPENAI_API_VERSION: {os.getenv('OPENAI_API_VERSION')}")
-
-# Initialize LLM client (commented for demo; uncomment when env loads)
-# client = AzureOpenAI(
-#     api_key=os.getenv("OPENAI_API_KEY"),
-#     azure_endpoint=os.getenv("LLM_ENDPOINT"),
-#     api_version=os.getenv("OPENAI_API_VERSION")
-# )
+# LLM client lives in utils/derivation.py (async, shared per process), created on first use
+# and configured from LLM_BASE_URL (OpenAI-compatible, e.g. utils.mock_llm_server) or the
+# Azure variables. openai and the numpy-backed per-patient store are imported on first
+# use so the login page renders without them (see utils/startup.py).
 
 def load_insights():
-    """Load AI-derived insights from centralized JSON."""
-    try:
-        with open("data/ai_insights.json", "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        logger.error(f"Error loading insights: {e}")
-        return {}
+    """Load AI-derived insights from centralized JSON (parsed once per process, read-only)."""
+    return get_insight_store().snapshot()
 
 # General service to fetch insights (simulates agent derivation via JSON for demo)
 def get_insight(section, key):
-    insights = load_insights()
-    return insights.get(section, {}).get(key, "Insight derivation in progress...")
+    with span("get_insight"):
+        insights = load_insights()
+        return insights.get(section, {}).get(key, "Insight derivation in progress...")
 
-# Placeholder for agent-based derivation (integrate CrewAI/Azure for production)
+# Agent-based derivation: prompts run concurrently on the derivation service's event loop
+# (simulated response when no LLM is configured).
 def derive_insight_via_agents(query):
-    # In production: Orchestrate CrewAI agents here.
-    # For demo: Simulate with hardcoded response (or uncomment LLM call once env fixed)
-    # try:
-    #     response = client.chat.completions.create(
-    #         model=os.getenv("DEPLOYMENT"),
-    #         messages=[{"role": "user", "content": query}]
-    #     )
-    #     return response.choices[0].message.content
-    # except Exception as e:
-    #     logger.error(f"Error in agent derivation: {e}")
-    #     return "Unable to derive insight at this time."
-    return f"Simulated AI response for query: '{query}' (enable LLM for real derivation)."
+    with span("derive_insight_via_agents", "agent") as s:
+        derivation = get_derivation_service().submit(query)
+        s.cache = derivation.cached or "miss"
+        return derivation.result()
+
+# Start every query at once; returns one chunk generator per query for st.write_stream
+def stream_insights_via_agents(queries):
+    return [_traced_stream(derivation) for derivation in get_derivation_service().submit_many(queries)]
+
+def _traced_stream(derivation):
+    # Span covers the wait for the answer as the page consumes it.
+    with span("derive_insight_via_agents", "agent") as s:
+        s.cache = derivation.cached or "miss"
+        for chunk in derivation.stream():
+            yield chunk
 
 # Admin-specific insight fetch
 def get_admin_insight(key):
     return get_insight("admin_data", key)
 
+# Per-patient insight record: curated hero patient first, then the sharded per-patient store
+def get_patient_insight(patient_id):
+    from utils.patient_insights import get_patient_insight_store
+    with span("get_patient_insight"):
+        hero = load_insights().get("doctor", {}).get("hero_patients", {}).get(patient_id)
+        return hero if hero is not None else get_patient_insight_store().get(patient_id)
+
 # Doctor-specific insight fetch
 def get_doctor_insight(patient_id, key):
-    insights = load_insights()
-    return insights.get("doctor", {}).get("hero_patients", {}).get(patient_id, {}).get(key, "Patient insight not available")
\ No newline at end of file
+    return (get_patient_insight(patient_id) or {}).get(key, "Patient insight not available")
\ No newline at end of file
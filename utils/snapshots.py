@@ -0,0 +1,252 @@
+# utils/snapshots.py
+"""
+Shared read-only snapshots of the serving data for multi-process deployments.
+
+    python -m utils.snapshots publish --root data/snapshots
+    SNAPSHOT_DIR=data/snapshots streamlit run dashboard.py     # in every server process
+
+Without SNAPSHOT_DIR each server process builds its own patient search index, care-flow
+index and insight tree, so memory and warm-up time grow with the number of processes.
+`publish` builds them once into a numbered generation directory:
+
+  <root>/gen-000007/manifest.json    generation number and sources
+  <root>/gen-000007/insights.json    merged insight tree (curated file + computed overlay)
+  <root>/gen-000007/directory.arrow  risk-ordered patient directory (Arrow IPC, uncompressed)
+  <root>/gen-000007/search/*.npy     patient search index arrays
+  <root>/gen-000007/care_flow/*.npy  care-flow index arrays
+  <root>/gen-000007/derived/*.arrow  the store's derived tables (risk_scores, care_gaps,
+                                     cohort_cube, ...) pinned as of this generation
+  <root>/CURRENT                     name of the live generation
+
+and then repoints CURRENT (temp file + rename). Server processes memory-map the files,
+so the operating system keeps one copy in the page cache for all of them, and check
+CURRENT at most once per second: a new generation is picked up as a whole, never half of
+one. The shared clinical store reads its derived tables from the generation's pinned
+copies (hard links, so no data is copied), so the admin views never pair one run's
+snapshot with another run's risk scores or cohort cube. The raw clinical store and
+per-patient insight shards are already memory-mapped and are not copied. The last KEEP
+generations are kept for processes still reading older ones.
+
+The merged insight tree is the one piece that is not zero-copy: every process parses
+insights.json into its own frozen dict. It holds the curated dashboard text and the
+fixed-size admin aggregates (tens of KB, independent of population size); everything
+per patient lives in the memory-mapped shards.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import threading
+import time
+from loguru import logger
+
+CURRENT = "CURRENT"
+MANIFEST = "manifest.json"
+KEEP = 3
+
+
+def generation_name(generation):
+    return f"gen-{generation:06d}"
+
+
+class Snapshot:
+    """One published generation; arrays and tables are memory-mapped on first use."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.generation = self.manifest["generation"]
+        self.insights_path = os.path.join(path, "insights.json")
+        self._derived = self.manifest.get("derived")
+        self._arrays = {}
+        self._tables = {}
+
+    def arrays(self, group):
+        """{name: memory-mapped array} for one group directory ({} if the group was not published)."""
+        import numpy as np   # numpy/pyarrow load with the pages that map arrays, not with the login page
+
+        if group not in self._arrays:
+            self._arrays[group] = {
+                os.path.basename(p)[:-4]: np.load(p, mmap_mode="r")
+                for p in sorted(glob.glob(os.path.join(self.path, group, "*.npy")))
+            }
+        return self._arrays[group]
+
+    def pins(self, store_root):
+        """True when this generation pinned the derived tables of the store at `store_root`."""
+        store = self.manifest.get("store")
+        return self._derived is not None and store is not None and os.path.realpath(store) == os.path.realpath(store_root)
+
+    def derived_path(self, name):
+        """Path of a pinned derived table, or None if the store had no such table at publish time."""
+        return os.path.join(self.path, "derived", f"{name}.arrow") if name in self._derived else None
+
+    def table(self, name):
+        import pyarrow as pa
+
+        if name not in self._tables:
+            source = pa.memory_map(os.path.join(self.path, f"{name}.arrow"), "r")
+            self._tables[name] = pa.ipc.open_file(source).read_all()
+        return self._tables[name]
+
+
+def read_current(root):
+    try:
+        with open(os.path.join(root, CURRENT), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class SnapshotReader:
+    """Per-process view of the live generation; re-reads CURRENT at most every `check_interval` seconds."""
+
+    def __init__(self, root, check_interval=1.0):
+        self.root = root
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._last_check = None
+
+    def current(self):
+        now = time.monotonic()
+        if self._last_check is not None and now - self._last_check < self.check_interval:
+            return self._snapshot
+        with self._lock:
+            if self._last_check is None or now - self._last_check >= self.check_interval:
+                self._last_check = now
+                name = read_current(self.root)
+                if name is None:
+                    self._snapshot = None
+                elif self._snapshot is None or os.path.basename(self._snapshot.path) != name:
+                    try:
+                        self._snapshot = Snapshot(os.path.join(self.root, name))
+                        logger.info(f"Serving snapshot generation {self._snapshot.generation} from {self.root}")
+                    except (OSError, ValueError, KeyError) as e:
+                        logger.error(f"Snapshot {name} unreadable, keeping the previous one: {e}")
+        return self._snapshot
+
+
+_reader = None
+_reader_lock = threading.Lock()
+
+
+def get_snapshot():
+    """The live Snapshot when SNAPSHOT_DIR is set and one has been published, else None."""
+    global _reader
+    root = os.getenv("SNAPSHOT_DIR")
+    if not root:
+        return None
+    if _reader is None or _reader.root != root:
+        with _reader_lock:
+            if _reader is None or _reader.root != root:
+                _reader = SnapshotReader(root)
+    return _reader.current()
+
+
+def _save_arrays(directory, arrays):
+    import numpy as np
+
+    os.makedirs(directory, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+
+
+def _pin_derived(store_root, directory):
+    """
+    Hard-link the store's current derived tables into `directory` ({name: mtime_ns}). Batch
+    jobs replace derived files by rename, so a link keeps this version even after the next run.
+    """
+    os.makedirs(directory, exist_ok=True)
+    pinned = {}
+    for path in sorted(glob.glob(os.path.join(store_root, "derived", "*.arrow"))):
+        name = os.path.basename(path)[:-len(".arrow")]
+        target = os.path.join(directory, f"{name}.arrow")
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copy2(path, target)   # different filesystem
+        pinned[name] = os.stat(target).st_mtime_ns
+    return pinned
+
+
+def publish(root, store_root=None, insights_path="data/ai_insights.json",
+            overlay_path="data/ai_insights.computed.json"):
+    """Build the next generation under `root`, make it current and prune old ones; returns its number."""
+    import pyarrow as pa
+
+    from utils.care_flow import build_care_flow_index
+    from utils.clinical_store import DEFAULT_STORE, ClinicalStore
+    from utils.insight_store import InsightStore
+    from utils.patient_search import build_patient_directory, search_arrays
+
+    started = time.perf_counter()
+    os.makedirs(root, exist_ok=True)
+    existing = [int(os.path.basename(p)[4:]) for p in glob.glob(os.path.join(root, "gen-[0-9]*"))
+                if os.path.basename(p)[4:].isdigit()]
+    generation = max(existing, default=0) + 1
+    final = os.path.join(root, generation_name(generation))
+    staging = f"{final}.{os.getpid()}.tmp"
+    os.makedirs(staging)
+
+    store = ClinicalStore(store_root or os.getenv("CLINICAL_STORE_DIR", DEFAULT_STORE))
+    insights = InsightStore(insights_path, overlay_path).snapshot()
+    with open(os.path.join(staging, "insights.json"), "w", encoding="utf-8") as f:
+        json.dump(insights, f, default=str)
+
+    table, arrays = search_arrays(build_patient_directory(store, insights))
+    with pa.OSFile(os.path.join(staging, "directory.arrow"), "wb") as sink, \
+            pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    _save_arrays(os.path.join(staging, "search"), arrays)
+
+    care_flow = build_care_flow_index(store)
+    if care_flow is not None:
+        _save_arrays(os.path.join(staging, "care_flow"), care_flow.arrays())
+
+    derived = _pin_derived(store.root, os.path.join(staging, "derived"))
+
+    with open(os.path.join(staging, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump({
+            "generation": generation,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "store": os.path.abspath(store.root),
+            "store_generation": store.generation,
+            "patients": table.num_rows,
+            "care_flow_transitions": len(care_flow) if care_flow is not None else 0,
+            "derived": derived,
+        }, f, indent=2)
+    os.rename(staging, final)
+
+    tmp = os.path.join(root, f"{CURRENT}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(generation_name(generation))
+    os.replace(tmp, os.path.join(root, CURRENT))
+
+    for old in sorted(existing)[:-(KEEP - 1) or None]:
+        shutil.rmtree(os.path.join(root, generation_name(old)), ignore_errors=True)
+    logger.info(f"Published snapshot generation {generation} ({table.num_rows:,} patients) "
+                f"in {time.perf_counter() - started:.1f}s")
+    return generation
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Publish shared serving snapshots for multi-process deployments.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    publish_cmd = commands.add_parser("publish", help="Build a new generation and make it current")
+    publish_cmd.add_argument("--root", default=os.getenv("SNAPSHOT_DIR", "data/snapshots"))
+    publish_cmd.add_argument("--store", default=None, help="Clinical store directory (default: CLINICAL_STORE_DIR)")
+    commands.add_parser("status", help="Show the current generation").add_argument(
+        "--root", default=os.getenv("SNAPSHOT_DIR", "data/snapshots"))
+    args = parser.parse_args(argv)
+    if args.command == "publish":
+        publish(args.root, args.store)
+    else:
+        name = read_current(args.root)
+        print(json.dumps(Snapshot(os.path.join(args.root, name)).manifest, indent=2) if name else "No snapshot published")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# utils/startup.py
+"""
+Cold-start helpers: background pre-warming and an import-time profile.
+
+dashboard.py imports a page module only when that page is rendered, and the login page
+avoids openai, plotly, pandas and numpy entirely, so a fresh server process paints the
+login screen after importing little more than streamlit. Once the home page has been
+served, prewarm() imports the dashboards and creates the shared services on a daemon
+thread, so the first login does not pay for them either (PREWARM=0 turns this off).
+
+    python -m utils.startup profile            # per-page import cost report
+    python -m utils.startup profile --json     # same, machine-readable for tracking
+
+The profile runs `python -X importtime` in a fresh interpreter per target, so numbers
+are true cold-import times for this machine and environment.
+"""
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from loguru import logger
+
+# Import time of this module, which dashboard.py loads before anything else of ours, so
+# first_paint() measures from (almost) the start of the script's first run.
+STARTED = time.perf_counter()
+
+PREWARM_MODULES = ["pages.admin", "pages.doctor", "plotly.express"]
+# (label, modules imported on top of streamlit) for the profile report.
+PROFILE_TARGETS = [
+    ("login page", ["pages.home"]),
+    ("admin dashboard", ["pages.admin"]),
+    ("doctor dashboard", ["pages.doctor"]),
+]
+HEAVY_MODULES = ["openai", "crewai", "plotly.express", "pandas", "numpy", "pyarrow"]
+
+_painted = False
+_prewarm_thread = None
+_prewarm_lock = threading.Lock()
+
+
+def first_paint():
+    """Log, once per process, how long the first page took from script start."""
+    global _painted
+    if _painted:
+        return
+    _painted = True
+    heavy = [name for name in HEAVY_MODULES if name in sys.modules]
+    logger.info(f"First paint {time.perf_counter() - STARTED:.2f}s after script start; "
+                f"heavy packages loaded: {', '.join(heavy) or 'none'}")
+
+
+def _prewarm():
+    started = time.perf_counter()
+    for module in PREWARM_MODULES:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            logger.warning(f"Prewarm import of {module} failed: {e}")
+    from utils.derivation import get_derivation_service
+    from utils.patient_insights import get_patient_insight_store
+    get_derivation_service()
+    get_patient_insight_store()
+    logger.info(f"Prewarm finished in {time.perf_counter() - started:.2f}s")
+
+
+def prewarm():
+    """Start the background pre-warm thread (once per process) unless PREWARM=0."""
+    global _prewarm_thread
+    if _prewarm_thread is not None or os.getenv("PREWARM", "1") == "0":
+        return
+    with _prewarm_lock:
+        if _prewarm_thread is None:
+            _prewarm_thread = threading.Thread(target=_prewarm, name="prewarm", daemon=True)
+            _prewarm_thread.start()
+
+
+def import_profile(modules, cwd=None):
+    """
+    Cold import of streamlit plus `modules` in a fresh interpreter:
+    {"total_ms", "modules": {name: cumulative ms}, "heavy": {HEAVY_MODULES entry: cumulative ms},
+     "packages": {top-level package: self ms}}.
+    """
+    code = "import streamlit\n" + "".join(f"import {m}\n" for m in modules)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=cwd,
+                            capture_output=True, text=True, check=True)
+    cumulative, packages = {}, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        cumulative[name] = int(cumulative_us) / 1000
+        top = name.split(".")[0]
+        packages[top] = packages.get(top, 0.0) + int(self_us) / 1000
+    return {
+        "total_ms": round(sum(packages.values()), 1),
+        "modules": {m: round(cumulative.get(m, 0.0), 1) for m in modules},
+        "heavy": {m: round(cumulative[m], 1) for m in HEAVY_MODULES if m in cumulative},
+        "packages": {k: round(v, 1) for k, v in sorted(packages.items(), key=lambda kv: -kv[1])},
+    }
+
+
+def profile_report(cwd=None):
+    """Per PROFILE_TARGETS page: cold import cost and the packages it adds on top of bare streamlit."""
+    baseline = import_profile([], cwd)
+    report = {"streamlit": baseline}
+    for label, modules in PROFILE_TARGETS:
+        entry = import_profile(modules, cwd)
+        added = {k: round(v - baseline["packages"].get(k, 0.0), 1) for k, v in entry["packages"].items()}
+        entry["added_ms"] = round(entry["total_ms"] - baseline["total_ms"], 1)
+        entry["added_packages"] = {k: v for k, v in sorted(added.items(), key=lambda kv: -kv[1]) if v >= 1.0}
+        entry["heavy_packages"] = [name for name in entry["heavy"] if name not in baseline["heavy"]]
+        report[label] = entry
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cold-start import profile of the dashboard pages.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    profile = commands.add_parser("profile", help="Import cost per page in a fresh interpreter")
+    profile.add_argument("--top", type=int, default=8, help="Packages to list per page")
+    profile.add_argument("--json", action="store_true", help="Print the raw report as JSON")
+    args = parser.parse_args(argv)
+
+    report = profile_report(cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"streamlit alone: {report['streamlit']['total_ms']:.0f} ms")
+    for label, _ in PROFILE_TARGETS:
+        entry = report[label]
+        print(f"{label}: +{entry['added_ms']:.0f} ms ({entry['total_ms']:.0f} ms total); "
+              f"heavy packages: {', '.join(entry['heavy_packages']) or 'none'}")
+        for package, ms in list(entry["added_packages"].items())[:args.top]:
+            print(f"  {ms:8.1f} ms  {package}")
+
+
+if __name__ == "__main__":
+    main()
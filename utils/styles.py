@@ -1,5 +1,8 @@
+import os
 import streamlit as st
 
+from utils.telemetry import span
+
 def inject_css():
     st.markdown(
         """
@@ -24,4 +27,54 @@ def metric_card(label, value):
 def ai_insight_box(title, text):
     st.markdown(f'<div class="ai-insight-box"><b>{title}</b><br>{text}</div>', unsafe_allow_html=True)
 
+def render_tabs(tabs, key):
+    """
+    st.tabs over (label, render function) pairs. With LAZY_TABS on (the default) the tab
+    bar reruns the script on selection and only the selected tab's function runs; the
+    other panels stay empty until opened. LAZY_TABS=0 renders every tab on every rerun.
+    """
+    lazy = os.getenv("LAZY_TABS", "1") != "0"
+    containers = st.tabs([label for label, _ in tabs], key=key, on_change="rerun" if lazy else "ignore")
+    for container, (label, render) in zip(containers, tabs):
+        # .open is None when selection isn't tracked (eager mode): render everything.
+        if container.open is False:
+            continue
+        with container, span(label, "tab"):
+            render()
+
+def show_dataframe(data, label, **kwargs):
+    """
+    st.dataframe with a telemetry span recording the bytes sent. Tables longer than one page
+    (TABLE_PAGE_ROWS) are paged on the server: filter, sort and page controls pick a window of
+    a shared PagedTable and only that window is passed to st.dataframe.
+    """
+    import pandas as pd   # not needed by the login page
+    from utils.paged_table import PAGE_ROWS, get_paged_table
+
+    with span(label, "dataframe") as s:
+        if len(data) <= PAGE_ROWS:
+            frame = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+            s.bytes = int(frame.memory_usage(index=True, deep=True).sum())
+            return st.dataframe(frame, **kwargs)
+
+        table = get_paged_table(data)
+        key = f"table_{label}"
+        cols = st.columns([3, 2, 1, 1])
+        query = cols[0].text_input("Filter", key=f"{key}_filter", placeholder="Text in any column")
+        sort_by = cols[1].selectbox("Sort by", [None] + table.columns, key=f"{key}_sort",
+                                    format_func=lambda c: "—" if c is None else c)
+        descending = cols[2].toggle("Descending", key=f"{key}_descending")
+        page = st.session_state.get(f"{key}_page", 1)          # 1-based, as shown
+        window, total = table.view(query, sort_by, descending, page - 1)
+        pages = max(1, -(-total // PAGE_ROWS))
+        if page > pages:
+            # The filter changed under a later page; restart from the top.
+            st.session_state[f"{key}_page"] = page = 1
+            window, total = table.view(query, sort_by, descending, page - 1)
+        cols[3].number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+        first = (page - 1) * PAGE_ROWS
+        st.caption(f"Rows {first + 1:,}–{first + window.num_rows:,} of {total:,}" if total else "No matching rows")
+        s.bytes = window.nbytes
+        return st.dataframe(window, **kwargs)
+
 # Inject CSS globally (call this in dashboard.py)
\ No newline at end of file
@@ -0,0 +1,226 @@
+# utils/synthetic_population.py
+"""
+Synthetic patient populations in the shapes the dashboard consumes.
+
+    python -m utils.synthetic_population --patients 1000000 --out data/synthetic --seed 7
+
+Writes Synthea-shaped CSVs (patients, encounters, conditions, medications, observations,
+payer_transitions, payers) under <out>/raw, ready for `python -m utils.ingest`, and one
+insight record per patient under <out>/insights as JSON lines shaped like
+doctor.hero_patients in data/ai_insights.json (plus "patient_id"; the shared
+confidence_and_limitations block is not repeated per patient).
+
+The population is cut into fixed-size chunks; chunk i always draws from the i-th child
+of SeedSequence(seed), so output is identical for a given seed and chunk size no matter
+how many worker processes run. Each worker writes its chunk straight to its own part
+files (e.g. raw/encounters_00012.csv, insights/patients_00012.jsonl), so memory stays
+bounded by workers x chunk size.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from utils.patient_narratives import patient_facts, template_record
+
+FIRST_F = np.array(["Mary", "Patricia", "Jennifer", "Linda", "Elizabeth", "Maria", "Aisha", "Mei", "Sofia",
+                    "Margaret", "Grace", "Fatima", "Ana", "Priya", "Chloe", "Nia"])
+FIRST_M = np.array(["James", "Robert", "John", "Michael", "David", "Jose", "Wei", "Carlos", "Omar", "Daniel",
+                    "Samuel", "Ahmed", "Luis", "Raj", "Kwame", "Ethan"])
+LAST = np.array(["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez",
+                 "Martinez", "Hernandez", "Lopez", "Nguyen", "Chen", "Khan", "Patel", "Kim", "Okafor",
+                 "Collins", "Ramirez", "Murphy", "Cohen", "Rossi", "Silva"])
+# Synthea's coding: Hispanic is an ethnicity, drawn independently of race.
+RACES = np.array(["white", "black", "asian", "native", "hawaiian", "other"])
+RACE_P = np.array([0.70, 0.15, 0.09, 0.02, 0.01, 0.03])
+ETHNICITIES = np.array(["nonhispanic", "hispanic"])
+HISPANIC_P = 0.18
+CITIES = np.array(["Boston", "Worcester", "Springfield", "Cambridge", "Lowell", "Fitchburg", "Pittsfield"])
+
+ENCOUNTER_CLASSES = np.array(["wellness", "ambulatory", "outpatient", "emergency", "urgentcare", "inpatient"])
+ENCOUNTER_P = np.array([0.30, 0.30, 0.18, 0.10, 0.07, 0.05])
+ENCOUNTER_COST = np.array([150.0, 120.0, 400.0, 1800.0, 600.0, 9000.0])
+CHRONIC = np.array(["Hypertension", "Diabetes mellitus type 2", "Chronic kidney disease stage 3", "Heart failure",
+                    "Asthma", "Hyperlipidemia", "Obesity", "Osteoarthritis of knee", "Prediabetes",
+                    "Chronic obstructive pulmonary disease"])
+ACUTE = np.array(["Acute bronchitis", "Viral sinusitis", "Sprain of ankle", "Acute viral pharyngitis",
+                  "Urinary tract infection", "Otitis media"])
+MEDICATIONS = np.array(["Lisinopril 10 MG", "Metformin 500 MG", "Atorvastatin 20 MG", "Albuterol inhaler",
+                        "Hydrochlorothiazide 25 MG", "Amlodipine 5 MG", "Insulin glargine", "Furosemide 40 MG"])
+OBSERVATIONS = np.array([("Body Mass Index", "kg/m2", 18.0, 42.0), ("Systolic Blood Pressure", "mm[Hg]", 95, 185),
+                         ("Diastolic Blood Pressure", "mm[Hg]", 55, 115), ("Hemoglobin A1c", "%", 4.5, 11.0),
+                         ("Glucose", "mg/dL", 70, 260)], dtype=object)
+PAYERS = pd.DataFrame({
+    "Id": ["b3221cfc-24fb-339e-823d-bc4136cbc4ed", "a735bf55-83e9-331a-899d-a82a60b9f60c",
+           "7caa7254-5050-3b5e-9eae-bd5ea30e809c", "42c4fca7-f8a9-3cd1-982a-dd9751bf3e2a",
+           "d47b3510-2895-3b70-9897-342d681c769d"],
+    "NAME": ["Medicare", "Medicaid", "Blue Cross Blue Shield", "Aetna", "NO_INSURANCE"],
+})
+
+DAY0 = np.datetime64("2010-01-01")
+SPAN_DAYS = 14 * 365
+AS_OF = pd.Timestamp("2024-01-01")
+DEFAULT_CHUNK = 50_000
+
+
+def uuids(rng, n):
+    """UUID-formatted random IDs drawn from `rng`."""
+    raw = rng.integers(0, 2 ** 63, size=(n, 2), dtype=np.int64).view(np.uint64)
+    hexed = np.char.add(np.char.zfill(np.char.mod("%x", raw[:, 0]), 16), np.char.zfill(np.char.mod("%x", raw[:, 1]), 16))
+    return pd.Series(hexed.astype("U32")).str.replace(
+        r"^(.{8})(.{4})(.{4})(.{4})(.{12})$", r"\1-\2-\3-\4-\5", regex=True).to_numpy()
+
+
+def _per_patient(rng, ids, rate):
+    """Repeat patient IDs by a per-patient Poisson count (`rate` is a scalar or per-patient array)."""
+    counts = rng.poisson(rate, size=len(ids))
+    return np.repeat(ids, counts), np.repeat(np.arange(len(ids)), counts)
+
+
+def _days(rng, n):
+    return DAY0 + rng.integers(0, SPAN_DAYS, size=n).astype("timedelta64[D]")
+
+
+def make_tables(rng, n):
+    """One chunk of patients and their clinical rows, as {table: DataFrame}."""
+    ids = uuids(rng, n)
+    female = rng.random(n) < 0.5
+    birth = np.datetime64("1935-01-01") + rng.integers(0, 85 * 365, size=n).astype("timedelta64[D]")
+    age = (np.datetime64(AS_OF.date(), "D") - birth).astype("float64") / 365.25
+    # Latent frailty drives chronic burden and utilization so features correlate like real cohorts.
+    frailty = np.clip(rng.gamma(2.0, 0.25, n) * (0.4 + age / 80.0), 0.05, 4.0)
+    patients = pd.DataFrame({
+        "Id": ids, "BIRTHDATE": birth, "DEATHDATE": pd.NaT,
+        "FIRST": np.where(female, FIRST_F[rng.integers(0, len(FIRST_F), n)], FIRST_M[rng.integers(0, len(FIRST_M), n)]),
+        "LAST": LAST[rng.integers(0, len(LAST), n)],
+        "RACE": RACES[rng.choice(len(RACES), size=n, p=RACE_P)], "ETHNICITY": ETHNICITIES[(rng.random(n) < HISPANIC_P).astype("int64")],
+        "GENDER": np.where(female, "F", "M"), "CITY": CITIES[rng.integers(0, len(CITIES), n)],
+        "HEALTHCARE_EXPENSES": rng.gamma(2.0, 20000.0, n).round(2),
+    })
+
+    patient, owner = _per_patient(rng, ids, 4 + 5 * frailty)
+    m = len(patient)
+    # Classes 0-2 are routine, 3-5 acute; frailer patients get a larger acute share.
+    acute_share = np.clip(0.12 + 0.1 * frailty[owner], 0, 0.6)
+    routine = rng.choice(3, size=m, p=ENCOUNTER_P[:3] / ENCOUNTER_P[:3].sum())
+    acute = 3 + rng.choice(3, size=m, p=ENCOUNTER_P[3:] / ENCOUNTER_P[3:].sum())
+    cls = np.where(rng.random(m) < acute_share, acute, routine)
+    encounters = pd.DataFrame({
+        "Id": uuids(rng, m), "START": _days(rng, m).astype("datetime64[s]"), "STOP": pd.NaT, "PATIENT": patient,
+        "ORGANIZATION": "", "PROVIDER": "", "PAYER": PAYERS["Id"].to_numpy()[rng.integers(0, len(PAYERS), m)],
+        "ENCOUNTERCLASS": ENCOUNTER_CLASSES[cls], "CODE": "185349003",
+        "DESCRIPTION": np.char.add("Encounter for ", ENCOUNTER_CLASSES[cls]),
+        "BASE_ENCOUNTER_COST": ENCOUNTER_COST[cls],
+        "TOTAL_CLAIM_COST": (ENCOUNTER_COST[cls] * rng.lognormal(0, 0.4, m)).round(2),
+        "PAYER_COVERAGE": 0.0, "REASONCODE": "", "REASONDESCRIPTION": "",
+    })
+
+    patient, owner = _per_patient(rng, ids, 0.5 + 1.5 * frailty)
+    m = len(patient)
+    chronic = rng.random(m) < np.clip(0.35 + 0.15 * frailty[owner], 0, 0.9)
+    start = _days(rng, m)
+    stop = np.where(chronic, np.datetime64("NaT"), start + rng.integers(7, 60, m).astype("timedelta64[D]"))
+    conditions = pd.DataFrame({
+        "START": start, "STOP": stop, "PATIENT": patient, "ENCOUNTER": "", "CODE": "38341003",
+        "DESCRIPTION": np.where(chronic, CHRONIC[rng.integers(0, len(CHRONIC), m)], ACUTE[rng.integers(0, len(ACUTE), m)]),
+    })
+
+    patient, owner = _per_patient(rng, ids, 0.3 + 1.2 * frailty)
+    m = len(patient)
+    start = _days(rng, m)
+    stopped = rng.random(m) < 0.45
+    stop = np.where(stopped, start + rng.integers(30, 720, m).astype("timedelta64[D]"), np.datetime64("NaT"))
+    cost = rng.gamma(2.0, 40.0, m).round(2)
+    dispenses = rng.integers(1, 60, m)
+    medications = pd.DataFrame({
+        "START": start.astype("datetime64[s]"), "STOP": stop.astype("datetime64[s]"), "PATIENT": patient,
+        "PAYER": "", "ENCOUNTER": "", "CODE": "314076", "DESCRIPTION": MEDICATIONS[rng.integers(0, len(MEDICATIONS), m)],
+        "BASE_COST": cost, "PAYER_COVERAGE": 0.0, "DISPENSES": dispenses, "TOTALCOST": (cost * dispenses).round(2),
+        "REASONCODE": "", "REASONDESCRIPTION": "",
+    })
+
+    patient, _ = _per_patient(rng, ids, 4)
+    m = len(patient)
+    kind = rng.integers(0, len(OBSERVATIONS), m)
+    lo, hi = OBSERVATIONS[kind, 2].astype(float), OBSERVATIONS[kind, 3].astype(float)
+    observations = pd.DataFrame({
+        "DATE": _days(rng, m).astype("datetime64[s]"), "PATIENT": patient, "ENCOUNTER": "", "CODE": "",
+        "DESCRIPTION": OBSERVATIONS[kind, 0], "VALUE": (lo + rng.random(m) * (hi - lo)).round(1),
+        "UNITS": OBSERVATIONS[kind, 1], "TYPE": "numeric",
+    })
+
+    # One to three coverage periods; a gap year between periods is an insurance disruption.
+    periods = rng.integers(1, 4, n)
+    patient, owner = np.repeat(ids, periods), np.repeat(np.arange(n), periods)
+    position = np.arange(len(patient)) - np.repeat(np.cumsum(periods) - periods, periods)
+    first_year = np.repeat(2010 + rng.integers(0, 6, n), periods)
+    start_year = first_year + 4 * position + rng.integers(0, 2, len(patient))
+    end_year = np.where(position == np.repeat(periods - 1, periods), 2026, start_year + 3)
+    payer_transitions = pd.DataFrame({
+        "PATIENT": patient, "START_YEAR": start_year, "END_YEAR": end_year,
+        "PAYER": PAYERS["Id"].to_numpy()[rng.integers(0, len(PAYERS), len(patient))], "OWNERSHIP": "Self",
+    })
+    return {"patients": patients, "encounters": encounters, "conditions": conditions,
+            "medications": medications, "observations": observations, "payer_transitions": payer_transitions}
+
+
+def insight_records(tables):
+    """Per-patient template insight records for one generated chunk."""
+    facts = patient_facts(tables, dict(zip(PAYERS["Id"], PAYERS["NAME"])), AS_OF)
+    return [template_record(row) for row in facts.to_dict("records")]
+
+
+def write_chunk(index, n, seed_sequence, out_dir):
+    """Generate chunk `index` (n patients) and write its part files; returns row counts."""
+    rng = np.random.default_rng(seed_sequence)
+    tables = make_tables(rng, n)
+    raw = os.path.join(out_dir, "raw")
+    for table, frame in tables.items():
+        frame.to_csv(os.path.join(raw, f"{table}_{index:05d}.csv"), index=False, date_format="%Y-%m-%dT%H:%M:%SZ")
+    rows = {table: len(frame) for table, frame in tables.items()}
+    with open(os.path.join(out_dir, "insights", f"patients_{index:05d}.jsonl"), "w", encoding="utf-8") as f:
+        for record in insight_records(tables):
+            f.write(json.dumps(record, default=str))
+            f.write("\n")
+    rows["insights"] = n
+    return rows
+
+
+def generate(out_dir, n_patients, seed=0, workers=None, chunk_patients=DEFAULT_CHUNK):
+    """Write the whole population under `out_dir`; returns total row counts per table."""
+    os.makedirs(os.path.join(out_dir, "raw"), exist_ok=True)
+    os.makedirs(os.path.join(out_dir, "insights"), exist_ok=True)
+    PAYERS.to_csv(os.path.join(out_dir, "raw", "payers.csv"), index=False)
+
+    sizes = [min(chunk_patients, n_patients - start) for start in range(0, n_patients, chunk_patients)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    workers = max(1, min(workers or os.cpu_count() or 1, len(sizes)))
+    started = time.perf_counter()
+    totals, done = {}, 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for n, rows in zip(sizes, pool.map(write_chunk, range(len(sizes)), sizes, seeds, [out_dir] * len(sizes))):
+            done += n
+            for table, count in rows.items():
+                totals[table] = totals.get(table, 0) + count
+            logger.info(f"Generated {done:,}/{n_patients:,} patients ({time.perf_counter() - started:.1f}s)")
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic population (CSVs + per-patient insight JSONL).")
+    parser.add_argument("--patients", type=int, required=True)
+    parser.add_argument("--out", default="data/synthetic", help="Output directory (raw/ and insights/ are created)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK, help="Patients per chunk / part file")
+    args = parser.parse_args(argv)
+    totals = generate(args.out, args.patients, args.seed, args.workers, args.chunk)
+    logger.info(f"Row counts: {totals}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# utils/telemetry.py
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from loguru import logger
+
+DEFAULT_CAPACITY = 50_000
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Span:
+    __slots__ = ("name", "kind", "started", "seconds", "bytes", "cache")
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+        self.started = time.time()
+        self.seconds = 0.0
+        self.bytes = None     # payload size sent to the browser, when known
+        self.cache = None     # "hit" / "miss" / "stale", when the call went through a cache
+
+
+class SpanRecorder:
+    """
+    Fixed-size in-memory ring buffer of finished spans (a deque append per span), shared
+    by every session. Aggregation happens only when the telemetry tab or the Prometheus
+    endpoint asks for it. Span counts, seconds, bytes and cache results are also kept as
+    process-lifetime totals next to the buffer, so the exported counters (and summary
+    _sum/_count) never go down when old spans roll off; quantiles use the recent window.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._spans = deque(maxlen=capacity)
+        self._recorded = 0
+        self._lock = threading.Lock()
+        self._totals = defaultdict(lambda: [0, 0.0])   # (kind, name) -> [spans, seconds] since process start
+        self._bytes = defaultdict(int)    # (kind, name) -> bytes since process start
+        self._cache = defaultdict(int)    # (kind, name, result) -> lookups since process start
+
+    @contextmanager
+    def span(self, name, kind="service"):
+        s = Span(name, kind)
+        started = time.perf_counter()
+        try:
+            yield s
+        finally:
+            s.seconds = time.perf_counter() - started
+            self._spans.append(s)
+            with self._lock:
+                self._recorded += 1
+                total = self._totals[(kind, name)]
+                total[0] += 1
+                total[1] += s.seconds
+                if s.bytes is not None:
+                    self._bytes[(kind, name)] += s.bytes
+                if s.cache is not None:
+                    self._cache[(kind, name, s.cache)] += 1
+
+    def frame(self):
+        """Buffered spans as a DataFrame (oldest first)."""
+        # pandas/numpy are only needed to report, not to record: spans run on the login page.
+        import numpy as np
+        import pandas as pd
+
+        spans = list(self._spans)
+        return pd.DataFrame({
+            "name": [s.name for s in spans],
+            "kind": [s.kind for s in spans],
+            "started": pd.to_datetime([s.started for s in spans], unit="s"),
+            "seconds": np.array([s.seconds for s in spans], dtype="float64"),
+            "bytes": pd.array([s.bytes for s in spans], dtype="Int64"),
+            "cache": [s.cache for s in spans],
+        })
+
+    def summary(self):
+        """Per (kind, name): count, p50/p95/p99 and max milliseconds, bytes sent, cache hit ratio."""
+        import numpy as np
+        import pandas as pd
+
+        spans = self.frame()
+        if spans.empty:
+            return pd.DataFrame(columns=["kind", "name", "count", "p50_ms", "p95_ms", "p99_ms", "max_ms",
+                                         "total_ms", "bytes", "cache_hit_ratio"])
+        rows = []
+        for (kind, name), group in spans.groupby(["kind", "name"], sort=True):
+            ms = group["seconds"].to_numpy() * 1000
+            p50, p95, p99 = np.percentile(ms, [q * 100 for q in QUANTILES])
+            cached = group["cache"].dropna()
+            rows.append({
+                "kind": kind, "name": name, "count": len(group),
+                "p50_ms": round(p50, 3), "p95_ms": round(p95, 3), "p99_ms": round(p99, 3),
+                "max_ms": round(ms.max(), 3), "total_ms": round(ms.sum(), 1),
+                "bytes": int(group["bytes"].sum()) if group["bytes"].notna().any() else None,
+                "cache_hit_ratio": round(float((cached != "miss").mean()), 3) if len(cached) else None,
+            })
+        return pd.DataFrame(rows).sort_values("total_ms", ascending=False, ignore_index=True)
+
+    def prometheus(self):
+        """Prometheus text exposition of the buffered spans (summary quantiles per span name)."""
+        import numpy as np
+
+        spans = self.frame()
+        lines = [
+            "# HELP dashboard_span_seconds Wall time of instrumented render-path spans (quantiles over the recent window).",
+            "# TYPE dashboard_span_seconds summary",
+        ]
+        for (kind, name), group in spans.groupby(["kind", "name"], sort=True):
+            labels = _labels(kind, name)
+            seconds = group["seconds"].to_numpy()
+            for q, value in zip(QUANTILES, np.percentile(seconds, [q * 100 for q in QUANTILES])):
+                lines.append(f'dashboard_span_seconds{{{labels},quantile="{q}"}} {value:.6f}')
+        with self._lock:
+            totals = {key: tuple(value) for key, value in self._totals.items()}
+            sent, cache, recorded = sorted(self._bytes.items()), sorted(self._cache.items()), self._recorded
+        for (kind, name), (count, seconds) in sorted(totals.items()):
+            lines.append(f"dashboard_span_seconds_sum{{{_labels(kind, name)}}} {seconds:.6f}")
+            lines.append(f"dashboard_span_seconds_count{{{_labels(kind, name)}}} {count}")
+        lines += ["# HELP dashboard_span_bytes_total Payload bytes sent by instrumented spans since process start.",
+                  "# TYPE dashboard_span_bytes_total counter"]
+        lines += [f"dashboard_span_bytes_total{{{_labels(kind, name)}}} {total}" for (kind, name), total in sent]
+        lines += ["# HELP dashboard_span_cache_total Cache lookups by result since process start.",
+                  "# TYPE dashboard_span_cache_total counter"]
+        lines += [f'dashboard_span_cache_total{{{_labels(kind, name)},result="{_escape(result)}"}} {count}'
+                  for (kind, name, result), count in cache]
+        lines += ["# HELP dashboard_spans_recorded_total Spans recorded since process start.",
+                  "# TYPE dashboard_spans_recorded_total counter",
+                  f"dashboard_spans_recorded_total {recorded}"]
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        self._spans.clear()
+
+
+def _labels(kind, name):
+    return f'kind="{_escape(kind)}",name="{_escape(name)}"'
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    """Shared SpanRecorder for this server process (TELEMETRY_CAPACITY spans)."""
+    global _recorder
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = SpanRecorder(int(os.getenv("TELEMETRY_CAPACITY", DEFAULT_CAPACITY)))
+    return _recorder
+
+
+def span(name, kind="service"):
+    return get_recorder().span(name, kind)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0].rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = get_recorder().prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_metrics_server = None
+
+
+def start_metrics_server(port=None, host="127.0.0.1"):
+    """
+    Serve /metrics for Prometheus on TELEMETRY_PORT from a daemon thread, once per process
+    (the spans live in this process, so the endpoint must too). No-op without a port.
+    """
+    global _metrics_server
+    port = port or os.getenv("TELEMETRY_PORT")
+    if _metrics_server is not None or not port:
+        return _metrics_server
+    with _recorder_lock:
+        if _metrics_server is None:
+            try:
+                server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+            except OSError as e:
+                logger.error(f"Metrics endpoint not started on port {port}: {e}")
+                return None
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+            _metrics_server = server
+            logger.info(f"Prometheus metrics on http://{host}:{server.server_port}/metrics")
+    return _metrics_server
@@ -0,0 +1,241 @@
+# utils/what_if.py
+"""
+Monte Carlo what-if simulator for the admin Predictive & What-If tab.
+
+    python -m utils.what_if --store data/store --cohort "Risk: high" --close-gaps 0.3
+
+Each patient's 12-month hospitalization probability p is the risk engine's
+`hospitalization_risk`. An intervention scales it down:
+
+  closing overdue care gaps   every overdue gap is closed with probability `close_gaps`;
+                              a closed gap removes its excess relative risk GAP_RR[impact]
+  reducing insurance churn    a churned patient (payer change in the last CHURN_YEARS
+                              years, or a coverage gap) is retained with probability
+                              `reduce_churn`, removing CHURN_RR
+
+The relative risks are planning assumptions, not estimates from this data, so every
+simulation draws its own effect scale (log-normal, EFFECT_SD) and its own cost per
+inpatient stay (normal around the store's mean inpatient claim, with its standard
+error).
+
+Given one simulation's draws, the cohort's hospitalizations are a sum of independent
+Bernoullis with per-patient probability q = p * f, where f depends only on the patient's
+count of overdue gaps per impact level and churn flag. Patients are therefore grouped
+once per cohort by that key, keeping sum(p) and sum(p^2) per group, and every simulation
+is a (simulations x groups) matrix product followed by a normal draw with the exact
+Poisson-binomial mean and variance. Runs are memoized per parameter set.
+"""
+import argparse
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from loguru import logger
+
+from utils.care_gaps import STATE_TABLE as CARE_GAPS
+from utils.clinical_store import DEFAULT_STORE, ClinicalStore, get_clinical_store
+from utils.continuity import COVERAGE_TABLE, cohort_masks, coverage_continuity
+from utils.risk_engine import INPATIENT_CLASSES, StageTimer, patient_codes
+
+HORIZON_MONTHS = 12
+GAP_RR = {"High": 1.20, "Medium": 1.10, "Low": 1.05}
+CHURN_RR = 1.35
+EFFECT_SD = 0.35
+MAX_GAPS = 15                     # overdue gaps per impact level beyond this count as this many
+DEFAULT_SIMULATIONS = 5000
+QUANTILES = (0.05, 0.5, 0.95)
+SWEEP_LEVELS = np.linspace(0.0, 1.0, 11)
+MEMO_ENTRIES = 256                # memoized scenarios (~160 KB each at 5,000 simulations)
+
+
+class WhatIfSimulator:
+    """Per-patient inputs for the simulator plus memoized runs; one per store/derived-table version."""
+
+    def __init__(self, p, gap_counts, churned, cohorts, stay_cost, stay_cost_se, simulations=DEFAULT_SIMULATIONS):
+        self.p = p                          # baseline 12-month hospitalization probability per patient
+        self.gap_counts = gap_counts        # (patients, len(GAP_RR)) overdue gaps per impact level
+        self.churned = churned
+        self._cohorts = dict(cohorts)
+        self.stay_cost = stay_cost
+        self.stay_cost_se = stay_cost_se
+        self.simulations = simulations
+        self._lock = threading.Lock()
+        self._groups = {}
+        self._memo = OrderedDict()   # params -> per-simulation arrays, least recently used first
+
+    def cohorts(self):
+        return list(self._cohorts)
+
+    def _group_stats(self, cohort):
+        """(group keys as (gap counts..., churned) rows, sum p, sum p^2) for one cohort."""
+        cached = self._groups.get(cohort)
+        if cached is None:
+            mask = self._cohorts[cohort]
+            counts = np.minimum(self.gap_counts[mask], MAX_GAPS)
+            key = np.ravel_multi_index(tuple(counts.T) + (self.churned[mask].astype("int64"),),
+                                       (MAX_GAPS + 1,) * counts.shape[1] + (2,))
+            keys, group = np.unique(key, return_inverse=True)
+            p = self.p[mask]
+            rows = np.stack(np.unravel_index(keys, (MAX_GAPS + 1,) * counts.shape[1] + (2,)), axis=1)
+            cached = self._groups[cohort] = (rows, np.bincount(group, weights=p), np.bincount(group, weights=p * p))
+        return cached
+
+    def simulate(self, cohort, close_gaps=0.0, reduce_churn=0.0, seed=0):
+        """
+        Per-simulation arrays for one scenario: baseline, projected and averted hospitalizations
+        and avoidable cost over HORIZON_MONTHS. Memoized per (cohort, close_gaps, reduce_churn, seed).
+        """
+        params = (cohort, round(float(close_gaps), 4), round(float(reduce_churn), 4), seed)
+        with self._lock:
+            cached = self._memo.get(params)
+            if cached is not None:
+                self._memo.move_to_end(params)
+                return cached
+        rows, s1, s2 = self._group_stats(cohort)
+        rng = np.random.default_rng(seed)
+        n = self.simulations
+        # Per-simulation uncertainty: effect scales for both levers and the cost of a stay.
+        gap_scale = rng.lognormal(0.0, EFFECT_SD, n)
+        churn_scale = rng.lognormal(0.0, EFFECT_SD, n)
+        stay_cost = np.maximum(rng.normal(self.stay_cost, self.stay_cost_se, n), 0.0)
+
+        # Expected residual risk factor per gap (closed with probability close_gaps) and per churned patient.
+        log_rr = np.log(np.array(list(GAP_RR.values())))
+        per_gap = 1.0 - close_gaps + close_gaps * np.exp(-np.outer(gap_scale, log_rr))        # (sims, levels)
+        per_churn = 1.0 - reduce_churn + reduce_churn * np.exp(-churn_scale * np.log(CHURN_RR))
+        log_f = np.log(per_gap) @ rows[:, :-1].T + np.outer(np.log(per_churn), rows[:, -1])  # (sims, groups)
+        f = np.exp(log_f)
+
+        base_mean, base_var = s1.sum(), s1.sum() - s2.sum()
+        averted_mean = (1.0 - f) @ s1
+        averted_var = np.maximum(averted_mean - ((1.0 - f) ** 2) @ s2, 0.0)
+        baseline = np.maximum(rng.normal(base_mean, np.sqrt(base_var), n), 0.0)
+        averted = np.clip(rng.normal(averted_mean, np.sqrt(averted_var)), 0.0, baseline)
+        result = {
+            "baseline": baseline,
+            "projected": baseline - averted,
+            "averted": averted,
+            "avoidable_cost": averted * stay_cost,
+        }
+        with self._lock:
+            self._memo[params] = result
+            while len(self._memo) > MEMO_ENTRIES:
+                self._memo.popitem(last=False)
+        return result
+
+    def summary(self, cohort, close_gaps=0.0, reduce_churn=0.0, seed=0):
+        """5th / 50th / 95th percentile of each simulated quantity, one row per quantity."""
+        result = self.simulate(cohort, close_gaps, reduce_churn, seed)
+        return pd.DataFrame({name: np.quantile(values, QUANTILES) for name, values in result.items()},
+                            index=["p5", "median", "p95"]).T
+
+    def sweep(self, cohort, reduce_churn=0.0, quantity="avoidable_cost", seed=0):
+        """Bands of `quantity` across care-gap closure levels 0-100% at a fixed churn reduction."""
+        rows = []
+        for level in SWEEP_LEVELS:
+            p5, median, p95 = np.quantile(self.simulate(cohort, level, reduce_churn, seed)[quantity], QUANTILES)
+            rows.append({"level": round(100 * level), "p5": p5, "median": median, "p95": p95})
+        return pd.DataFrame(rows)
+
+
+def build(store, simulations=DEFAULT_SIMULATIONS, timer=None):
+    """WhatIfSimulator over a store's risk_scores (required), care_gaps and coverage history."""
+    timer = timer or StageTimer()
+    with timer.stage("load"):
+        patients = store.read_table("patients", ["Id", "BIRTHDATE", "GENDER"])
+        scores = store.read_derived("risk_scores")
+        if patients is None or scores is None:
+            return None
+        gaps = store.read_derived(CARE_GAPS)
+        coverage = store.read_derived(COVERAGE_TABLE)
+        encounters = store.read_table("encounters", ["START", "ENCOUNTERCLASS", "TOTAL_CLAIM_COST"])
+        patient_ids = patients.column("Id").combine_chunks()
+        n = len(patient_ids)
+        latest = pc.max(encounters.column("START")).as_py() if encounters is not None else None
+        today = int(np.datetime64(pd.Timestamp(latest or pd.Timestamp.now()).date(), "D").astype("int64"))
+
+    with timer.stage("inputs"):
+        position = patient_codes(patient_ids, scores.column("patient_id"))
+        p = np.zeros(n)
+        p[position[position >= 0]] = scores.column("hospitalization_risk").to_numpy()[position >= 0]
+
+        gap_counts = np.zeros((n, len(GAP_RR)), dtype="int64")
+        if gaps is not None:
+            codes = patient_codes(patient_ids, gaps.column("patient_id"))
+            overdue = gaps.column("overdue").to_numpy(zero_copy_only=False) & (codes >= 0)
+            impact = gaps.column("risk_impact").to_numpy(zero_copy_only=False)
+            for j, level in enumerate(GAP_RR):
+                gap_counts[:, j] = np.bincount(codes[overdue & (impact == level)], minlength=n)
+
+        if coverage is not None:
+            rows = patient_codes(patient_ids, coverage.column("patient_id"))
+            current_payer = np.full(n, "", dtype=object)
+            churned = np.zeros(n, dtype=bool)
+            known = rows >= 0
+            current_payer[rows[known]] = coverage.column("current_payer").to_numpy(zero_copy_only=False)[known]
+            churned[rows[known]] = ((coverage.column("recent_payer_changes").to_numpy() > 0)
+                                    | (coverage.column("coverage_gaps").to_numpy() > 0))[known]
+        else:
+            transitions = store.read_table("payer_transitions", ["PATIENT", "START_YEAR", "END_YEAR", "PAYER"])
+            history, _, _ = coverage_continuity(patient_ids, transitions, today, n)
+            current_payer = history["current_payer"]
+            churned = (history["recent_payer_changes"] > 0) | (history["coverage_gaps"] > 0)
+
+        payers = store.reference("payers")
+        names = dict(zip(payers["Id"], payers["NAME"])) if not payers.empty else {}
+        cohorts = cohort_masks(patients, scores, current_payer, names, today)
+
+        stay_cost, stay_cost_se = 0.0, 0.0
+        if encounters is not None:
+            inpatient = pc.is_in(pc.utf8_lower(encounters.column("ENCOUNTERCLASS")),
+                                 value_set=pa.array(INPATIENT_CLASSES))
+            cost = pc.drop_null(pc.filter(encounters.column("TOTAL_CLAIM_COST"), pc.fill_null(inpatient, False)))
+            cost = cost.to_numpy().astype("float64")
+            if len(cost):
+                stay_cost = float(cost.mean())
+                stay_cost_se = float(cost.std() / np.sqrt(len(cost)))
+
+    logger.info(f"What-if simulator ready for {n:,} patients ({len(cohorts)} cohorts, mean inpatient stay "
+                f"${stay_cost:,.0f}); stage timings (s): {timer.stages}")
+    return WhatIfSimulator(p, gap_counts, churned, cohorts, stay_cost, stay_cost_se, simulations)
+
+
+_simulator = None
+_simulator_version = None
+_simulator_lock = threading.Lock()
+
+
+def get_what_if_simulator(store=None):
+    """Shared WhatIfSimulator, rebuilt when the store or its risk, care-gap or coverage tables change; None without risk scores."""
+    global _simulator, _simulator_version
+    store = store or get_clinical_store()
+    version = (store.root, store.generation) + tuple(
+        store.derived_version(t) for t in ("risk_scores", CARE_GAPS, COVERAGE_TABLE))
+    if version != _simulator_version:
+        with _simulator_lock:
+            if version != _simulator_version:
+                simulations = int(os.getenv("WHATIF_SIMULATIONS", DEFAULT_SIMULATIONS))
+                _simulator = build(store, simulations)
+                _simulator_version = version
+    return _simulator
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run one what-if scenario and print its percentile bands.")
+    parser.add_argument("--store", default=os.getenv("CLINICAL_STORE_DIR", DEFAULT_STORE), help="Clinical store directory")
+    parser.add_argument("--cohort", default="All patients")
+    parser.add_argument("--close-gaps", type=float, default=0.0, help="Share of overdue care gaps closed (0-1)")
+    parser.add_argument("--reduce-churn", type=float, default=0.0, help="Share of churned patients retained (0-1)")
+    parser.add_argument("--simulations", type=int, default=DEFAULT_SIMULATIONS)
+    args = parser.parse_args(argv)
+    simulator = build(ClinicalStore(args.store), args.simulations)
+    if simulator is None:
+        raise SystemExit(f"Store {args.store} has no risk_scores; run utils.risk_engine first")
+    print(simulator.summary(args.cohort, args.close_gaps, args.reduce_churn).round(1).to_string())
+
+
+if __name__ == "__main__":
+    main()